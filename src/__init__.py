@@ -1,7 +1,3 @@
-from message import Message
-from simple_message import SimpleMessage
+from consumers import dict_consumers
 
-dict_consumers = {
-    "simple_message": SimpleMessage,
-    "message": Message,
-}
+__all__ = ["dict_consumers"]
@@ -0,0 +1,266 @@
+import asyncio
+import threading
+import time
+
+import asyncpg
+from botocore.exceptions import ClientError
+
+from config import (
+    ASYNC_CONCURRENCY,
+    ASYNC_WRITERS,
+    BATCH_MAX_ROWS,
+    PIPELINE_QUEUE_SIZE,
+    POLLING_INTERVAL,
+    WAIT_TIME_SECONDS,
+    logger,
+)
+from scripts.aws_connection import AWSConnection
+from scripts.postgres import PostgresClient
+from utils import (
+    build_data_batch,
+    delete_batch_messages_from_queue_async,
+    poll_messages_async,
+)
+from visibility import VisibilityManager
+
+_STOP = object()
+
+
+class AsyncVisibilityManager(VisibilityManager):
+    """
+    VisibilityManager of an aiobotocore client: its SQS calls are coroutines,
+    and its heartbeat is a task of the event loop instead of a thread.
+    """
+
+    async def abandon(self, messages) -> None:
+        self.release(messages)
+        receipt_handles = [message["ReceiptHandle"] for message in messages]
+        await self._change_visibility(receipt_handles, visibility_timeout=0)
+        logger.warning(f"Returned {len(receipt_handles)} messages to the queue.")
+
+    async def _change_visibility(self, receipt_handles, visibility_timeout: int):
+        failed = []
+        for chunk in self._chunks(receipt_handles):
+            try:
+                response = await self.sqs_client.change_message_visibility_batch(
+                    QueueUrl=self.queue_url,
+                    Entries=self._entries(chunk, visibility_timeout),
+                )
+            except ClientError as e:
+                logger.error(f"Error changing message visibility: {e}")
+                failed.extend(chunk)
+                continue
+            failed.extend(self._failures(chunk, response))
+        return failed
+
+    async def extend_due(self) -> int:
+        now = time.monotonic()
+        due = self._due(now)
+        if not due:
+            return 0
+        failed = set(await self._change_visibility(due, self.visibility_timeout))
+        return self._extended(due, failed, now)
+
+    async def heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self.extend_due()
+            except Exception as e:
+                logger.error(f"Error in visibility heartbeat: {e}")
+
+
+class AsyncConsumer:
+    """
+    Consumer running on a single asyncio event loop.
+
+    `concurrency` coroutines long-poll the queue at the same time with an
+    aiobotocore client, and hand their batches to `writers` coroutines
+    through a bounded queue. A writer merges the batches waiting in the
+    queue, up to BATCH_MAX_ROWS messages, builds their rows with the
+    consumer class (`handle_messages`), copies them with asyncpg, then
+    deletes the messages. A failed insert returns its messages to the queue.
+    On `stop`, the pending long polls end and the writers drain the queue.
+    """
+
+    def __init__(
+        self,
+        postgres_client: PostgresClient,
+        sqs_client,
+        pool: asyncpg.Pool,
+        queue_url: str,
+        concurrency: int = ASYNC_CONCURRENCY,
+        writers: int = ASYNC_WRITERS,
+        queue_size: int = PIPELINE_QUEUE_SIZE,
+        wait_time_seconds: int = WAIT_TIME_SECONDS,
+        stop_event=None,
+    ) -> None:
+        self.postgres_client = postgres_client
+        self.sqs_client = sqs_client
+        self.pool = pool
+        self.queue_url = queue_url
+        self.concurrency = concurrency
+        self.writers = writers
+        self.queue_size = queue_size
+        self.wait_time_seconds = wait_time_seconds
+        self.stop_event = stop_event or threading.Event()
+        self.visibility_manager = AsyncVisibilityManager(
+            sqs_client=sqs_client, queue_url=queue_url
+        )
+        self._batches = None
+
+    async def _receive(self) -> None:
+        # On stop, the long poll in progress is not cancelled: its messages
+        # would stay invisible until their visibility timeout
+        while not self.stop_event.is_set():
+            try:
+                messages = await poll_messages_async(
+                    self.sqs_client,
+                    self.queue_url,
+                    wait_time_seconds=self.wait_time_seconds,
+                    visibility_timeout=self.visibility_manager.visibility_timeout,
+                )
+            except ClientError as e:
+                logger.error(f"Error receiving message: {e}")
+                await asyncio.sleep(POLLING_INTERVAL)
+                continue
+            if not messages:
+                logger.info("No messages received.")
+                continue
+            self.visibility_manager.track(messages)
+            try:
+                await self._batches.put(messages)
+            except asyncio.CancelledError:
+                await self.visibility_manager.abandon(messages)
+                raise
+
+    async def _write(self) -> None:
+        while True:
+            messages = await self._batches.get()
+            if messages is _STOP:
+                return
+            stopped = False
+            while len(messages) < BATCH_MAX_ROWS and not self._batches.empty():
+                batch = self._batches.get_nowait()
+                if batch is _STOP:
+                    stopped = True
+                    break
+                messages = messages + batch
+            await self._flush(messages)
+            if stopped:
+                return
+
+    async def _flush(self, messages) -> None:
+        """
+        Insert the rows of the messages in one transaction, then ack them.
+        """
+        client = self.postgres_client
+        try:
+            data_batch = build_data_batch(client, messages)
+            async with self.pool.acquire() as connection:
+                await client.insert_data_async(
+                    connection,
+                    schema_name=client.schema_name,
+                    table_name=client.table_name,
+                    data=data_batch,
+                    columns=client.columns,
+                    strategy="skip",
+                )
+        except BaseException:
+            await self.visibility_manager.abandon(messages)
+            raise
+        await delete_batch_messages_from_queue_async(
+            self.sqs_client, self.queue_url, messages
+        )
+        self.visibility_manager.release(messages)
+
+    async def _wait_for_stop(self) -> None:
+        while not self.stop_event.is_set():
+            await asyncio.sleep(0.5)
+
+    async def _drain(self) -> None:
+        """
+        Return the batches left in the queue by a failure.
+        """
+        while not self._batches.empty():
+            messages = self._batches.get_nowait()
+            if messages is not _STOP:
+                await self.visibility_manager.abandon(messages)
+
+    async def run(self) -> None:
+        """
+        Run the receive and write coroutines until `stop` or until one of
+        them fails.
+        """
+        self._batches = asyncio.Queue(maxsize=self.queue_size)
+        receivers = [
+            asyncio.create_task(self._receive()) for _ in range(self.concurrency)
+        ]
+        writers = [asyncio.create_task(self._write()) for _ in range(self.writers)]
+        heartbeat = asyncio.create_task(self.visibility_manager.heartbeat())
+        stopper = asyncio.create_task(self._wait_for_stop())
+        tasks = [*receivers, *writers, heartbeat, stopper]
+        logger.info(
+            f"Async consumer running {self.concurrency} pollers and "
+            f"{self.writers} writers."
+        )
+        try:
+            done, _ = await asyncio.wait(
+                [*receivers, *writers, stopper], return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                task.result()
+            # Stopped: the receivers end their long poll, then the writers
+            # flush what they received
+            await asyncio.gather(*receivers)
+            for _ in writers:
+                await self._batches.put(_STOP)
+            await asyncio.gather(*writers)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._drain()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+
+async def _run_async_consumer(
+    postgres_client: PostgresClient, queue_url: str, stop_event
+) -> None:
+    # One HTTP connection per concurrent call: the polls, the deletes of the
+    # writers and the visibility heartbeat
+    sqs_context = AWSConnection().create_async_client(
+        "sqs", max_pool_connections=ASYNC_CONCURRENCY + ASYNC_WRITERS + 1
+    )
+    async with (
+        sqs_context as sqs_client,
+        asyncpg.create_pool(
+            dsn=postgres_client.db_uri, min_size=1, max_size=ASYNC_WRITERS
+        ) as pool,
+    ):
+        await AsyncConsumer(
+            postgres_client=postgres_client,
+            sqs_client=sqs_client,
+            pool=pool,
+            queue_url=queue_url,
+            stop_event=stop_event,
+        ).run()
+
+
+def async_consumer(
+    postgres_client: PostgresClient,
+    sqs_client,
+    queue_url: str = None,
+    stop_event=None,
+) -> None:
+    """
+    Run an AsyncConsumer on a new event loop. The blocking `sqs_client` is
+    not used: the loop gets an aiobotocore client from the AWSConnection of
+    the process, and an asyncpg pool of its own.
+    """
+    try:
+        asyncio.run(_run_async_consumer(postgres_client, queue_url, stop_event))
+    except Exception as e:
+        logger.error(f"Error in async consumer: {e}")
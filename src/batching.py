@@ -0,0 +1,183 @@
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from config import (
+    BATCH_MAX_BYTES,
+    BATCH_MAX_LINGER,
+    BATCH_MAX_ROWS,
+    POLLING_INTERVAL,
+    VISIBILITY_SAFETY_MARGIN,
+    VISIBILITY_TIMEOUT,
+    WAIT_TIME_SECONDS,
+    logger,
+)
+from polling import AdaptivePoller
+from scripts.postgres import PostgresClient
+from utils import build_data_batch, delete_batch_messages_from_queue, poll_messages
+from visibility import VisibilityManager
+
+
+class MicroBatcher:
+    """
+    Accumulate rows from several SQS receives and write them in one commit.
+
+    The buffer is flushed when it reaches `max_rows` rows, `max_bytes` bytes of
+    message bodies, or when its oldest message has waited `max_linger` seconds.
+    The linger is capped so that the buffer is always committed and acked
+    `VISIBILITY_SAFETY_MARGIN` seconds before the oldest message becomes
+    visible again. The visibility of the buffered messages is also extended
+    in the background, and they are returned to the queue if the flush fails.
+    """
+
+    def __init__(
+        self,
+        postgres_client: PostgresClient,
+        sqs_client,
+        queue_url: str,
+        max_rows: int = BATCH_MAX_ROWS,
+        max_bytes: int = BATCH_MAX_BYTES,
+        max_linger: float = BATCH_MAX_LINGER,
+        visibility_timeout: int = VISIBILITY_TIMEOUT,
+    ) -> None:
+        if visibility_timeout <= VISIBILITY_SAFETY_MARGIN:
+            raise ValueError(
+                "Visibility timeout must be greater than the safety margin "
+                f"({VISIBILITY_SAFETY_MARGIN}s)."
+            )
+        self.postgres_client = postgres_client
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.visibility_timeout = visibility_timeout
+        self.max_linger = min(max_linger, visibility_timeout - VISIBILITY_SAFETY_MARGIN)
+        self.messages = []
+        self.rows = []
+        self.nb_bytes = 0
+        self.first_received_at = None
+        self.visibility_manager = VisibilityManager(
+            sqs_client=sqs_client,
+            queue_url=queue_url,
+            visibility_timeout=visibility_timeout,
+        )
+
+    def add(self, messages) -> None:
+        """
+        Buffer the rows built from a received batch of messages.
+        """
+        if self.first_received_at is None:
+            self.first_received_at = time.monotonic()
+        self.visibility_manager.track(messages)
+        self.messages.extend(messages)
+        try:
+            self.rows.extend(build_data_batch(self.postgres_client, messages))
+        except Exception:
+            self.visibility_manager.abandon(self.messages)
+            raise
+        self.nb_bytes += sum(len(message["Body"]) for message in messages)
+
+    def remaining_linger(self) -> float:
+        """
+        Seconds left before the buffer has to be flushed.
+        """
+        if self.first_received_at is None:
+            return self.max_linger
+        return self.max_linger - (time.monotonic() - self.first_received_at)
+
+    def should_flush(self) -> bool:
+        if not self.messages:
+            return False
+        return (
+            len(self.rows) >= self.max_rows
+            or self.nb_bytes >= self.max_bytes
+            or self.remaining_linger() <= 0
+        )
+
+    def flush(self) -> None:
+        """
+        Insert every buffered row in one commit, then ack the covered messages.
+        """
+        if not self.messages:
+            return
+        try:
+            self.postgres_client.insert_data(
+                schema_name=self.postgres_client.schema_name,
+                table_name=self.postgres_client.table_name,
+                data=self.rows,
+                columns=self.postgres_client.columns,
+                strategy="skip",
+            )
+        except Exception:
+            self.visibility_manager.abandon(self.messages)
+            raise
+        delete_batch_messages_from_queue(self.sqs_client, self.queue_url, self.messages)
+        self.visibility_manager.release(self.messages)
+        logger.info(
+            f"Flushed {len(self.rows)} rows from {len(self.messages)} messages "
+            f"({self.nb_bytes} bytes)."
+        )
+        self.messages = []
+        self.rows = []
+        self.nb_bytes = 0
+        self.first_received_at = None
+
+    def wait_time_seconds(self, wait_time_seconds: int = WAIT_TIME_SECONDS) -> int:
+        """
+        Long-poll duration that does not overshoot the flush deadline.
+        """
+        if not self.messages:
+            return wait_time_seconds
+        return max(0, min(wait_time_seconds, int(self.remaining_linger())))
+
+    def run(self, stop_event=None) -> None:
+        """
+        Receive and flush until `stop_event` is set, then flush what is left.
+        """
+        stop_event = stop_event or threading.Event()
+        poller = AdaptivePoller()
+        self.visibility_manager.start()
+        try:
+            while not stop_event.is_set():
+                try:
+                    if stop_event.wait(timeout=poller.delay):
+                        break
+                    parameters = poller.receive_parameters()
+                    parameters["wait_time_seconds"] = self.wait_time_seconds(
+                        parameters["wait_time_seconds"]
+                    )
+                    start = time.monotonic()
+                    messages = poll_messages(
+                        self.sqs_client,
+                        self.queue_url,
+                        visibility_timeout=self.visibility_timeout,
+                        **parameters,
+                    )
+                    poller.record(
+                        len(messages),
+                        time.monotonic() - start,
+                        requested_wait=parameters["wait_time_seconds"],
+                    )
+                except ClientError as e:
+                    logger.error(f"Error receiving message: {e}")
+                    time.sleep(POLLING_INTERVAL)
+                    messages = []
+                if messages:
+                    self.add(messages)
+                if self.should_flush():
+                    self.flush()
+            self.flush()
+        finally:
+            self.visibility_manager.stop()
+
+
+def batching_consumer(
+    postgres_client: PostgresClient,
+    sqs_client,
+    queue_url: str = None,
+    stop_event=None,
+) -> None:
+    MicroBatcher(
+        postgres_client=postgres_client, sqs_client=sqs_client, queue_url=queue_url
+    ).run(stop_event=stop_event)
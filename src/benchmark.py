@@ -0,0 +1,339 @@
+import argparse
+import datetime
+import json
+import resource
+import sys
+import time
+
+from config import CONSUMER_NAME, MAX_NUMBER_OF_MESSAGES, POSTGRES_URI, logger
+from consumers import dict_consumers
+from metrics import STAGE_LATENCY, bucket_quantile
+from scripts.aws_queue import Queue
+from scripts.fake_aws import FakeBroker
+from utils import (
+    build_data_batch,
+    percentile,
+    receive_message_from_queue,
+    with_message_id,
+)
+
+BENCHMARK_SCHEMA = "benchmark"
+SCENARIOS = ("handle", "insert", "consume")
+
+
+def generate_body(consumer_name: str, counter: int, payload_size: int) -> str:
+    """
+    SNS message body understood by the handler of `consumer_name`, padded
+    to about `payload_size` bytes.
+    """
+    payload = "x" * payload_size
+    if consumer_name == "message":
+        return json.dumps(
+            {
+                "id": f"benchmark-{counter}",
+                "estimatedStartDate": "2024-01-01T10:00:00",
+                "closedAt": "2024-01-01T10:30:00",
+                "payload": payload,
+            }
+        )
+    return payload
+
+
+def load_queue(
+    broker: FakeBroker,
+    consumer_name,
+    nb_messages,
+    payload_size,
+    raw_message_delivery=False,
+) -> str:
+    """
+    Publish `nb_messages` messages to a fresh topic subscribed by a fresh
+    queue of the fake broker, and return the queue URL.
+    """
+    sns_client, sqs_client = broker.client("sns"), broker.client("sqs")
+    topic_arn = sns_client.create_topic(Name="benchmark")["TopicArn"]
+    queue_url = sqs_client.create_queue(
+        QueueName="benchmark", Attributes={"VisibilityTimeout": "300"}
+    )["QueueUrl"]
+    queue_arn = sqs_client.get_queue_attributes(QueueUrl=queue_url)["Attributes"][
+        "QueueArn"
+    ]
+    sns_client.subscribe(
+        TopicArn=topic_arn,
+        Protocol="sqs",
+        Endpoint=queue_arn,
+        Attributes=Queue.subscription_attributes(raw_message_delivery),
+    )
+    for start in range(0, nb_messages, 10):
+        sns_client.publish_batch(
+            TopicArn=topic_arn,
+            PublishBatchRequestEntries=[
+                {
+                    "Id": str(i),
+                    "Message": generate_body(consumer_name, i, payload_size),
+                    "MessageAttributes": with_message_id(),
+                }
+                for i in range(start, min(nb_messages, start + 10))
+            ],
+        )
+    return queue_url
+
+
+def receive_all(sqs_client, queue_url, batch_size: int) -> list:
+    """
+    Receive every message of a fake queue, grouped by batches of `batch_size`.
+    """
+    messages = []
+    while response := sqs_client.receive_message(
+        QueueUrl=queue_url, MaxNumberOfMessages=MAX_NUMBER_OF_MESSAGES
+    ).get("Messages"):
+        messages.extend(response)
+    return [
+        messages[start : start + batch_size]
+        for start in range(0, len(messages), batch_size)
+    ]
+
+
+def stage_counts() -> dict:
+    """
+    STAGE_LATENCY bucket counts of each stage so far.
+    """
+    return {
+        stage: child.bucket_counts()
+        for (stage,), child in STAGE_LATENCY.children().items()
+    }
+
+
+def stage_latencies(before: dict) -> dict:
+    """
+    Per-stage p50 and p99, estimated from the STAGE_LATENCY buckets filled
+    since the `before` stage_counts.
+    """
+    stages = {}
+    for stage, counts in stage_counts().items():
+        previous = before.get(stage, [0] * len(counts))
+        delta = [count - start for count, start in zip(counts, previous)]
+        if not any(delta):
+            continue
+        stages[stage] = {
+            "count": sum(delta),
+            "p50_ms": round(
+                bucket_quantile(STAGE_LATENCY.buckets, delta, 0.5) * 1000, 3
+            ),
+            "p99_ms": round(
+                bucket_quantile(STAGE_LATENCY.buckets, delta, 0.99) * 1000, 3
+            ),
+        }
+    return stages
+
+
+def summarize(
+    scenario: str, nb_messages: int, elapsed: float, latencies, stages=None
+) -> dict:
+    latencies_ms = [latency * 1000 for latency in latencies]
+    return {
+        "scenario": scenario,
+        "messages": nb_messages,
+        "elapsed_s": round(elapsed, 3),
+        "msgs_per_s": round(nb_messages / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies_ms, 50) or 0, 3),
+        "p99_ms": round(percentile(latencies_ms, 99) or 0, 3),
+        # ru_maxrss is in kilobytes on Linux, the peak of the whole process
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+        # Latency of the consumer stages run by the scenario, from /metrics
+        "stages": stages or {},
+    }
+
+
+def timed(function, batches) -> tuple:
+    """
+    Run `function` on each batch: elapsed time, per-call latencies and
+    per-stage latencies.
+    """
+    latencies = []
+    before = stage_counts()
+    start = time.perf_counter()
+    for batch in batches:
+        call_start = time.perf_counter()
+        function(batch)
+        latencies.append(time.perf_counter() - call_start)
+    return time.perf_counter() - start, latencies, stage_latencies(before)
+
+
+def run_benchmark(
+    consumer_name: str = CONSUMER_NAME,
+    nb_messages: int = 10000,
+    payload_size: int = 100,
+    raw_message_delivery: bool = False,
+    batch_size: int = MAX_NUMBER_OF_MESSAGES,
+    scenarios=SCENARIOS,
+    db_uri: str = POSTGRES_URI,
+) -> dict:
+    """
+    Benchmark the consume path of `consumer_name` and return its results.
+
+    - handle: SQS messages to rows, `build_data_batch` per batch.
+    - insert: `insert_data` per batch of rows.
+    - consume: `receive_message_from_queue` per call, against the in-process
+      SQS stand-in, so the AWS network is out of the measure.
+
+    Rows are written to a dedicated `benchmark` schema, dropped at the end.
+    """
+    postgres_client = dict_consumers[consumer_name](db_uri=db_uri)
+    # Keep the benchmark rows away from the consumer table
+    postgres_client.schema_name = BENCHMARK_SCHEMA
+    # get_or_create_table replaces the column definitions by the column names
+    column_definitions = dict(postgres_client.columns)
+    results = []
+
+    def reset_table():
+        postgres_client.delete_table(
+            schema_name=BENCHMARK_SCHEMA, table_name=postgres_client.table_name
+        )
+        postgres_client.get_or_create_table(
+            schema_name=BENCHMARK_SCHEMA,
+            table_name=postgres_client.table_name,
+            columns=column_definitions,
+        )
+
+    def insert(data_batch):
+        postgres_client.insert_data(
+            schema_name=BENCHMARK_SCHEMA,
+            table_name=postgres_client.table_name,
+            data=data_batch,
+            columns=list(column_definitions),
+            strategy="skip",
+        )
+
+    try:
+        if "handle" in scenarios or "insert" in scenarios:
+            broker = FakeBroker()
+            queue_url = load_queue(
+                broker, consumer_name, nb_messages, payload_size, raw_message_delivery
+            )
+            batches = receive_all(broker.client("sqs"), queue_url, batch_size)
+            elapsed, latencies, stages = timed(
+                lambda batch: build_data_batch(
+                    postgres_client, batch, raw_message_delivery
+                ),
+                batches,
+            )
+            if "handle" in scenarios:
+                results.append(
+                    summarize("handle", nb_messages, elapsed, latencies, stages)
+                )
+            if "insert" in scenarios:
+                reset_table()
+                data_batches = [
+                    build_data_batch(postgres_client, batch, raw_message_delivery)
+                    for batch in batches
+                ]
+                elapsed, latencies, stages = timed(insert, data_batches)
+                results.append(
+                    summarize("insert", nb_messages, elapsed, latencies, stages)
+                )
+
+        if "consume" in scenarios:
+            reset_table()
+            broker = FakeBroker()
+            sqs_client = broker.client("sqs")
+            queue_url = load_queue(
+                broker, consumer_name, nb_messages, payload_size, raw_message_delivery
+            )
+            latencies, nb_received = [], 0
+            before = stage_counts()
+            start = time.perf_counter()
+            while nb_received < nb_messages:
+                call_start = time.perf_counter()
+                messages = receive_message_from_queue(
+                    postgres_client=postgres_client,
+                    schema_name=BENCHMARK_SCHEMA,
+                    table_name=postgres_client.table_name,
+                    sqs_client=sqs_client,
+                    queue_url=queue_url,
+                    columns=list(column_definitions),
+                    max_number_of_messages=min(batch_size, MAX_NUMBER_OF_MESSAGES),
+                    wait_time_seconds=0,
+                    raw_message_delivery=raw_message_delivery,
+                )
+                latencies.append(time.perf_counter() - call_start)
+                if not messages:
+                    break
+                nb_received += len(messages)
+            elapsed = time.perf_counter() - start
+            results.append(
+                summarize(
+                    "consume", nb_received, elapsed, latencies, stage_latencies(before)
+                )
+            )
+    finally:
+        postgres_client.execute_query(
+            f"DROP SCHEMA IF EXISTS {BENCHMARK_SCHEMA} CASCADE;"
+        )
+        postgres_client.close()
+
+    return {
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "parameters": {
+            "consumer": consumer_name,
+            "messages": nb_messages,
+            "payload_size": payload_size,
+            "raw_message_delivery": raw_message_delivery,
+            "batch_size": batch_size,
+        },
+        "results": results,
+    }
+
+
+def compare(report: dict, baseline: dict) -> list:
+    """
+    Throughput ratio of each scenario against a previous report.
+    """
+    baseline_results = {result["scenario"]: result for result in baseline["results"]}
+    lines = []
+    for result in report["results"]:
+        previous = baseline_results.get(result["scenario"])
+        if previous is None or not previous["msgs_per_s"]:
+            continue
+        ratio = result["msgs_per_s"] / previous["msgs_per_s"]
+        lines.append(
+            f"{result['scenario']}: {previous['msgs_per_s']} -> "
+            f"{result['msgs_per_s']} msgs/s (x{ratio:.2f})"
+        )
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the consume path.")
+    parser.add_argument("--consumer", default=CONSUMER_NAME, choices=dict_consumers)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--payload-size", type=int, default=100)
+    parser.add_argument("--raw-delivery", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=MAX_NUMBER_OF_MESSAGES)
+    parser.add_argument("--scenario", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    # The per-message INFO logs would otherwise flood the terminal
+    logger.remove(0)
+    logger.add(sys.stderr, level=args.log_level)
+
+    report = run_benchmark(
+        consumer_name=args.consumer,
+        nb_messages=args.messages,
+        payload_size=args.payload_size,
+        raw_message_delivery=args.raw_delivery,
+        batch_size=args.batch_size,
+        scenarios=args.scenario,
+    )
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.compare:
+        with open(args.compare, "r") as file:
+            print("\n".join(compare(report, json.load(file))))
@@ -0,0 +1,116 @@
+# JSON codec of the consumers: the fastest installed library among orjson,
+# ujson and the standard json module
+from config import RAW_MESSAGE_DELIVERY
+
+# Message attribute set by our producers with an ID of their own: with raw
+# message delivery, SQS bodies do not hold the SNS MessageId any more
+MESSAGE_ID_ATTRIBUTE = "message_id"
+
+try:
+    import orjson
+
+    BACKEND = "orjson"
+
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(obj) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+
+except ImportError:
+    try:
+        import ujson
+
+        BACKEND = "ujson"
+
+        def loads(data):
+            return ujson.loads(data)
+
+        def dumps(obj) -> str:
+            return ujson.dumps(obj, ensure_ascii=False)
+
+    except ImportError:
+        import json
+
+        BACKEND = "json"
+
+        def loads(data):
+            return json.loads(data)
+
+        def dumps(obj) -> str:
+            return json.dumps(obj, ensure_ascii=False)
+
+
+# Consumer decodes: a bare backend call, timed once per batch by the caller
+decode = loads
+
+
+class LazyBody:
+    """
+    SQS message body decoded on first access to one of its fields.
+    `raw` keeps the undecoded text, so a consumer reading only the raw body
+    never pays for the JSON decode.
+    """
+
+    __slots__ = ("raw", "_document")
+
+    def __init__(self, raw) -> None:
+        self.raw = raw
+        self._document = None
+
+    def document(self) -> dict:
+        if self._document is None:
+            self._document = decode(self.raw)
+        return self._document
+
+    def get(self, key, default=None):
+        return self.document().get(key, default)
+
+    def __getitem__(self, key):
+        return self.document()[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self.document()
+
+
+class SNSBody(LazyBody):
+    """
+    Body of an SQS message fed by an SNS subscription, with or without raw
+    message delivery, as set by RAW_MESSAGE_DELIVERY. A raw delivery is
+    exposed like an SNS envelope, so handlers read "MessageId", "Message"
+    and "MessageAttributes" either way, and its "Message" text is only
+    decoded if a handler reads inside it.
+    The "MessageId" of a raw delivery is the MESSAGE_ID_ATTRIBUTE attribute
+    set by the producer, the same for every delivery of a publish. Without
+    it, it falls back to the SQS MessageId, which differs between the
+    duplicate deliveries SNS may make.
+    """
+
+    __slots__ = ("message", "raw_message_delivery")
+
+    def __init__(
+        self, message: dict, raw_message_delivery: bool = RAW_MESSAGE_DELIVERY
+    ) -> None:
+        super().__init__(message["Body"])
+        self.message = message
+        self.raw_message_delivery = raw_message_delivery
+
+    def document(self) -> dict:
+        if self._document is None:
+            if self.raw_message_delivery:
+                self._document = self._raw_envelope()
+            else:
+                self._document = decode(self.raw)
+        return self._document
+
+    def _raw_envelope(self) -> dict:
+        attributes = {
+            name: {"Type": value["DataType"], "Value": value.get("StringValue")}
+            for name, value in self.message.get("MessageAttributes", {}).items()
+        }
+        message_id = attributes.get(MESSAGE_ID_ATTRIBUTE, {}).get("Value")
+        return {
+            "MessageId": message_id or self.message.get("MessageId"),
+            "Message": self.raw,
+            "MessageAttributes": attributes,
+        }
@@ -18,12 +18,62 @@ SESSION_NAME = os.getenv("SESSION_NAME")
 TOPIC_NAME = os.getenv("TOPIC_NAME")
 TOPIC_ARN = os.getenv("TOPIC_ARN")
 QUEUE_NAME = os.getenv("QUEUE_NAME")
+# Resources created by initialize_aws_setup, verified instead of set up again
+AWS_MANIFEST_PATH = os.getenv("AWS_MANIFEST_PATH", ".aws_manifest.json")
+# Assumed-role credentials are renewed this many seconds before they expire
+CREDENTIALS_REFRESH_MARGIN = int(os.getenv("CREDENTIALS_REFRESH_MARGIN", "600"))
 
 # AWS QUEUE SETTINGS #
 POLLING_INTERVAL = 1
 MAX_NUMBER_OF_MESSAGES = 10
 VISIBILITY_TIMEOUT = 30
 WAIT_TIME_SECONDS = 20
+# Long-poll wait used while the queue is backed up, see polling.AdaptivePoller
+ADAPTIVE_MIN_WAIT_TIME_SECONDS = 1
+# Seconds kept before the visibility deadline to commit and ack buffered messages
+VISIBILITY_SAFETY_MARGIN = 10
+# Seconds between two checks for in-flight messages to extend
+VISIBILITY_HEARTBEAT_INTERVAL = 5
+# Seconds to wait for a new queue to be served, see Queue.wait_until_ready
+QUEUE_READY_TIMEOUT = 10
+# Deliver the published message as the SQS body, without the SNS envelope
+RAW_MESSAGE_DELIVERY = int(os.getenv("RAW_MESSAGE_DELIVERY", "0"))
+# SNS filter policy on message attributes, as JSON, e.g. {"type": ["order"]}
+SUBSCRIPTION_FILTER_POLICY = os.getenv("SUBSCRIPTION_FILTER_POLICY")
+
+# AWS TOPIC SETTINGS #
+PUBLISH_BATCH_SIZE = 10  # maximum entries per PublishBatch call
+PUBLISH_BATCH_MAX_BYTES = 256 * 1024  # maximum payload per PublishBatch call
+PUBLISH_MAX_RETRIES = 3
+PUBLISH_MAX_LINGER = float(os.getenv("PUBLISH_MAX_LINGER", "0.05"))
+
+# PRODUCER SETTINGS #
+PRODUCER_RATE = float(os.getenv("PRODUCER_RATE", "100"))  # messages per second
+PRODUCER_MAX_IN_FLIGHT = int(os.getenv("PRODUCER_MAX_IN_FLIGHT", "50"))
+PRODUCER_THREADS = int(os.getenv("PRODUCER_THREADS", "16"))
+
+# CONSUMER WORKERS SETTINGS #
+NUM_WORKERS = int(os.getenv("NUM_WORKERS", "1"))
+WORKER_MODE = os.getenv("WORKER_MODE", "thread")  # "thread" or "process"
+# "loop", "pipeline", "batch" or "async"
+CONSUMER_MODE = os.getenv("CONSUMER_MODE", "loop")
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))
+
+# MICRO-BATCHING SETTINGS #
+BATCH_MAX_ROWS = int(os.getenv("BATCH_MAX_ROWS", "500"))
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", str(5 * 1024 * 1024)))
+BATCH_MAX_LINGER = float(os.getenv("BATCH_MAX_LINGER", "5"))
+
+# ASYNC CONSUMER SETTINGS #
+ASYNC_CONCURRENCY = int(os.getenv("ASYNC_CONCURRENCY", "10"))  # concurrent polls
+ASYNC_WRITERS = int(os.getenv("ASYNC_WRITERS", "2"))  # asyncpg connections
+
+# AWS CLIENT SETTINGS #
+# HTTP connections per cached boto3 client, enough for the threads sharing it
+_POOL_CONNECTIONS = max(10, 2 * NUM_WORKERS, PRODUCER_THREADS)
+AWS_MAX_POOL_CONNECTIONS = int(
+    os.getenv("AWS_MAX_POOL_CONNECTIONS", str(_POOL_CONNECTIONS))
+)
 
 # ENV & DEBUG #
 ENV = os.getenv("ENV")
@@ -40,3 +90,40 @@ logger.add(
 
 # POSTGRES SETTINGS #
 POSTGRES_URI = os.getenv("POSTGRES_URI")
+# Batches with at least this many rows are loaded through COPY FROM STDIN,
+# smaller ones through a multi-row INSERT ... VALUES
+COPY_MIN_ROWS = int(os.getenv("COPY_MIN_ROWS", "1000"))
+# Rows older than this many days are deleted by /cleanup
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "14"))
+# New consumer tables are partitioned by day of their delete column, and
+# retention drops whole partitions; daily partitions are created ahead of time
+PARTITION_BY_DAY = os.getenv("PARTITION_BY_DAY", "0") == "1"
+PARTITION_PREMAKE_DAYS = int(os.getenv("PARTITION_PREMAKE_DAYS", "3"))
+
+# RETENTION SCHEDULER SETTINGS #
+# Seconds between two retention runs of the service, 0 disables them
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "3600"))
+# Expired rows deleted per transaction
+RETENTION_CHUNK_SIZE = int(os.getenv("RETENTION_CHUNK_SIZE", "5000"))
+# Seconds between two chunks, doubled up to RETENTION_MAX_PAUSE while the
+# mean insert_data latency is above RETENTION_INSERT_LATENCY_TARGET seconds
+RETENTION_CHUNK_PAUSE = float(os.getenv("RETENTION_CHUNK_PAUSE", "0.1"))
+RETENTION_MAX_PAUSE = float(os.getenv("RETENTION_MAX_PAUSE", "10"))
+RETENTION_INSERT_LATENCY_TARGET = float(
+    os.getenv("RETENTION_INSERT_LATENCY_TARGET", "0.25")
+)
+
+# AGGREGATE CACHE SETTINGS #
+# /aggregate results are served from memory for this many seconds, or until
+# the consumer inserts or deletes rows; 0 disables the cache
+AGGREGATE_CACHE_TTL = float(os.getenv("AGGREGATE_CACHE_TTL", "5"))
+AGGREGATE_CACHE_SIZE = int(os.getenv("AGGREGATE_CACHE_SIZE", "128"))
+
+# POSTGRES POOL SETTINGS #
+POSTGRES_POOL_MIN_SIZE = int(os.getenv("POSTGRES_POOL_MIN_SIZE", "1"))
+# Enough for every consumer worker, the gunicorn request threads (4) and the
+# retention scheduler (2: its advisory lock plus the chunk being deleted)
+POSTGRES_POOL_MAX_SIZE = int(os.getenv("POSTGRES_POOL_MAX_SIZE", str(NUM_WORKERS + 6)))
+POSTGRES_POOL_MAX_IDLE = float(os.getenv("POSTGRES_POOL_MAX_IDLE", "300"))
+POSTGRES_POOL_HEALTH_CHECK_AFTER = 30  # ping connections idle for longer, seconds
+POSTGRES_POOL_CHECKOUT_TIMEOUT = 30  # seconds to wait for a free connection
@@ -0,0 +1,8 @@
+from message import Message
+from simple_message import SimpleMessage
+
+# Consumer classes by CONSUMER_NAME
+dict_consumers = {
+    "simple_message": SimpleMessage,
+    "message": Message,
+}
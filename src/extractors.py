@@ -0,0 +1,105 @@
+import datetime
+import uuid
+
+from codec import decode
+
+
+def to_string(value):
+    return None if value is None else str(value)
+
+
+def to_integer(value):
+    return None if value is None else int(value)
+
+
+def to_uuid(value):
+    """
+    Canonical text form of a UUID, rejects malformed ones.
+    """
+    return None if value is None else str(uuid.UUID(str(value)))
+
+
+def to_timestamp(value):
+    """
+    ISO 8601 string to a naive UTC datetime, for TIMESTAMP columns.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        # fromisoformat does not read the "Z" suffix before Python 3.11
+        value = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class Field:
+    """
+    Column read from a dotted JSON `path` of the SNS message body, then
+    converted by `converter`. JSON strings met along the path (like the SNS
+    `Message`) are decoded. A field without path holds the time at which the
+    batch was handled, in naive UTC.
+    """
+
+    def __init__(self, path: str = None, converter=None) -> None:
+        self.path = tuple(path.split(".")) if path else None
+        self.converter = converter
+
+
+RECEIVED_AT = Field()
+# Time at which SNS accepted the message, the same for all its deliveries. Only
+# the SNS envelope holds it, not a raw delivery
+PUBLISHED_AT = Field("Timestamp", to_timestamp)
+
+
+def _document(value):
+    if isinstance(value, (str, bytes)):
+        return decode(value)
+    return value if value is not None else {}
+
+
+def compile_extractor(fields: dict):
+    """
+    Compile a {column: Field} mapping into `extract(message_bodies,
+    received_at) -> rows`, with rows in the order of the mapping.
+
+    The generated function loops once over the batch, and decodes every
+    nested JSON document once per message however many columns read it.
+    """
+    namespace = {"_document": _document}
+    documents = {(): "body"}  # path prefix -> local variable
+    lines = []
+    values = []
+
+    def document(prefix) -> str:
+        if prefix not in documents:
+            parent = document(prefix[:-1])
+            name = f"document_{len(documents)}"
+            documents[prefix] = name
+            lines.append(f"        {name} = _document({parent}.get({prefix[-1]!r}))")
+        return documents[prefix]
+
+    for index, (column, field) in enumerate(fields.items()):
+        if field.path is None:
+            value = "received_at"
+        else:
+            parent = document(field.path[:-1])
+            value = f"{parent}.get({field.path[-1]!r})"
+        if field.converter is not None:
+            namespace[f"convert_{index}"] = field.converter
+            value = f"convert_{index}({value})"
+        values.append(value)
+
+    source = "\n".join(
+        [
+            "def extract(message_bodies, received_at):",
+            "    rows = []",
+            "    append = rows.append",
+            "    for body in message_bodies:",
+            *lines,
+            f"        append(({', '.join(values)},))",
+            "    return rows",
+        ]
+    )
+    exec(compile(source, "<extractor>", "exec"), namespace)
+    return namespace["extract"]
@@ -1,9 +1,12 @@
+import functools
 import threading
 
-from flask import Flask
+from flask import Flask, Response
 
-from config import CONSUMER_NAME, POSTGRES_URI, logger
-from queue_listener import consumer, initialize_consumer
+from config import CONSUMER_NAME, NUM_WORKERS, POSTGRES_URI, logger
+from metrics import CONSUMER_ALIVE, REGISTRY
+from queue_listener import consumer_pool, get_consumer, initialize_consumer
+from retention import RetentionScheduler
 from src import dict_consumers
 
 
@@ -13,9 +16,15 @@ def start_consumer(consumer_class):
         postgres_client, sqs_client, queue_url = initialize_consumer(
             postgres=consumer_class
         )
-        consumer(
-            postgres_client=postgres_client, sqs_client=sqs_client, queue_url=queue_url
-        )
+        if NUM_WORKERS > 1:
+            postgres_client.close()
+            consumer_pool(postgres=consumer_class, queue_url=queue_url)
+        else:
+            get_consumer()(
+                postgres_client=postgres_client,
+                sqs_client=sqs_client,
+                queue_url=queue_url,
+            )
         return {"status": "ok", "message": "Consumer initialized and running."}
     except Exception as e:
         return [{"server-status": f"error: {e}"}]
@@ -26,15 +35,26 @@ def create_app():
 
     consumer_class = dict_consumers.get(CONSUMER_NAME)
 
+    @functools.lru_cache(maxsize=None)
+    def get_client():
+        """
+        Client shared by every request, its queries run on pooled connections.
+        """
+        return consumer_class(db_uri=POSTGRES_URI)
+
     @app.route("/_healthz")
     def health_check():
         return [{"status": "ok", "message": "Flask app is running."}]
 
+    @app.route("/metrics")
+    def metrics():
+        return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
     @app.route("/aggregate")
     def aggregate():
         try:
             if hasattr(consumer_class, "aggregate"):
-                client = consumer_class(db_uri=POSTGRES_URI)
+                client = get_client()
                 data = client.aggregate()
                 return data
             else:
@@ -45,7 +65,7 @@ def create_app():
     @app.route("/cleanup")
     def cleanup():
         try:
-            client = consumer_class(db_uri=POSTGRES_URI)
+            client = get_client()
             client.delete_data(
                 schema_name=client.schema_name,
                 table_name=client.table_name,
@@ -60,6 +80,10 @@ def create_app():
         target=start_consumer, args=(consumer_class,), daemon=True
     )
     consumer_thread.start()
+    CONSUMER_ALIVE.set_function(lambda: int(consumer_thread.is_alive()))
+
+    # Delete the expired rows by small chunks every RETENTION_INTERVAL seconds
+    RetentionScheduler(consumer_class, db_uri=POSTGRES_URI).start()
 
     return app
 
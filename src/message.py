@@ -1,8 +1,10 @@
-import datetime
-import json
+from config import DIRECTORY_PATH, PARTITION_BY_DAY, RAW_MESSAGE_DELIVERY
+from extractors import PUBLISHED_AT, RECEIVED_AT, Field, to_string, to_timestamp
+from result_cache import cached_result
+from scripts.postgres import Index, PostgresClient
 
-from config import DIRECTORY_PATH
-from scripts.postgres import PostgresClient
+with open(f"{DIRECTORY_PATH}/queries/aggregate_message.sql", "r") as file:
+    AGGREGATE_QUERY = file.read()
 
 
 class Message(PostgresClient):
@@ -12,30 +14,31 @@ class Message(PostgresClient):
         self.table_name = "messages"
         self.primary_key = "consultation_id"
         self.delete_column = "inserted_utc_at"
+        self.indexes = [Index("inserted_utc_at", method="brin")]
+        # Counted per minute by /aggregate
+        self.rollup_column = "closed_utc_at"
         self.columns = {
             "consultation_id": "VARCHAR PRIMARY KEY",
             "inserted_utc_at": "TIMESTAMP",
             "estimated_start_utc_at": "TIMESTAMP",
             "closed_utc_at": "TIMESTAMP",
         }
+        # "Message" holds the JSON document published to the topic
+        self.fields = {
+            "consultation_id": Field("Message.id", to_string),
+            "inserted_utc_at": RECEIVED_AT,
+            "estimated_start_utc_at": Field("Message.estimatedStartDate", to_timestamp),
+            "closed_utc_at": Field("Message.closedAt", to_timestamp),
+        }
 
-    def handle_message(self, message_body) -> None:
-        """
-        Handle the message received from SQS.
-        """
-        dict_message = json.loads(message_body.get("Message"))
-
-        data = [
-            (
-                dict_message.get("id"),
-                datetime.datetime.now().isoformat(),
-                dict_message.get("estimatedStartDate"),
-                dict_message.get("closedAt"),
-            )
-        ]
-        return data
+        if PARTITION_BY_DAY:
+            if RAW_MESSAGE_DELIVERY:
+                raise ValueError("PARTITION_BY_DAY needs the SNS envelope.")
+            # The partition column is part of the primary key: duplicate
+            # deliveries must share it, their receive time differs
+            self.partition_column = self.delete_column
+            self.fields[self.delete_column] = PUBLISHED_AT
 
+    @cached_result()
     def aggregate(self):
-        with open(f"{DIRECTORY_PATH}/queries/aggregate_message.sql", "r") as file:
-            query = file.read()
-        return self.execute_query(query=query)
+        return self.execute_query(query=AGGREGATE_QUERY)
@@ -0,0 +1,313 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Down to 0.1 ms: decoding and handling a batch take well under 5 ms
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    20,
+    30,
+)
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in labels)
+    return "{" + pairs + "}"
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    Base class of the metrics: a metric holds one child per set of label
+    values, created on first use.
+    """
+
+    type_name = None
+
+    def __init__(self, name: str, documentation: str, label_names=()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.label_names:
+            # Metrics without labels are exposed even before their first use
+            self._children[()] = self._new_child()
+
+    def labels(self, **labels):
+        key = tuple((name, str(labels[name])) for name in self.label_names)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _default(self):
+        return self._children[()]
+
+    def children(self) -> dict:
+        """
+        {label values: child} of the children used so far.
+        """
+        return {
+            tuple(value for _, value in labels): child
+            for labels, child in list(self._children.items())
+        }
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> list:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        for labels, child in list(self._children.items()):
+            lines.extend(child.render(self.name, labels))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self) -> None:
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, labels) -> list:
+        return [f"{name}{_format_labels(labels)} {_format_value(self.value)}"]
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1) -> None:
+        self._default().inc(amount)
+
+
+class _GaugeChild:
+    def __init__(self) -> None:
+        self.value = 0
+        self.function = None
+
+    def set(self, value) -> None:
+        self.value = value
+
+    def set_to_current_time(self) -> None:
+        self.value = time.time()
+
+    def set_function(self, function) -> None:
+        """
+        Compute the value with `function` each time the metric is rendered.
+        """
+        self.function = function
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+    def render(self, name, labels) -> list:
+        return [f"{name}{_format_labels(labels)} {_format_value(self.get())}"]
+
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value) -> None:
+        self._default().set(value)
+
+    def set_to_current_time(self) -> None:
+        self._default().set_to_current_time()
+
+    def set_function(self, function) -> None:
+        self._default().set_function(function)
+
+    def get(self):
+        return self._default().get()
+
+
+class _HistogramChild:
+    def __init__(self, buckets) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def totals(self) -> tuple:
+        """
+        Sum and count of the observations so far.
+        """
+        with self._lock:
+            return self.sum, self.count
+
+    def bucket_counts(self) -> list:
+        """
+        Observations per bucket so far, the last one being +Inf.
+        """
+        with self._lock:
+            return list(self.counts)
+
+    def render(self, name, labels) -> list:
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip((*self.buckets, float("inf")), counts):
+            cumulative += bucket_count
+            bucket_labels = (*labels, ("le", _format_value(bound)))
+            lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+def bucket_quantile(buckets, counts, quantile: float):
+    """
+    Estimate a quantile from per-bucket counts like Prometheus'
+    histogram_quantile: linear interpolation inside the bucket holding it,
+    the highest bound for the +Inf one. None without observations.
+    """
+    total = sum(counts)
+    if not total:
+        return None
+    rank = quantile * total
+    cumulative, lower = 0, 0.0
+    for bound, count in zip(buckets, counts):
+        if count and cumulative + count >= rank:
+            return lower + (bound - lower) * (rank - cumulative) / count
+        cumulative += count
+        lower = bound
+    return buckets[-1]
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, label_names=(), buckets=LATENCY_BUCKETS
+    ) -> None:
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, label_names)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value) -> None:
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+MESSAGES_RECEIVED = REGISTRY.register(
+    Counter("consumer_messages_received_total", "Messages received from SQS.")
+)
+ROWS_INSERTED = REGISTRY.register(
+    Counter("consumer_rows_inserted_total", "Rows sent to Postgres by insert_data.")
+)
+MESSAGES_DELETED = REGISTRY.register(
+    Counter("consumer_messages_deleted_total", "Messages deleted from SQS.")
+)
+DELETE_FAILURES = REGISTRY.register(
+    Counter(
+        "consumer_delete_failed_entries_total",
+        "Entries rejected by delete_message_batch.",
+    )
+)
+BATCH_SIZE = REGISTRY.register(
+    Histogram(
+        "consumer_batch_size",
+        "Messages per SQS receive and rows per insert.",
+        label_names=("operation",),
+        buckets=BATCH_SIZE_BUCKETS,
+    )
+)
+STAGE_LATENCY = REGISTRY.register(
+    Histogram(
+        "consumer_stage_latency_seconds",
+        "Seconds spent per batch in each consumer stage.",
+        label_names=("stage",),
+    )
+)
+RETENTION_ROWS_DELETED = REGISTRY.register(
+    Counter(
+        "retention_rows_deleted_total",
+        "Expired rows deleted by the retention scheduler.",
+    )
+)
+CONSUMER_HEARTBEAT = REGISTRY.register(
+    Gauge(
+        "consumer_last_poll_timestamp_seconds",
+        "Unix time of the last SQS receive issued by the consumer.",
+    )
+)
+CONSUMER_ALIVE = REGISTRY.register(
+    Gauge("consumer_thread_alive", "1 if the consumer thread is running.")
+)
@@ -1,21 +1,24 @@
-import random
-import time
+import argparse
+import itertools
 
 from config import (
     AWS_ARN_ROLE_CONSUMER,
     POSTGRES_URI,
+    PRODUCER_MAX_IN_FLIGHT,
+    PRODUCER_RATE,
+    PRODUCER_THREADS,
+    PUBLISH_MAX_LINGER,
     QUEUE_NAME,
     SESSION_NAME,
     TOPIC_NAME,
-    logger,
 )
+from producer_engine import ProducerEngine
 from scripts.postgres import PostgresClient
 from setup import (
     initialize_aws_setup,
     initialize_postgres_client,
 )
 from simple_message import SimpleMessage
-from utils import send_message_to_topic
 
 
 def initialize_producer(
@@ -43,27 +46,64 @@ def initialize_producer(
     return postgres_client, sns_client, topic_arn
 
 
-def producer(sns_client, topic_arn) -> None:
-    try:
-        counter = 1
-        while counter < 100:
-            message_body = f"Test message number: {counter}"
-            subject = "Test Subject"
-            message_attributes = {
+def generate_messages():
+    """
+    Endless stream of test messages.
+    """
+    for counter in itertools.count(1):
+        yield {
+            "message_body": f"Test message number: {counter}",
+            "subject": "Test Subject",
+            "message_attributes": {
                 "AttributeKey": {"DataType": "String", "StringValue": "AttributeValue"}
-            }
-            send_message_to_topic(
-                sns_client, topic_arn, message_body, subject, message_attributes
-            )
-            counter += 1
+            },
+        }
 
-            if counter % 20 == 0:
-                logger.info(f"Sent {counter} messages, sleeping for a while...")
-                time.sleep(random.randint(1, 20))
-    except Exception as e:
-        logger.error(f"Error sending message to topic: {e}")
+
+def producer(
+    sns_client,
+    topic_arn,
+    nb_messages: int = 100,
+    rate: float = PRODUCER_RATE,
+    max_in_flight: int = PRODUCER_MAX_IN_FLIGHT,
+    num_threads: int = PRODUCER_THREADS,
+    batch_size: int = 1,
+    max_linger: float = PUBLISH_MAX_LINGER,
+) -> dict:
+    """
+    Publish `nb_messages` test messages at `rate` messages per second and
+    return the achieved throughput and publish latencies.
+    """
+    engine = ProducerEngine(
+        sns_client=sns_client,
+        topic_arn=topic_arn,
+        rate=rate,
+        max_in_flight=max_in_flight,
+        num_threads=num_threads,
+        batch_size=batch_size,
+        max_linger=max_linger,
+    )
+    return engine.run(generate_messages(), nb_messages=nb_messages)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Publish test messages to SNS.")
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=PRODUCER_RATE)
+    parser.add_argument("--max-in-flight", type=int, default=PRODUCER_MAX_IN_FLIGHT)
+    parser.add_argument("--threads", type=int, default=PRODUCER_THREADS)
+    parser.add_argument("--batch-size", type=int, default=1, choices=range(1, 11))
+    parser.add_argument("--max-linger", type=float, default=PUBLISH_MAX_LINGER)
+    args = parser.parse_args()
+
     _, sns_client, topic_arn = initialize_producer(postgres=SimpleMessage)
-    producer(sns_client=sns_client, topic_arn=topic_arn)
+    producer(
+        sns_client=sns_client,
+        topic_arn=topic_arn,
+        nb_messages=args.messages,
+        rate=args.rate,
+        max_in_flight=args.max_in_flight,
+        num_threads=args.threads,
+        batch_size=args.batch_size,
+        max_linger=args.max_linger,
+    )
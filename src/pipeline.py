@@ -0,0 +1,208 @@
+import queue
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from config import PIPELINE_QUEUE_SIZE, POLLING_INTERVAL, logger
+from polling import AdaptivePoller
+from scripts.postgres import PostgresClient
+from utils import build_data_batch, delete_batch_messages_from_queue
+from visibility import VisibilityManager
+
+_STOP = object()
+
+
+class ConsumerPipeline:
+    """
+    Consumer split into receive / transform / insert / delete stages.
+
+    Each stage runs in its own thread and the stages are joined by bounded
+    queues: the next long poll is already in flight while the previous batch
+    is written to Postgres and acked, and a slow stage blocks the earlier ones
+    once its input queue is full.
+    """
+
+    def __init__(
+        self,
+        postgres_client: PostgresClient,
+        sqs_client,
+        queue_url: str,
+        queue_size: int = PIPELINE_QUEUE_SIZE,
+        stop_event=None,
+    ) -> None:
+        self.postgres_client = postgres_client
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+        self.transform_queue = queue.Queue(maxsize=queue_size)
+        self.insert_queue = queue.Queue(maxsize=queue_size)
+        self.delete_queue = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        # Set by the worker pool: stops this pipeline, while a failed stage
+        # only stops its own pipeline
+        self.shutdown_event = stop_event
+        self.visibility_manager = VisibilityManager(
+            sqs_client=sqs_client, queue_url=queue_url
+        )
+
+    def _put(self, stage_queue: queue.Queue, item) -> bool:
+        """
+        Block until the item fits in the queue, unless the pipeline is stopping.
+        """
+        while not self.stop_event.is_set():
+            try:
+                stage_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, stage_queue: queue.Queue):
+        """
+        Block until an item is available, unless the pipeline is stopping.
+        """
+        while not self.stop_event.is_set():
+            try:
+                return stage_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return _STOP
+
+    def _receive_stage(self) -> None:
+        poller = AdaptivePoller()
+        while not self.stop_event.is_set():
+            try:
+                messages = poller.poll(self.sqs_client, self.queue_url)
+            except ClientError as e:
+                logger.error(f"Error receiving message: {e}")
+                time.sleep(POLLING_INTERVAL)
+                continue
+            if not messages:
+                logger.info("No messages received.")
+                continue
+            self.visibility_manager.track(messages)
+            if not self._put(self.transform_queue, messages):
+                self.visibility_manager.abandon(messages)
+
+    def _transform_stage(self) -> None:
+        while True:
+            messages = self._get(self.transform_queue)
+            if messages is _STOP:
+                return
+            try:
+                data_batch = build_data_batch(self.postgres_client, messages)
+            except Exception:
+                self.visibility_manager.abandon(messages)
+                raise
+            if not self._put(self.insert_queue, (messages, data_batch)):
+                self.visibility_manager.abandon(messages)
+
+    def _insert_stage(self) -> None:
+        while True:
+            item = self._get(self.insert_queue)
+            if item is _STOP:
+                return
+            messages, data_batch = item
+            try:
+                self.postgres_client.insert_data(
+                    schema_name=self.postgres_client.schema_name,
+                    table_name=self.postgres_client.table_name,
+                    data=data_batch,
+                    columns=self.postgres_client.columns,
+                    strategy="skip",
+                )
+            except Exception:
+                self.visibility_manager.abandon(messages)
+                raise
+            if not self._put(self.delete_queue, messages):
+                # Committed rows must be acked even if the pipeline is stopping
+                delete_batch_messages_from_queue(
+                    self.sqs_client, self.queue_url, messages
+                )
+                self.visibility_manager.release(messages)
+
+    def _delete_stage(self) -> None:
+        while True:
+            messages = self._get(self.delete_queue)
+            if messages is _STOP:
+                return
+            delete_batch_messages_from_queue(self.sqs_client, self.queue_url, messages)
+            self.visibility_manager.release(messages)
+
+    def _run_stage(self, stage) -> None:
+        try:
+            stage()
+        except Exception as e:
+            logger.error(f"Error in pipeline stage {stage.__name__}: {e}")
+            self.stop()
+
+    def _watch_shutdown(self) -> None:
+        while not self.shutdown_event.wait(timeout=0.5):
+            if self.stop_event.is_set():
+                return
+        self.stop()
+
+    def run(self) -> None:
+        """
+        Start every stage and block until the pipeline stops.
+        """
+        stages = [
+            self._receive_stage,
+            self._transform_stage,
+            self._insert_stage,
+            self._delete_stage,
+        ]
+        threads = [
+            threading.Thread(
+                target=self._run_stage,
+                args=(stage,),
+                name=f"pipeline{stage.__name__}",
+                daemon=True,
+            )
+            for stage in stages
+        ]
+        if self.shutdown_event is not None:
+            threads.append(
+                threading.Thread(
+                    target=self._watch_shutdown, name="pipeline-shutdown", daemon=True
+                )
+            )
+        self.visibility_manager.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._drain()
+        self.visibility_manager.stop()
+
+    def _drain(self) -> None:
+        """
+        Ack the committed batches left behind by a stop and return the other
+        pending messages to the queue.
+        """
+        while not self.delete_queue.empty():
+            messages = self.delete_queue.get_nowait()
+            delete_batch_messages_from_queue(self.sqs_client, self.queue_url, messages)
+            self.visibility_manager.release(messages)
+        while not self.transform_queue.empty():
+            self.visibility_manager.abandon(self.transform_queue.get_nowait())
+        while not self.insert_queue.empty():
+            messages, _ = self.insert_queue.get_nowait()
+            self.visibility_manager.abandon(messages)
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+
+def pipelined_consumer(
+    postgres_client: PostgresClient,
+    sqs_client,
+    queue_url: str = None,
+    stop_event=None,
+) -> None:
+    ConsumerPipeline(
+        postgres_client=postgres_client,
+        sqs_client=sqs_client,
+        queue_url=queue_url,
+        stop_event=stop_event,
+    ).run()
@@ -0,0 +1,84 @@
+import math
+import time
+
+from config import (
+    ADAPTIVE_MIN_WAIT_TIME_SECONDS,
+    MAX_NUMBER_OF_MESSAGES,
+    POLLING_INTERVAL,
+    WAIT_TIME_SECONDS,
+)
+from utils import poll_messages
+
+
+class AdaptivePoller:
+    """
+    Pick the parameters of the next SQS receive from the previous ones.
+
+    While batches come back full the queue is backed up: poll again at once
+    with a short wait. When the queue is empty the long-poll wait doubles up
+    to WAIT_TIME_SECONDS. `MaxNumberOfMessages` follows a moving average of
+    the batch sizes, and jumps back to the maximum as soon as a batch fills it.
+    """
+
+    def __init__(
+        self,
+        max_number_of_messages: int = MAX_NUMBER_OF_MESSAGES,
+        min_wait_time_seconds: int = ADAPTIVE_MIN_WAIT_TIME_SECONDS,
+        max_wait_time_seconds: int = WAIT_TIME_SECONDS,
+        smoothing: float = 0.3,
+    ) -> None:
+        self.max_messages_limit = max_number_of_messages
+        self.min_wait_time_seconds = min_wait_time_seconds
+        self.max_wait_time_seconds = max_wait_time_seconds
+        self.smoothing = smoothing
+        self.arrival_rate = float(max_number_of_messages)  # messages per receive
+        self.max_number_of_messages = max_number_of_messages
+        self.wait_time_seconds = max_wait_time_seconds
+        self.delay = 0
+
+    def receive_parameters(self) -> dict:
+        return {
+            "max_number_of_messages": self.max_number_of_messages,
+            "wait_time_seconds": self.wait_time_seconds,
+        }
+
+    def poll(self, sqs_client, queue_url):
+        """
+        Receive messages with the current parameters, then adapt them.
+        """
+        time.sleep(self.delay)
+        start = time.monotonic()
+        messages = poll_messages(sqs_client, queue_url, **self.receive_parameters())
+        self.record(len(messages), time.monotonic() - start)
+        return messages
+
+    def record(
+        self, nb_messages: int, elapsed: float = None, requested_wait: float = None
+    ) -> None:
+        """
+        Update the parameters after a receive that returned `nb_messages`
+        messages in `elapsed` seconds. `requested_wait` is the long-poll wait
+        actually sent, when the caller capped the one of `receive_parameters`.
+        """
+        is_full = nb_messages >= self.max_number_of_messages
+        if requested_wait is None:
+            requested_wait = self.wait_time_seconds
+        self.arrival_rate += self.smoothing * (nb_messages - self.arrival_rate)
+        self.delay = 0
+
+        if is_full:
+            self.max_number_of_messages = self.max_messages_limit
+            self.wait_time_seconds = self.min_wait_time_seconds
+        elif nb_messages > 0:
+            self.max_number_of_messages = min(
+                self.max_messages_limit, max(1, math.ceil(2 * self.arrival_rate))
+            )
+            self.wait_time_seconds = self.min_wait_time_seconds
+        else:
+            self.wait_time_seconds = min(
+                self.max_wait_time_seconds,
+                max(1, 2 * self.wait_time_seconds),
+            )
+            # An empty receive that did not wait has failed: do not spin
+            if elapsed is not None and elapsed < requested_wait / 2:
+                self.delay = POLLING_INTERVAL
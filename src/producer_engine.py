@@ -0,0 +1,197 @@
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (
+    PRODUCER_MAX_IN_FLIGHT,
+    PRODUCER_RATE,
+    PRODUCER_THREADS,
+    PUBLISH_MAX_LINGER,
+    logger,
+)
+from publisher import BatchPublisher
+from utils import percentile, send_message_to_topic
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at `rate` tokens per second, holding at
+    most `capacity` tokens. It starts empty so that a run does not begin with
+    a burst. A rate of 0 or None disables the limit.
+    """
+
+    def __init__(self, rate: float, capacity: float = None) -> None:
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate or 0)
+        self._tokens = 0.0
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1) -> None:
+        """
+        Block until `tokens` tokens are available, then consume them.
+        """
+        if not self.rate:
+            return
+        if tokens > self.capacity:
+            raise ValueError("Cannot acquire more tokens than the bucket capacity.")
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated_at) * self.rate
+                )
+                self._updated_at = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class _BoundedExecutor:
+    """
+    Submit to `executor`, blocking while `semaphore` has no slot left.
+    """
+
+    def __init__(self, executor, semaphore) -> None:
+        self.executor = executor
+        self.semaphore = semaphore
+
+    def submit(self, fn, *args):
+        self.semaphore.acquire()
+        return self.executor.submit(self._run, fn, *args)
+
+    def _run(self, fn, *args):
+        try:
+            return fn(*args)
+        finally:
+            self.semaphore.release()
+
+
+class ProducerEngine:
+    """
+    Publish messages to an SNS topic at a controlled rate.
+
+    Publishes run on a thread pool, are paced by a token bucket (`rate`
+    messages per second) and at most `max_in_flight` publish calls run at the
+    same time. With `batch_size` > 1, messages go through a BatchPublisher:
+    full batches are sent with PublishBatch at once and partial ones after
+    `max_linger` seconds. The latencies are then measured per message, from
+    `publish` to its message ID, linger included.
+    """
+
+    def __init__(
+        self,
+        sns_client,
+        topic_arn: str,
+        rate: float = PRODUCER_RATE,
+        max_in_flight: int = PRODUCER_MAX_IN_FLIGHT,
+        num_threads: int = PRODUCER_THREADS,
+        batch_size: int = 1,
+        max_linger: float = PUBLISH_MAX_LINGER,
+    ) -> None:
+        self.sns_client = sns_client
+        self.topic_arn = topic_arn
+        self.batch_size = batch_size
+        self.max_linger = max_linger
+        # Bursts are limited to a tenth of a second of traffic
+        self.bucket = TokenBucket(
+            rate=rate, capacity=max(1, batch_size, (rate or 0) / 10)
+        )
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.num_threads = num_threads
+        self._lock = threading.Lock()
+        self._latencies = []
+        self._nb_sent = 0
+        self._nb_failed = 0
+
+    def _publish(self, message) -> None:
+        start = time.perf_counter()
+        try:
+            response = send_message_to_topic(
+                sns_client=self.sns_client,
+                topic_arn=self.topic_arn,
+                message_body=message["message_body"],
+                subject=message.get("subject"),
+                message_attributes=message.get("message_attributes"),
+            )
+            nb_sent = int(response is not None)
+        except Exception as e:
+            logger.error(f"Error sending message to topic: {e}")
+            nb_sent = 0
+        finally:
+            self.in_flight.release()
+        self._record(time.perf_counter() - start, nb_sent)
+
+    def _record(self, latency: float, nb_sent: int, nb_messages: int = 1) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+            self._nb_sent += nb_sent
+            self._nb_failed += nb_messages - nb_sent
+
+    def _publish_batched(self, messages, executor) -> None:
+        with BatchPublisher(
+            sns_client=self.sns_client,
+            topic_arn=self.topic_arn,
+            max_linger=self.max_linger,
+            batch_size=self.batch_size,
+            executor=_BoundedExecutor(executor, self.in_flight),
+        ) as publisher:
+            for message in messages:
+                self.bucket.acquire()
+                published_at = time.perf_counter()
+                future = publisher.publish(
+                    message_body=message["message_body"],
+                    subject=message.get("subject"),
+                    message_attributes=message.get("message_attributes"),
+                )
+                future.add_done_callback(
+                    lambda future, published_at=published_at: self._record(
+                        time.perf_counter() - published_at,
+                        int(future.result() is not None),
+                    )
+                )
+
+    def run(self, messages, nb_messages: int = None) -> dict:
+        """
+        Publish every message from the `messages` iterable, or only the first
+        `nb_messages`, and return the achieved throughput and latencies.
+        Each message is a dict as expected by `send_messages_to_topic`.
+        """
+        messages = iter(messages)
+        if nb_messages is not None:
+            messages = itertools.islice(messages, nb_messages)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(
+            max_workers=self.num_threads, thread_name_prefix="producer"
+        ) as executor:
+            if self.batch_size > 1:
+                self._publish_batched(messages, executor)
+            else:
+                for message in messages:
+                    self.bucket.acquire()
+                    self.in_flight.acquire()
+                    executor.submit(self._publish, message)
+        elapsed = time.perf_counter() - start
+        return self.report(elapsed)
+
+    def report(self, elapsed: float) -> dict:
+        with self._lock:
+            latencies = list(self._latencies)
+            nb_sent, nb_failed = self._nb_sent, self._nb_failed
+        report = {
+            "sent": nb_sent,
+            "failed": nb_failed,
+            "elapsed_seconds": round(elapsed, 3),
+            "messages_per_second": round(nb_sent / elapsed, 1) if elapsed else None,
+        }
+        for percent in (50, 90, 99):
+            value = percentile(latencies, percent)
+            report[f"latency_p{percent}_ms"] = (
+                round(value * 1000, 2) if value is not None else None
+            )
+        logger.info(f"Producer report: {report}")
+        return report
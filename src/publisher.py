@@ -0,0 +1,148 @@
+import threading
+import time
+from concurrent.futures import Future
+
+from config import (
+    PUBLISH_BATCH_MAX_BYTES,
+    PUBLISH_BATCH_SIZE,
+    PUBLISH_MAX_LINGER,
+    logger,
+)
+from utils import publish_entry_size, send_messages_to_topic
+
+
+class BatchPublisher:
+    """
+    Buffer messages and publish them to an SNS topic with PublishBatch.
+
+    A batch is sent as soon as it is full (`batch_size` entries or
+    PUBLISH_BATCH_MAX_BYTES bytes), and a background thread sends partial
+    batches once their oldest message has waited `max_linger` seconds, so
+    low-traffic producers are not delayed.
+    Batches are sent by the thread that fills them, or submitted to
+    `executor` when one is given.
+    `publish` returns a Future resolved with the message ID, or None if the
+    message could not be published.
+    """
+
+    def __init__(
+        self,
+        sns_client,
+        topic_arn,
+        max_linger: float = PUBLISH_MAX_LINGER,
+        batch_size: int = PUBLISH_BATCH_SIZE,
+        executor=None,
+    ):
+        if max_linger <= 0:
+            raise ValueError("Publish linger must be greater than 0.")
+        if not 1 <= batch_size <= PUBLISH_BATCH_SIZE:
+            raise ValueError(
+                f"Publish batch size must be between 1 and {PUBLISH_BATCH_SIZE}."
+            )
+        self.sns_client = sns_client
+        self.topic_arn = topic_arn
+        self.max_linger = max_linger
+        self.batch_size = batch_size
+        self.executor = executor
+        self._lock = threading.Lock()
+        self._messages = []
+        self._futures = []
+        self._nb_bytes = 0
+        self._first_added_at = None
+        self._closed = threading.Event()
+        self._linger_thread = threading.Thread(
+            target=self._linger_loop, name="batch-publisher", daemon=True
+        )
+        self._linger_thread.start()
+
+    def publish(self, message_body, subject=None, message_attributes=None) -> Future:
+        if self._closed.is_set():
+            raise RuntimeError("Publisher is closed.")
+        message = {
+            "message_body": message_body,
+            "subject": subject,
+            "message_attributes": message_attributes,
+        }
+        entry_size = publish_entry_size(
+            {
+                "Message": message_body,
+                "Subject": subject or "",
+                "MessageAttributes": message_attributes or {},
+            }
+        )
+        future = Future()
+        batch = None
+        with self._lock:
+            if self._messages and self._nb_bytes + entry_size > PUBLISH_BATCH_MAX_BYTES:
+                batch = self._take_batch()
+            if self._first_added_at is None:
+                self._first_added_at = time.monotonic()
+            self._messages.append(message)
+            self._futures.append(future)
+            self._nb_bytes += entry_size
+            if batch is None and len(self._messages) >= self.batch_size:
+                batch = self._take_batch()
+        if batch is not None:
+            self._dispatch(batch)
+        return future
+
+    def _take_batch(self):
+        """
+        Detach the buffered messages. Must be called with the lock held.
+        """
+        batch = (self._messages, self._futures)
+        self._messages, self._futures = [], []
+        self._nb_bytes = 0
+        self._first_added_at = None
+        return batch
+
+    def _dispatch(self, batch) -> None:
+        if self.executor is None:
+            self._send(*batch)
+        else:
+            self.executor.submit(self._send, *batch)
+
+    def _send(self, messages, futures) -> None:
+        try:
+            message_ids = send_messages_to_topic(
+                sns_client=self.sns_client,
+                topic_arn=self.topic_arn,
+                messages=messages,
+            )
+        except Exception as e:
+            logger.error(f"Error sending message batch: {e}")
+            message_ids = [None] * len(messages)
+        for future, message_id in zip(futures, message_ids):
+            future.set_result(message_id)
+
+    def _linger_loop(self) -> None:
+        while not self._closed.wait(timeout=self.max_linger / 2):
+            batch = None
+            with self._lock:
+                if (
+                    self._first_added_at is not None
+                    and time.monotonic() - self._first_added_at >= self.max_linger
+                ):
+                    batch = self._take_batch()
+            if batch is not None:
+                self._dispatch(batch)
+
+    def flush(self) -> None:
+        """
+        Send the buffered messages right away.
+        """
+        with self._lock:
+            batch = self._take_batch() if self._messages else None
+        if batch is not None:
+            self._dispatch(batch)
+
+    def close(self) -> None:
+        self._closed.set()
+        self._linger_thread.join()
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
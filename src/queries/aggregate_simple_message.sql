@@ -1,9 +1,9 @@
 SELECT
-    DATE_TRUNC('MINUTE', m.created_at) AS minute,
-    COUNT(*)
+    NULLIF(r.minute, '-infinity') AS minute,
+    r.count
 FROM
-    schema_name.table_name AS m
-GROUP BY
-    1
+    schema_name.table_name_per_minute AS r
+WHERE
+    r.count > 0
 ORDER BY
     1 ASC
\ No newline at end of file
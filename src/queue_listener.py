@@ -1,15 +1,24 @@
+import multiprocessing
 import os
+import threading
 import time
 
+from async_consumer import async_consumer
+from batching import batching_consumer
 from config import (
     AWS_ARN_ROLE_CONSUMER,
-    POLLING_INTERVAL,
+    CONSUMER_MODE,
+    NUM_WORKERS,
     POSTGRES_URI,
     QUEUE_NAME,
     SESSION_NAME,
     TOPIC_NAME,
+    WORKER_MODE,
     logger,
 )
+from pipeline import pipelined_consumer
+from polling import AdaptivePoller
+from scripts.aws_connection import AWSConnection
 from scripts.aws_queue import Queue
 from scripts.postgres import PostgresClient
 from setup import (
@@ -18,6 +27,7 @@ from setup import (
 )
 from simple_message import SimpleMessage
 from utils import receive_message_from_queue
+from visibility import VisibilityManager
 
 
 def initialize_consumer(
@@ -56,28 +66,149 @@ def consumer(
     postgres_client: PostgresClient,
     sqs_client: Queue,
     queue_url: str = None,
+    stop_event=None,
 ) -> None:
-    is_consumer_running = True
+    """
+    Receive, insert and ack batches of messages one after the other, until
+    `stop_event` is set or a receive fails.
+    """
+    stop_event = stop_event or threading.Event()
+    poller = AdaptivePoller()
+    visibility_manager = VisibilityManager(
+        sqs_client=sqs_client, queue_url=queue_url
+    ).start()
 
-    while is_consumer_running:
+    while not stop_event.is_set():
         try:
-            receive_message_from_queue(
+            if stop_event.wait(timeout=poller.delay):
+                break
+            start = time.monotonic()
+            messages = receive_message_from_queue(
                 postgres_client=postgres_client,
                 schema_name=postgres_client.schema_name,
                 table_name=postgres_client.table_name,
                 sqs_client=sqs_client,
                 queue_url=queue_url,
                 columns=postgres_client.columns,
+                visibility_manager=visibility_manager,
+                **poller.receive_parameters(),
             )
-            time.sleep(POLLING_INTERVAL)  # polling interval
+            poller.record(len(messages or []), time.monotonic() - start)
         except Exception as e:
-            is_consumer_running = False
             logger.error(f"Error receiving messages: {e}")
             break
+    visibility_manager.stop()
+
+
+def get_consumer(consumer_mode: str = CONSUMER_MODE):
+    """
+    Return the consumer loop matching the given mode.
+    """
+    consumers = {
+        "loop": consumer,
+        "pipeline": pipelined_consumer,
+        "batch": batching_consumer,
+        "async": async_consumer,
+    }
+    if consumer_mode not in consumers:
+        raise ValueError(f"Invalid consumer mode. Use one of: {', '.join(consumers)}.")
+    return consumers[consumer_mode]
+
+
+def start_worker(
+    postgres: PostgresClient,
+    queue_url: str,
+    role: str = AWS_ARN_ROLE_CONSUMER,
+    session_name: str = SESSION_NAME,
+    db_uri: str = POSTGRES_URI,
+    consumer_mode: str = CONSUMER_MODE,
+    stop_event=None,
+) -> None:
+    """
+    Run a single consumer worker with its own Postgres client. Worker threads
+    share the cached SQS client of the process.
+    """
+    run_consumer = get_consumer(consumer_mode)
+    postgres_client = postgres(db_uri=db_uri)
+    sqs_client = AWSConnection(role=role, session_name=session_name).get_client(
+        service="sqs"
+    )
+    try:
+        run_consumer(
+            postgres_client=postgres_client,
+            sqs_client=sqs_client,
+            queue_url=queue_url,
+            stop_event=stop_event,
+        )
+    finally:
+        postgres_client.close()
+
+
+def consumer_pool(
+    postgres: PostgresClient,
+    queue_url: str,
+    num_workers: int = NUM_WORKERS,
+    worker_mode: str = WORKER_MODE,
+    role: str = AWS_ARN_ROLE_CONSUMER,
+    session_name: str = SESSION_NAME,
+    db_uri: str = POSTGRES_URI,
+    consumer_mode: str = CONSUMER_MODE,
+    stop_event=None,
+) -> None:
+    """
+    Run `num_workers` consumers long-polling the same queue in parallel.
+    Workers are threads or processes depending on `worker_mode`. Setting
+    `stop_event` (a multiprocessing Event for processes) stops them after
+    their current batch, and the pool returns once they all have.
+    """
+    if worker_mode == "thread":
+        worker_class = threading.Thread
+        stop_event = stop_event or threading.Event()
+    elif worker_mode == "process":
+        context = multiprocessing.get_context("spawn")
+        worker_class = context.Process
+        stop_event = stop_event or context.Event()
+    else:
+        raise ValueError("Invalid worker mode. Use 'thread' or 'process'.")
+
+    if num_workers < 1:
+        raise ValueError("Number of workers must be at least 1.")
+
+    workers = [
+        worker_class(
+            target=start_worker,
+            kwargs={
+                "postgres": postgres,
+                "queue_url": queue_url,
+                "role": role,
+                "session_name": session_name,
+                "db_uri": db_uri,
+                "consumer_mode": consumer_mode,
+                "stop_event": stop_event,
+            },
+            name=f"consumer-worker-{i}",
+            daemon=True,
+        )
+        for i in range(num_workers)
+    ]
+    for worker in workers:
+        worker.start()
+    logger.info(f"Started {num_workers} consumer workers ({worker_mode} mode).")
+
+    for worker in workers:
+        worker.join()
+    if stop_event.is_set():
+        logger.info("All consumer workers have stopped.")
+    else:
+        logger.warning("All consumer workers have stopped.")
 
 
 if __name__ == "__main__":
     postgres_client, sqs_client, queue_url = initialize_consumer(postgres=SimpleMessage)
-    consumer(
-        postgres_client=postgres_client, sqs_client=sqs_client, queue_url=queue_url
-    )
+    if NUM_WORKERS > 1:
+        postgres_client.close()
+        consumer_pool(postgres=SimpleMessage, queue_url=queue_url)
+    else:
+        get_consumer()(
+            postgres_client=postgres_client, sqs_client=sqs_client, queue_url=queue_url
+        )
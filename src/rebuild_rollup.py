@@ -0,0 +1,30 @@
+import argparse
+
+from config import CONSUMER_NAME, POSTGRES_URI
+from consumers import dict_consumers
+from setup import initialize_postgres_client
+
+
+def rebuild_rollup(consumer_name: str = CONSUMER_NAME, db_uri: str = POSTGRES_URI):
+    """
+    Recompute the per-minute rollup of a consumer table from its rows, after
+    a backfill or any write that bypassed `insert_data`.
+    """
+    postgres_client = initialize_postgres_client(
+        postgres=dict_consumers[consumer_name], db_uri=db_uri
+    )
+    try:
+        postgres_client.rebuild_rollup(
+            schema_name=postgres_client.schema_name,
+            table_name=postgres_client.table_name,
+        )
+    finally:
+        postgres_client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the per-minute rollup.")
+    parser.add_argument("--consumer", default=CONSUMER_NAME, choices=dict_consumers)
+    args = parser.parse_args()
+
+    rebuild_rollup(consumer_name=args.consumer)
@@ -0,0 +1,73 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+from config import AGGREGATE_CACHE_SIZE, AGGREGATE_CACHE_TTL
+
+
+class ResultCache:
+    """
+    Query results kept `ttl` seconds, at most `maxsize` of them: the least
+    recently read one is evicted first. Each result is stored with the data
+    version it was computed at, and is stale as soon as the version moved.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: float = 5) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, version, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        """
+        Cached value of `key` at `version`, None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, entry_version, value = entry
+            if entry_version != version or expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, version, value) -> None:
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+AGGREGATE_CACHE = ResultCache(maxsize=AGGREGATE_CACHE_SIZE, ttl=AGGREGATE_CACHE_TTL)
+
+
+def cached_result(cache: ResultCache = AGGREGATE_CACHE):
+    """
+    Cache the results of a PostgresClient query method per consumer class
+    and arguments, until the consumer table gets new rows.
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            key = (type(self).__name__, method.__name__, args, tuple(kwargs.items()))
+            version = self.data_version(self.schema_name, self.table_name)
+            rows = cache.get(key, version)
+            if rows is None:
+                rows = tuple(method(self, *args, **kwargs))
+                cache.put(key, version, rows)
+            return list(rows)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,160 @@
+import threading
+import time
+
+from config import (
+    POSTGRES_URI,
+    RETENTION_CHUNK_PAUSE,
+    RETENTION_CHUNK_SIZE,
+    RETENTION_INSERT_LATENCY_TARGET,
+    RETENTION_INTERVAL,
+    RETENTION_MAX_PAUSE,
+    WORKER_MODE,
+    logger,
+)
+from metrics import RETENTION_ROWS_DELETED, STAGE_LATENCY
+from scripts.postgres import PostgresClient
+
+
+class RetentionScheduler:
+    """
+    Delete the expired rows of a consumer table every `interval` seconds.
+
+    Rows are deleted by chunks of `chunk_size`, each in its own short
+    transaction, so that autovacuum and the consumer inserts keep up.
+    Between chunks the scheduler pauses `pause` seconds, doubled while the
+    mean `insert_data` latency since the previous chunk is above
+    `latency_target`, and halved back once it is below. Partitioned tables
+    drop their expired partitions first.
+    The insert latency is read from this process: with consumer workers in
+    processes of their own, `adaptive` is off and the pause stays fixed.
+    Replicas sharing the database take turns through an advisory lock.
+    The `postgres` client is built from `db_uri` on the first run, in the
+    scheduler thread, so that starting the app does not need the database.
+    """
+
+    def __init__(
+        self,
+        postgres: PostgresClient,
+        db_uri: str = POSTGRES_URI,
+        interval: float = RETENTION_INTERVAL,
+        chunk_size: int = RETENTION_CHUNK_SIZE,
+        pause: float = RETENTION_CHUNK_PAUSE,
+        max_pause: float = RETENTION_MAX_PAUSE,
+        latency_target: float = RETENTION_INSERT_LATENCY_TARGET,
+        adaptive: bool = WORKER_MODE != "process",
+    ) -> None:
+        self.postgres = postgres
+        self.db_uri = db_uri
+        self._postgres_client = None
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.min_pause = pause
+        self.max_pause = max_pause
+        self.latency_target = latency_target
+        self.pause = pause
+        self.adaptive = adaptive
+        self._table_ready = False
+        self._insert_latency = STAGE_LATENCY.labels(stage="insert_data")
+        self._insert_totals = self._insert_latency.totals()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def postgres_client(self) -> PostgresClient:
+        if self._postgres_client is None:
+            self._postgres_client = self.postgres(db_uri=self.db_uri)
+        return self._postgres_client
+
+    def _adapt_pause(self) -> None:
+        """
+        Pace the next chunk on the inserts observed since the previous one.
+        """
+        if not self.adaptive:
+            return
+        total, count = self._insert_latency.totals()
+        previous_total, previous_count = self._insert_totals
+        self._insert_totals = (total, count)
+        if count == previous_count:
+            return  # no insert meanwhile, keep the pace
+        mean_latency = (total - previous_total) / (count - previous_count)
+        if mean_latency > self.latency_target:
+            self.pause = min(self.max_pause, self.pause * 2)
+        else:
+            self.pause = max(self.min_pause, self.pause / 2)
+
+    def run_once(self) -> int:
+        """
+        Delete the expired rows of the table. Returns the number of rows
+        deleted by chunks, stopping early when the scheduler is stopped, and
+        0 when another process is already running the retention.
+        """
+        client = self.postgres_client
+        schema_name, table_name = client.schema_name, client.table_name
+        with client.advisory_lock(f"retention {schema_name}.{table_name}") as locked:
+            if not locked:
+                logger.info(
+                    f"Retention of '{schema_name}.{table_name}' is running "
+                    f"elsewhere, skipped."
+                )
+                return 0
+            return self._delete_expired()
+
+    def _delete_expired(self) -> int:
+        client = self.postgres_client
+        schema_name, table_name = client.schema_name, client.table_name
+        if not self._table_ready:
+            # Also tells whether the table is actually partitioned
+            client.get_or_create_table(schema_name, table_name, client.columns)
+            self._table_ready = True
+        if client.delete_column == client.partition_column:
+            client.create_partitions(schema_name, table_name)
+            client.drop_expired_partitions(schema_name, table_name)
+
+        nb_deleted = 0
+        while not self._stop_event.is_set():
+            start = time.perf_counter()
+            with STAGE_LATENCY.labels(stage="retention_chunk").time():
+                nb_chunk = client.delete_expired_chunk(
+                    schema_name, table_name, client.delete_column, self.chunk_size
+                )
+            RETENTION_ROWS_DELETED.inc(nb_chunk)
+            nb_deleted += nb_chunk
+            logger.info(
+                f"Retention deleted {nb_chunk} rows from '{schema_name}.{table_name}' "
+                f"in {time.perf_counter() - start:.3f}s."
+            )
+            if nb_chunk < self.chunk_size:
+                break
+            self._adapt_pause()
+            self._stop_event.wait(timeout=self.pause)
+        return nb_deleted
+
+    def _run(self) -> None:
+        # The first run waits one interval, once the consumer set the table up
+        while not self._stop_event.wait(timeout=self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Error in retention scheduler: {e}")
+
+    def start(self) -> "RetentionScheduler":
+        if self._thread is None and self.interval > 0:
+            if not self.adaptive:
+                logger.warning(
+                    f"Retention pauses a fixed {self.pause}s between chunks, "
+                    f"without pacing on the insert latency."
+                )
+            self._thread = threading.Thread(
+                target=self._run, name="retention-scheduler", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._postgres_client is not None:
+            self._postgres_client.close()
+            self._postgres_client = None
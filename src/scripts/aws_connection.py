@@ -1,12 +1,19 @@
+import asyncio
 import datetime
 import os
+import threading
 
 import boto3
+from aiobotocore.config import AioConfig
+from aiobotocore.credentials import AioRefreshableCredentials
+from aiobotocore.session import get_session as get_aio_session
 from boto3 import Session
+from botocore.config import Config
 from botocore.credentials import RefreshableCredentials
 from botocore.session import get_session
 
-from config import logger
+from config import AWS_MAX_POOL_CONNECTIONS, CREDENTIALS_REFRESH_MARGIN, logger
+from scripts.fake_aws import get_fake_broker
 
 
 class AWSConnectionMeta(type):
@@ -17,34 +24,61 @@ class AWSConnectionMeta(type):
     """
 
     _instances = {}
+    _lock = threading.Lock()
 
     def __call__(cls, *args, **kwargs):
         """
         Possible changes to the value of the `__init__` argument do not affect
         the returned instance.
+        The instance is only published once initialized, and threads racing to
+        create it wait for it instead of creating their own.
         """
-        if cls not in cls._instances:
-            instance = super().__call__(*args, **kwargs)
-            cls._instances[cls] = instance
-        return cls._instances[cls]
+        instance = cls._instances.get(cls)
+        if instance is None:
+            with cls._lock:
+                instance = cls._instances.get(cls)
+                if instance is None:
+                    instance = super().__call__(*args, **kwargs)
+                    cls._instances[cls] = instance
+        return instance
 
 
 class AWSConnection(metaclass=AWSConnectionMeta):
+    # Seconds between fetching the next assumed-role credentials and using them
+    prefetch_lead = 60
+
     def __init__(
         self,
         role: str = None,
         session_name: str = None,
         assume_role_max_duration: int = 3600,
+        refresh_margin: int = CREDENTIALS_REFRESH_MARGIN,
     ) -> None:
+        if getattr(self, "_refresher", None) is not None:
+            self.close()  # initialized again
+        self.utc = datetime.timezone.utc
+        self.refresh_margin = refresh_margin
+        self._prefetched = None
+        self._prefetched_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._refresher = None
         self.credentials = self._init_credentials(
             role, session_name, assume_role_max_duration
         )
+        # Clients are cached per (service, region) and built on the credentials
+        # above, which are refreshed in place
+        self._clients = {}
+        self._clients_lock = threading.Lock()
         # if no role assumed or in local dev / testing environment return None
-        if self.credentials == {} or os.getenv("LOCALSTACK") == "1":
+        if (
+            self.credentials == {}
+            or os.getenv("LOCALSTACK") == "1"
+            or os.getenv("FAKE_AWS") == "1"
+        ):
             self.expired_date = None
         else:
             self.expired_date = self.credentials._expiry_time.isoformat()
-        self.utc = datetime.timezone.utc
+            self._start_refresher()
 
     def _init_credentials(self, role, session_name, assume_role_max_duration):
         self.role = role
@@ -60,6 +94,10 @@ class AWSConnection(metaclass=AWSConnectionMeta):
                 "Assume role max duration is None or not between 15 mins and 8 hours"
             )
 
+        # In-process broker for load tests and benchmarks, see scripts.fake_aws
+        if os.getenv("FAKE_AWS") == "1":
+            return {}
+
         if os.getenv("LOCALSTACK") == "1":
             if os.getenv("REDSHIFT") == "1":
                 return {}
@@ -75,19 +113,44 @@ class AWSConnection(metaclass=AWSConnectionMeta):
             logger.warning("No role given : using aws connection without assume role")
             return {}
 
+        if (
+            not 2 * self.prefetch_lead
+            < self.refresh_margin
+            < (self.assume_role_max_duration - 3 * self.prefetch_lead)
+        ):
+            raise ValueError(
+                f"Refresh margin must be between {2 * self.prefetch_lead}s and "
+                f"the assume role duration minus {3 * self.prefetch_lead}s."
+            )
+        # botocore refreshes the credentials once they expire in less than the
+        # refresh margin, with the ones prefetched by the refresher thread
         session_credentials = RefreshableCredentials.create_from_metadata(
             metadata=self._refresh(),
             refresh_using=self._refresh,
             method="sts-assume-role",
+            advisory_timeout=self.refresh_margin,
+            mandatory_timeout=self.prefetch_lead,
         )
 
         return session_credentials
 
     def _refresh(self):
         """
-        Refresh tokens by calling assume_role again
+        Credentials for botocore: the ones prefetched by the refresher thread,
+        or new ones from assume_role if it could not prefetch them.
         Documentation: https://dev.to/li_chastina/auto-refresh-aws-tokens-using-iam-role-and-boto3-2cjf
         """
+        with self._prefetched_lock:
+            credentials, self._prefetched = self._prefetched, None
+        if credentials is None:
+            credentials = self._assume_role()
+        self.expired_date = credentials.get("expiry_time")
+        return credentials
+
+    def _assume_role(self):
+        """
+        Assume the role with STS.
+        """
         sts_client = boto3.client("sts", region_name=self.region)
 
         params = {
@@ -107,10 +170,50 @@ class AWSConnection(metaclass=AWSConnectionMeta):
             "token": response.get("SessionToken"),
             "expiry_time": response.get("Expiration").isoformat(),
         }
+        return credentials
 
-        self.expired_date = credentials.get("expiry_time")
+    def _seconds_until_prefetch(self) -> float:
+        expiry = datetime.datetime.fromisoformat(self.expired_date)
+        remaining = (expiry - datetime.datetime.now(self.utc)).total_seconds()
+        return max(0, remaining - self.refresh_margin - self.prefetch_lead)
 
-        return credentials
+    def _refresh_credentials(self) -> None:
+        """
+        Refresher thread: assume the role `prefetch_lead` seconds before
+        botocore wants new credentials, then trigger the swap, so that no
+        request ever waits for STS.
+        """
+        while not self._stop_event.wait(timeout=self._seconds_until_prefetch()):
+            try:
+                credentials = self._assume_role()
+                with self._prefetched_lock:
+                    self._prefetched = credentials
+                # Past the refresh margin, botocore swaps in the prefetched
+                # credentials under its own lock on their next use
+                if self._stop_event.wait(timeout=2 * self.prefetch_lead):
+                    return
+                self.credentials.get_frozen_credentials()
+                logger.info(f"Credentials refreshed, expire at {self.expired_date}")
+            except Exception as e:
+                logger.error(f"Error refreshing credentials: {e}")
+                self._stop_event.wait(timeout=self.prefetch_lead)
+
+    def _start_refresher(self) -> None:
+        self._refresher = threading.Thread(
+            target=self._refresh_credentials,
+            name="credentials-refresher",
+            daemon=True,
+        )
+        self._refresher.start()
+
+    def close(self) -> None:
+        """
+        Stop the credentials refresher.
+        """
+        self._stop_event.set()
+        if self._refresher is not None:
+            self._refresher.join()
+            self._refresher = None
 
     def get_session(self) -> boto3.Session:
         """
@@ -121,26 +224,95 @@ class AWSConnection(metaclass=AWSConnectionMeta):
         session.set_config_variable(logical_name="region", value=self.region)
         return Session(botocore_session=session)
 
-    def get_client(self, service) -> boto3.client:
+    def get_client(self, service, region_name: str = None) -> boto3.client:
         """
-        Get s3 client object
+        Get the client of an aws service, cached per service and region.
+        boto3 clients are thread-safe: workers share them, and their HTTP
+        connection pool holds up to AWS_MAX_POOL_CONNECTIONS connections.
         Args:
             service: aws service to connect to
+            region_name: region of the service, the connection region by default
         """
 
-        if (self.expired_date is not None) and (
-            datetime.datetime.now(self.utc)
-            > datetime.datetime.fromisoformat(self.expired_date)
-        ):
-            self.__init__(role=self.role, session_name=self.session_name)
+        if os.getenv("FAKE_AWS") == "1":
+            return get_fake_broker(region=self.region).client(service)
+
+        key = (service, region_name or self.region)
+        client = self._clients.get(key)
+        if client is None:
+            with self._clients_lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = self._create_client(*key)
+                    self._clients[key] = client
+        return client
 
+    def _create_client(self, service, region_name) -> boto3.client:
+        config = Config(max_pool_connections=AWS_MAX_POOL_CONNECTIONS)
         # if no role assumed or in local dev / testing environment return None
         if self.credentials == {} or os.getenv("LOCALSTACK") == "1":
             logger.info(
                 f"No role assumed or in local dev / testing environment, "
                 f"credentials: {self.credentials}"
             )
-            return boto3.client(service, region_name=self.region, **self.credentials)
+            # A dedicated session keeps client creation safe across worker threads
+            return boto3.session.Session().client(
+                service, region_name=region_name, config=config, **self.credentials
+            )
         else:
             autorefresh_session = self.get_session()
-            return autorefresh_session.client(service)
+            return autorefresh_session.client(
+                service, region_name=region_name, config=config
+            )
+
+    def create_async_client(
+        self,
+        service,
+        region_name: str = None,
+        max_pool_connections: int = AWS_MAX_POOL_CONNECTIONS,
+    ):
+        """
+        Async context manager of an aiobotocore client of an aws service, for
+        the asyncio consumer. The client belongs to the event loop that enters
+        it, so it is not cached.
+        Args:
+            service: aws service to connect to
+            region_name: region of the service, the connection region by default
+            max_pool_connections: HTTP connections, one per concurrent call
+        """
+        region_name = region_name or self.region
+        if os.getenv("FAKE_AWS") == "1":
+            return get_fake_broker(region=self.region).async_client(service)
+
+        session = get_aio_session()
+        config = AioConfig(max_pool_connections=max_pool_connections)
+        if self.credentials == {} or os.getenv("LOCALSTACK") == "1":
+            return session.create_client(
+                service, region_name=region_name, config=config, **self.credentials
+            )
+        session._credentials = self._async_credentials()
+        return session.create_client(service, region_name=region_name, config=config)
+
+    def _async_credentials(self) -> AioRefreshableCredentials:
+        """
+        Assumed-role credentials for aiobotocore, starting from the current
+        ones. They are refreshed by `_refresh` too, in a thread so that the
+        event loop never waits for STS.
+        """
+        frozen = self.credentials.get_frozen_credentials()
+
+        async def refresh():
+            return await asyncio.to_thread(self._refresh)
+
+        return AioRefreshableCredentials.create_from_metadata(
+            metadata={
+                "access_key": frozen.access_key,
+                "secret_key": frozen.secret_key,
+                "token": frozen.token,
+                "expiry_time": self.credentials._expiry_time.isoformat(),
+            },
+            refresh_using=refresh,
+            method="sts-assume-role",
+            advisory_timeout=self.refresh_margin,
+            mandatory_timeout=self.prefetch_lead,
+        )
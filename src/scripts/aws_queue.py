@@ -3,16 +3,20 @@ import time
 
 from botocore.exceptions import ClientError
 
+from config import QUEUE_READY_TIMEOUT
 from scripts.aws_connection import AWSConnection
 
 
 class Queue:
     """
     Class to manage AWS SQS queues.
+    The queue URL and ARN are memoized once known.
     """
 
     def __init__(self, role: str, session_name: str, queue_name: str, logger=None):
         self.queue_name = queue_name
+        self._queue_url = None
+        self._queue_arn = None
         self.connection = AWSConnection(
             role=role,
             session_name=session_name,
@@ -21,10 +25,20 @@ class Queue:
         self.sns_client = self.connection.get_client(service="sns")
         self.logger = logger
 
-    def initialize_queue(self, topic_arn, dead_letter_queue_arn):
+    def initialize_queue(
+        self,
+        topic_arn,
+        dead_letter_queue_arn,
+        raw_message_delivery=False,
+        filter_policy=None,
+    ):
         try:
             self.create_queue()
-            self.subscribe_queue_to_topic(topic_arn=topic_arn)
+            self.subscribe_queue_to_topic(
+                topic_arn=topic_arn,
+                raw_message_delivery=raw_message_delivery,
+                filter_policy=filter_policy,
+            )
             self.add_subscription_policy_to_queue(topic_arn=topic_arn)
             self.add_redrive_policy_to_queue(
                 dead_letter_queue_arn=dead_letter_queue_arn
@@ -36,24 +50,77 @@ class Queue:
     def create_queue(self):
         try:
             response = self.sqs_client.create_queue(QueueName=self.queue_name)
-            time.sleep(2)  # Wait for the queue to be created
             queue_url = response["QueueUrl"]
+            self._queue_url = queue_url
+            self.wait_until_ready()
             self.logger.info(f"Created queue: {self.queue_name}, URL: {queue_url}")
             return queue_url
         except ClientError as e:
             self.logger.error(f"Error creating queue: {e}")
             return None
 
-    def subscribe_queue_to_topic(self, topic_arn):
+    def wait_until_ready(self, timeout: float = QUEUE_READY_TIMEOUT) -> str:
+        """
+        Poll a new queue until SQS serves its attributes, with a growing delay.
+        Returns the queue ARN.
+        """
+        deadline = time.monotonic() + timeout
+        delay = 0.05
+        while True:
+            try:
+                response = self.sqs_client.get_queue_attributes(
+                    QueueUrl=self._queue_url, AttributeNames=["QueueArn"]
+                )
+                self._queue_arn = response["Attributes"]["QueueArn"]
+                return self._queue_arn
+            except ClientError as e:
+                not_ready = (
+                    e.response["Error"]["Code"]
+                    == "AWS.SimpleQueueService.NonExistentQueue"
+                )
+                if not not_ready or time.monotonic() + delay > deadline:
+                    raise
+            time.sleep(delay)
+            delay = min(1, 2 * delay)
+
+    @staticmethod
+    def subscription_attributes(raw_message_delivery=False, filter_policy=None):
+        """
+        SNS subscription attributes. With raw message delivery the SQS body is
+        the published message instead of the SNS JSON envelope. A filter policy
+        on message attributes drops, at SNS, the messages the consumer ignores.
+        """
+        attributes = {"RawMessageDelivery": "true" if raw_message_delivery else "false"}
+        if filter_policy:
+            if not isinstance(filter_policy, str):
+                filter_policy = json.dumps(filter_policy)
+            attributes["FilterPolicy"] = filter_policy
+        return attributes
+
+    def subscribe_queue_to_topic(
+        self, topic_arn, raw_message_delivery=False, filter_policy=None
+    ):
+        attributes = self.subscription_attributes(
+            raw_message_delivery=raw_message_delivery, filter_policy=filter_policy
+        )
         try:
             queue_arn = self.get_queue_arn()
-            response = self.sns_client.subscribe(
-                TopicArn=topic_arn,
-                Protocol="sqs",
-                Endpoint=queue_arn,
-            )
+            try:
+                response = self.sns_client.subscribe(
+                    TopicArn=topic_arn,
+                    Protocol="sqs",
+                    Endpoint=queue_arn,
+                    Attributes=attributes,
+                )
+                subscription_arn = response["SubscriptionArn"]
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "InvalidParameter":
+                    raise
+                # Already subscribed with other attributes: update them
+                subscription_arn = self.update_subscription_attributes(
+                    topic_arn=topic_arn, queue_arn=queue_arn, attributes=attributes
+                )
 
-            subscription_arn = response["SubscriptionArn"]
             self.logger.info(
                 f"Subscribed queue to topic. Subscription ARN: {subscription_arn}"
             )
@@ -62,6 +129,27 @@ class Queue:
             self.logger.error(f"Error subscribing queue to topic: {e}")
             return None
 
+    def update_subscription_attributes(self, topic_arn, queue_arn, attributes):
+        params = {"TopicArn": topic_arn}
+        while True:
+            page = self.sns_client.list_subscriptions_by_topic(**params)
+            for subscription in page["Subscriptions"]:
+                if subscription["Endpoint"] != queue_arn:
+                    continue
+                subscription_arn = subscription["SubscriptionArn"]
+                for name, value in attributes.items():
+                    self.sns_client.set_subscription_attributes(
+                        SubscriptionArn=subscription_arn,
+                        AttributeName=name,
+                        AttributeValue=value,
+                    )
+                self.logger.info(f"Updated subscription attributes: {attributes}")
+                return subscription_arn
+            if "NextToken" not in page:
+                break
+            params["NextToken"] = page["NextToken"]
+        raise ValueError(f"No subscription of {queue_arn} to {topic_arn}.")
+
     def add_redrive_policy_to_queue(self, dead_letter_queue_arn, max_receive_count=5):
         queue_url = self.get_queue_url()
         queue_arn = self.get_queue_arn()
@@ -107,7 +195,7 @@ class Queue:
     def add_subscription_policy_to_queue(self, topic_arn):
         queue_url = self.get_queue_url()
         queue_attrs = self.sqs_client.get_queue_attributes(
-            QueueUrl=queue_url, AttributeNames=["QueueArn", "Policy"]
+            QueueUrl=queue_url, AttributeNames=["Policy"]
         )
         queue_arn = self.get_queue_arn()
         existing_policy_str = queue_attrs["Attributes"].get("Policy", "")
@@ -137,6 +225,8 @@ class Queue:
             self.logger.info("Policy already includes permission for this SNS topic.")
 
     def get_queue_arn(self):
+        if self._queue_arn is not None:
+            return self._queue_arn
         try:
             queue = self.get_queue_url()
             response = self.sqs_client.get_queue_attributes(
@@ -146,6 +236,7 @@ class Queue:
             self.logger.info(
                 f"Queue '{self.queue_name}' found. URL: {queue}, ARN: {queue_arn}"
             )
+            self._queue_arn = queue_arn
             return queue_arn
         except ClientError as e:
             error_code = e.response["Error"]["Code"]
@@ -156,10 +247,13 @@ class Queue:
             return None
 
     def get_queue_url(self):
+        if self._queue_url is not None:
+            return self._queue_url
         try:
             response = self.sqs_client.get_queue_url(QueueName=self.queue_name)
             self.logger.info(f"Queue URL is: {response['QueueUrl']}")
-            return response["QueueUrl"]
+            self._queue_url = response["QueueUrl"]
+            return self._queue_url
         except ClientError as e:
             if e.response["Error"]["Code"] == "AWS.SimpleQueueService.NonExistentQueue":
                 return None
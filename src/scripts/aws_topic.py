@@ -4,7 +4,11 @@ from scripts.aws_connection import AWSConnection
 
 
 class Topic:
+    # Account id of each role, looked up once per process
+    _account_ids = {}
+
     def __init__(self, role: str, session_name: str, topic_name: str, logger=None):
+        self.role = role
         self.topic_name = topic_name
         self.connection = AWSConnection(
             role=role,
@@ -15,8 +19,11 @@ class Topic:
         self.logger = logger
 
     def get_account_id(self):
+        if self.role in self._account_ids:
+            return self._account_ids[self.role]
         try:
             account_id = self.sts_client.get_caller_identity()["Account"]
+            self._account_ids[self.role] = account_id
             return account_id
         except ClientError as e:
             self.logger.error(f"Error getting account ID: {e}")
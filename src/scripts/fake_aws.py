@@ -0,0 +1,600 @@
+import asyncio
+import collections
+import hashlib
+import heapq
+import itertools
+import json
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+from botocore.exceptions import ClientError
+
+ACCOUNT_ID = "000000000000"
+
+
+def _client_error(code: str, message: str, operation_name: str, error_class=None):
+    error_class = error_class or ClientError
+    return error_class(
+        error_response={
+            "Error": {"Code": code, "Message": message},
+            "ResponseMetadata": {"HTTPStatusCode": 400},
+        },
+        operation_name=operation_name,
+    )
+
+
+def _response(**fields) -> dict:
+    return {**fields, "ResponseMetadata": {"HTTPStatusCode": 200}}
+
+
+def _matches_condition(condition, value) -> bool:
+    if isinstance(condition, dict):
+        if "exists" in condition:
+            return condition["exists"] == (value is not None)
+        if value is None:
+            return False
+        if "prefix" in condition:
+            return isinstance(value, str) and value.startswith(condition["prefix"])
+        if "anything-but" in condition:
+            excluded = condition["anything-but"]
+            if not isinstance(excluded, list):
+                excluded = [excluded]
+            return value not in excluded
+        raise ValueError(f"Unsupported filter policy condition: {condition}")
+    return value == condition
+
+
+def _matches_filter_policy(filter_policy: dict, message_attributes: dict) -> bool:
+    """
+    Evaluate an SNS filter policy on message attributes: every key must
+    match one of its conditions (exact values, prefix, anything-but, exists).
+    """
+    for name, conditions in filter_policy.items():
+        attribute = message_attributes.get(name)
+        values = [None]
+        if attribute is not None:
+            value = attribute.get("StringValue")
+            if attribute["DataType"] == "Number":
+                values = [float(value)]
+            elif attribute["DataType"] == "String.Array":
+                values = json.loads(value)
+            else:
+                values = [value]
+        if not any(
+            _matches_condition(condition, value)
+            for condition in conditions
+            for value in values
+        ):
+            return False
+    return True
+
+
+class NotFoundException(ClientError):  # noqa: N818 named like the boto3 one
+    pass
+
+
+class _FakeMessage:
+    __slots__ = (
+        "message_id",
+        "body",
+        "md5",
+        "message_attributes",
+        "sent_at",
+        "receive_count",
+        "receipt_handle",
+        "visible_at",
+    )
+
+    def __init__(self, body: str, message_attributes=None) -> None:
+        self.message_id = str(uuid.uuid4())
+        self.body = body
+        self.md5 = hashlib.md5(body.encode("utf-8")).hexdigest()
+        self.message_attributes = message_attributes or {}
+        self.sent_at = time.time()
+        self.receive_count = 0
+        self.receipt_handle = None
+        self.visible_at = 0.0
+
+    def to_response(self, attribute_names, message_attribute_names) -> dict:
+        message = {
+            "MessageId": self.message_id,
+            "ReceiptHandle": self.receipt_handle,
+            "MD5OfBody": self.md5,
+            "Body": self.body,
+        }
+        if attribute_names:
+            message["Attributes"] = {
+                "ApproximateReceiveCount": str(self.receive_count),
+                "SentTimestamp": str(int(self.sent_at * 1000)),
+            }
+        if message_attribute_names and self.message_attributes:
+            if "All" in message_attribute_names:
+                message["MessageAttributes"] = dict(self.message_attributes)
+            else:
+                message["MessageAttributes"] = {
+                    name: value
+                    for name, value in self.message_attributes.items()
+                    if name in message_attribute_names
+                }
+        return message
+
+
+class _FakeQueue:
+    def __init__(self, name: str, region: str, lock: threading.Lock) -> None:
+        self.name = name
+        self.arn = f"arn:aws:sqs:{region}:{ACCOUNT_ID}:{name}"
+        self.url = f"https://sqs.{region}.fake/{ACCOUNT_ID}/{name}"
+        self.attributes = {"VisibilityTimeout": "30"}
+        self.visible = collections.deque()
+        self.in_flight = {}  # receipt handle -> message
+        self.deadlines = []  # heap of (visible_at, receipt handle)
+        self.condition = threading.Condition(lock)
+
+    def release_expired(self, now: float) -> None:
+        """
+        Make visible again the in-flight messages whose visibility expired.
+        """
+        while self.deadlines and self.deadlines[0][0] <= now:
+            visible_at, receipt_handle = heapq.heappop(self.deadlines)
+            message = self.in_flight.get(receipt_handle)
+            # Skip stale heap entries left by a visibility change
+            if message is not None and message.visible_at == visible_at:
+                del self.in_flight[receipt_handle]
+                message.receipt_handle = None
+                self.visible.append(message)
+
+    def hide(self, message: _FakeMessage, visibility_timeout: float) -> None:
+        message.visible_at = time.monotonic() + visibility_timeout
+        self.in_flight[message.receipt_handle] = message
+        heapq.heappush(self.deadlines, (message.visible_at, message.receipt_handle))
+
+    def enqueue(self, message: _FakeMessage) -> None:
+        self.visible.append(message)
+        self.condition.notify()
+
+
+class FakeBroker:
+    """
+    In-process stand-in for the SNS and SQS features used by this project.
+
+    It implements topics with fan-out to subscribed queues, long polling,
+    visibility timeouts, batch deletes and visibility changes, and redrive
+    to a dead letter queue after `maxReceiveCount` receives. Clients built by
+    `client` share the broker state, like boto3 clients share AWS.
+    """
+
+    def __init__(self, region: str = "eu-west-3") -> None:
+        self.region = region
+        self.lock = threading.Lock()
+        self.queues = {}  # url -> queue
+        self.topics = {}  # arn -> list of subscriptions
+        self._receipt_ids = itertools.count()
+
+    def client(self, service: str):
+        clients = {
+            "sns": FakeSNSClient,
+            "sqs": FakeSQSClient,
+            "sts": FakeSTSClient,
+        }
+        if service not in clients:
+            raise ValueError(f"Service '{service}' is not supported by FakeBroker.")
+        return clients[service](broker=self)
+
+    def async_client(self, service: str) -> "FakeAsyncClient":
+        return FakeAsyncClient(self.client(service))
+
+    def queue(self, queue_url: str, operation_name: str) -> _FakeQueue:
+        queue = self.queues.get(queue_url)
+        if queue is None:
+            raise _client_error(
+                "AWS.SimpleQueueService.NonExistentQueue",
+                "The specified queue does not exist.",
+                operation_name,
+            )
+        return queue
+
+    def queue_by_arn(self, queue_arn: str):
+        for queue in self.queues.values():
+            if queue.arn == queue_arn:
+                return queue
+        return None
+
+    def new_receipt_handle(self, message: _FakeMessage) -> str:
+        return f"{message.message_id}#{next(self._receipt_ids)}"
+
+
+class _FakeClient:
+    def __init__(self, broker: FakeBroker) -> None:
+        self.broker = broker
+        self.meta = SimpleNamespace(region_name=broker.region)
+
+
+class FakeSTSClient(_FakeClient):
+    def get_caller_identity(self) -> dict:
+        return _response(Account=ACCOUNT_ID, Arn=f"arn:aws:iam::{ACCOUNT_ID}:root")
+
+
+class FakeSNSClient(_FakeClient):
+    exceptions = SimpleNamespace(NotFoundException=NotFoundException)
+
+    def _topic_subscriptions(self, topic_arn: str, operation_name: str) -> list:
+        subscriptions = self.broker.topics.get(topic_arn)
+        if subscriptions is None:
+            raise _client_error(
+                "NotFound",
+                "Topic does not exist",
+                operation_name,
+                error_class=NotFoundException,
+            )
+        return subscriptions
+
+    def create_topic(self, Name) -> dict:  # noqa: N803
+        topic_arn = f"arn:aws:sns:{self.broker.region}:{ACCOUNT_ID}:{Name}"
+        with self.broker.lock:
+            self.broker.topics.setdefault(topic_arn, [])
+        return _response(TopicArn=topic_arn)
+
+    def get_topic_attributes(self, TopicArn) -> dict:  # noqa: N803
+        with self.broker.lock:
+            subscriptions = self._topic_subscriptions(TopicArn, "GetTopicAttributes")
+            return _response(
+                Attributes={
+                    "TopicArn": TopicArn,
+                    "SubscriptionsConfirmed": str(len(subscriptions)),
+                }
+            )
+
+    def subscribe(self, TopicArn, Protocol, Endpoint, Attributes=None) -> dict:  # noqa: N803
+        if Protocol != "sqs":
+            raise _client_error(
+                "InvalidParameter", f"Unsupported protocol {Protocol}", "Subscribe"
+            )
+        with self.broker.lock:
+            subscriptions = self._topic_subscriptions(TopicArn, "Subscribe")
+            for subscription in subscriptions:
+                if subscription["Endpoint"] != Endpoint:
+                    continue
+                # Like SNS, subscribing again only succeeds with the same attributes
+                if subscription["Attributes"] != dict(Attributes or {}):
+                    raise _client_error(
+                        "InvalidParameter",
+                        "Subscription already exists with different attributes",
+                        "Subscribe",
+                    )
+                return _response(SubscriptionArn=subscription["SubscriptionArn"])
+            subscription_arn = f"{TopicArn}:{uuid.uuid4()}"
+            subscriptions.append(
+                {
+                    "SubscriptionArn": subscription_arn,
+                    "Endpoint": Endpoint,
+                    "Attributes": dict(Attributes or {}),
+                }
+            )
+        return _response(SubscriptionArn=subscription_arn)
+
+    def list_subscriptions_by_topic(self, TopicArn) -> dict:  # noqa: N803
+        with self.broker.lock:
+            subscriptions = self._topic_subscriptions(
+                TopicArn, "ListSubscriptionsByTopic"
+            )
+            return _response(
+                Subscriptions=[
+                    {
+                        "SubscriptionArn": subscription["SubscriptionArn"],
+                        "TopicArn": TopicArn,
+                        "Protocol": "sqs",
+                        "Endpoint": subscription["Endpoint"],
+                    }
+                    for subscription in subscriptions
+                ]
+            )
+
+    def set_subscription_attributes(
+        self,
+        SubscriptionArn,  # noqa: N803
+        AttributeName,  # noqa: N803
+        AttributeValue,  # noqa: N803
+    ) -> dict:
+        with self.broker.lock:
+            for subscriptions in self.broker.topics.values():
+                for subscription in subscriptions:
+                    if subscription["SubscriptionArn"] == SubscriptionArn:
+                        subscription["Attributes"][AttributeName] = AttributeValue
+                        return _response()
+        raise _client_error(
+            "NotFound",
+            "Subscription does not exist",
+            "SetSubscriptionAttributes",
+            error_class=NotFoundException,
+        )
+
+    def _deliver(self, topic_arn, message, subject, message_attributes) -> str:
+        """
+        Fan a message out to every subscribed queue. Must hold the lock.
+        """
+        subscriptions = self._topic_subscriptions(topic_arn, "Publish")
+        message_id = str(uuid.uuid4())
+        envelope = None
+        for subscription in subscriptions:
+            queue = self.broker.queue_by_arn(subscription["Endpoint"])
+            if queue is None:
+                continue
+            filter_policy = subscription["Attributes"].get("FilterPolicy")
+            if filter_policy and not _matches_filter_policy(
+                json.loads(filter_policy), message_attributes or {}
+            ):
+                continue
+            if subscription["Attributes"].get("RawMessageDelivery") == "true":
+                queue.enqueue(_FakeMessage(message, message_attributes))
+                continue
+            if envelope is None:
+                envelope = json.dumps(
+                    {
+                        "Type": "Notification",
+                        "MessageId": message_id,
+                        "TopicArn": topic_arn,
+                        "Subject": subject,
+                        "Message": message,
+                        "Timestamp": time.strftime(
+                            "%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()
+                        ),
+                        "SignatureVersion": "1",
+                        "Signature": "FAKE",
+                        "SigningCertURL": "https://sns.fake/cert.pem",
+                        "UnsubscribeURL": "https://sns.fake/unsubscribe",
+                        "MessageAttributes": {
+                            name: {
+                                "Type": value["DataType"],
+                                "Value": value.get("StringValue"),
+                            }
+                            for name, value in (message_attributes or {}).items()
+                        },
+                    }
+                )
+            queue.enqueue(_FakeMessage(envelope))
+        return message_id
+
+    def publish(
+        self,
+        TopicArn,  # noqa: N803
+        Message,  # noqa: N803
+        Subject=None,  # noqa: N803
+        MessageAttributes=None,  # noqa: N803
+    ) -> dict:
+        with self.broker.lock:
+            message_id = self._deliver(TopicArn, Message, Subject, MessageAttributes)
+        return _response(MessageId=message_id)
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries) -> dict:  # noqa: N803
+        if len(PublishBatchRequestEntries) > 10:
+            raise _client_error(
+                "TooManyEntriesInBatchRequest",
+                "The batch request contains more entries than permissible.",
+                "PublishBatch",
+            )
+        successful = []
+        with self.broker.lock:
+            for entry in PublishBatchRequestEntries:
+                message_id = self._deliver(
+                    TopicArn,
+                    entry["Message"],
+                    entry.get("Subject"),
+                    entry.get("MessageAttributes"),
+                )
+                successful.append({"Id": entry["Id"], "MessageId": message_id})
+        return _response(Successful=successful, Failed=[])
+
+
+class FakeSQSClient(_FakeClient):
+    def create_queue(self, QueueName, Attributes=None) -> dict:  # noqa: N803
+        with self.broker.lock:
+            for queue in self.broker.queues.values():
+                if queue.name == QueueName:
+                    return _response(QueueUrl=queue.url)
+            queue = _FakeQueue(QueueName, self.broker.region, self.broker.lock)
+            queue.attributes.update(Attributes or {})
+            self.broker.queues[queue.url] = queue
+        return _response(QueueUrl=queue.url)
+
+    def get_queue_url(self, QueueName) -> dict:  # noqa: N803
+        with self.broker.lock:
+            for queue in self.broker.queues.values():
+                if queue.name == QueueName:
+                    return _response(QueueUrl=queue.url)
+        raise _client_error(
+            "AWS.SimpleQueueService.NonExistentQueue",
+            "The specified queue does not exist.",
+            "GetQueueUrl",
+        )
+
+    def get_queue_attributes(self, QueueUrl, AttributeNames=None) -> dict:  # noqa: N803
+        with self.broker.lock:
+            queue = self.broker.queue(QueueUrl, "GetQueueAttributes")
+            queue.release_expired(time.monotonic())
+            attributes = {
+                **queue.attributes,
+                "QueueArn": queue.arn,
+                "ApproximateNumberOfMessages": str(len(queue.visible)),
+                "ApproximateNumberOfMessagesNotVisible": str(len(queue.in_flight)),
+            }
+        names = AttributeNames or ["All"]
+        if "All" not in names:
+            attributes = {
+                name: value for name, value in attributes.items() if name in names
+            }
+        return _response(Attributes=attributes)
+
+    def set_queue_attributes(self, QueueUrl, Attributes) -> dict:  # noqa: N803
+        with self.broker.lock:
+            queue = self.broker.queue(QueueUrl, "SetQueueAttributes")
+            queue.attributes.update(Attributes)
+        return _response()
+
+    def send_message(self, QueueUrl, MessageBody, MessageAttributes=None) -> dict:  # noqa: N803
+        with self.broker.lock:
+            queue = self.broker.queue(QueueUrl, "SendMessage")
+            message = _FakeMessage(MessageBody, MessageAttributes)
+            queue.enqueue(message)
+        return _response(MessageId=message.message_id, MD5OfMessageBody=message.md5)
+
+    def _redrive(self, queue: _FakeQueue, message: _FakeMessage) -> bool:
+        """
+        Move a message over its receive count to the dead letter queue.
+        Must hold the lock.
+        """
+        redrive_policy = queue.attributes.get("RedrivePolicy")
+        if not redrive_policy:
+            return False
+        policy = json.loads(redrive_policy)
+        if message.receive_count < int(policy["maxReceiveCount"]):
+            return False
+        dead_letter_queue = self.broker.queue_by_arn(policy["deadLetterTargetArn"])
+        if dead_letter_queue is None:
+            return False
+        dead_letter_queue.enqueue(message)
+        return True
+
+    def receive_message(
+        self,
+        QueueUrl,  # noqa: N803
+        MaxNumberOfMessages=1,  # noqa: N803
+        WaitTimeSeconds=0,  # noqa: N803
+        VisibilityTimeout=None,  # noqa: N803
+        MessageAttributeNames=None,  # noqa: N803
+        AttributeNames=None,  # noqa: N803
+    ) -> dict:
+        deadline = time.monotonic() + WaitTimeSeconds
+        with self.broker.lock:
+            queue = self.broker.queue(QueueUrl, "ReceiveMessage")
+            if VisibilityTimeout is None:
+                VisibilityTimeout = int(queue.attributes["VisibilityTimeout"])  # noqa: N806
+            while True:
+                now = time.monotonic()
+                queue.release_expired(now)
+                messages = []
+                while queue.visible and len(messages) < MaxNumberOfMessages:
+                    message = queue.visible.popleft()
+                    if self._redrive(queue, message):
+                        continue
+                    message.receive_count += 1
+                    message.receipt_handle = self.broker.new_receipt_handle(message)
+                    queue.hide(message, VisibilityTimeout)
+                    messages.append(
+                        message.to_response(AttributeNames, MessageAttributeNames)
+                    )
+                if messages or now >= deadline:
+                    break
+                # Wake up for new messages or for the next visibility expiry
+                timeout = deadline - now
+                if queue.deadlines:
+                    timeout = min(timeout, max(0, queue.deadlines[0][0] - now))
+                queue.condition.wait(timeout=timeout)
+        if not messages:
+            return _response()
+        return _response(Messages=messages)
+
+    def delete_message(self, QueueUrl, ReceiptHandle) -> dict:  # noqa: N803
+        with self.broker.lock:
+            queue = self.broker.queue(QueueUrl, "DeleteMessage")
+            if queue.in_flight.pop(ReceiptHandle, None) is None:
+                raise _client_error(
+                    "ReceiptHandleIsInvalid",
+                    f"The receipt handle {ReceiptHandle} is not valid.",
+                    "DeleteMessage",
+                )
+        return _response()
+
+    def _batch(self, QueueUrl, Entries, operation_name, action) -> dict:  # noqa: N803
+        if len(Entries) > 10:
+            raise _client_error(
+                "AWS.SimpleQueueService.TooManyEntriesInBatchRequest",
+                "Maximum number of entries per request are 10.",
+                operation_name,
+            )
+        successful, failed = [], []
+        with self.broker.lock:
+            queue = self.broker.queue(QueueUrl, operation_name)
+            for entry in Entries:
+                message = queue.in_flight.get(entry["ReceiptHandle"])
+                if message is None:
+                    failed.append(
+                        {
+                            "Id": entry["Id"],
+                            "SenderFault": True,
+                            "Code": "ReceiptHandleIsInvalid",
+                            "Message": "The receipt handle is not valid.",
+                        }
+                    )
+                    continue
+                action(queue, message, entry)
+                successful.append({"Id": entry["Id"]})
+        return _response(Successful=successful, Failed=failed)
+
+    def delete_message_batch(self, QueueUrl, Entries) -> dict:  # noqa: N803
+        def delete(queue, message, entry):
+            del queue.in_flight[message.receipt_handle]
+
+        return self._batch(QueueUrl, Entries, "DeleteMessageBatch", delete)
+
+    def change_message_visibility_batch(self, QueueUrl, Entries) -> dict:  # noqa: N803
+        def change_visibility(queue, message, entry):
+            queue.hide(message, entry["VisibilityTimeout"])
+            if entry["VisibilityTimeout"] == 0:
+                queue.release_expired(time.monotonic())
+                queue.condition.notify()
+
+        return self._batch(
+            QueueUrl, Entries, "ChangeMessageVisibilityBatch", change_visibility
+        )
+
+
+class FakeAsyncClient:
+    """
+    aiobotocore-like client over a fake client, for the asyncio consumer:
+    every call is a coroutine, and long polls wait on the event loop
+    instead of blocking it.
+    """
+
+    poll_interval = 0.02
+
+    def __init__(self, client: _FakeClient) -> None:
+        self.client = client
+        self.meta = client.meta
+
+    async def __aenter__(self) -> "FakeAsyncClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        return None
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        async def call(**kwargs):
+            return method(**kwargs)
+
+        return call
+
+    async def receive_message(self, WaitTimeSeconds=0, **kwargs) -> dict:  # noqa: N803
+        deadline = time.monotonic() + WaitTimeSeconds
+        while True:
+            response = self.client.receive_message(WaitTimeSeconds=0, **kwargs)
+            if "Messages" in response or time.monotonic() >= deadline:
+                return response
+            await asyncio.sleep(self.poll_interval)
+
+
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+
+def get_fake_broker(region: str = "eu-west-3") -> FakeBroker:
+    """
+    Broker shared by every fake client of the process for a region.
+    """
+    with _brokers_lock:
+        if region not in _brokers:
+            _brokers[region] = FakeBroker(region=region)
+        return _brokers[region]
@@ -1,39 +1,173 @@
-import psycopg2
+import datetime
+import io
+import itertools
+import re
+import zlib
+from contextlib import contextmanager
 
-from config import logger
+from psycopg2.extras import execute_values
+
+from config import COPY_MIN_ROWS, PARTITION_PREMAKE_DAYS, RETENTION_DAYS, logger
+from extractors import RECEIVED_AT, compile_extractor
+from metrics import BATCH_SIZE, ROWS_INSERTED, STAGE_LATENCY
+from scripts.postgres_pool import get_pool
+
+
+def _copy_value(value) -> str:
+    """
+    Format a Python value as a CSV field for COPY: NULL stays unquoted.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        value = value.isoformat()
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _copy_buffer(data) -> io.StringIO:
+    """
+    Build the in-memory CSV stream sent through COPY FROM STDIN.
+    """
+    buffer = io.StringIO()
+    buffer.writelines(",".join(map(_copy_value, row)) + "\n" for row in data)
+    buffer.seek(0)
+    return buffer
+
+
+# Current time on the database clock, as naive UTC like the TIMESTAMP columns.
+# Partitions and retention all read it, never the clock of this process
+UTC_NOW = "(NOW() AT TIME ZONE 'UTC')"
+
+# Comment of the indexes created from `indexes`, the only ones reconcile drops
+MANAGED_INDEX_COMMENT = "declared in PostgresClient.indexes"
+
+
+class Index:
+    """
+    Secondary index declared by a consumer in `indexes`: `method` is the
+    Postgres access method ("btree", "brin" for append-only timestamps...),
+    and `where` makes it a partial index.
+    """
+
+    def __init__(self, *columns: str, method: str = "btree", where: str = None):
+        self.columns = columns
+        self.method = method
+        self.where = where
+
+    def name(self, table_name: str) -> str:
+        """
+        Name derived from the definition, so a changed index gets a new one.
+        """
+        name = f"{table_name}_{'_'.join(self.columns)}"
+        if self.method != "btree":
+            name += f"_{self.method}"
+        if self.where:
+            name += f"_{zlib.crc32(self.where.encode()):08x}"
+        name += "_idx"
+        if len(name) > 63:  # longer identifiers are truncated by Postgres
+            name = f"{name[:50]}_{zlib.crc32(name.encode()):08x}_idx"
+        return name
+
+    def create_sql(self, target: str, name: str, concurrently=False) -> str:
+        return (
+            f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}"
+            f"IF NOT EXISTS {name} ON {target} USING {self.method} "
+            f"({', '.join(self.columns)})"
+            f"{f' WHERE {self.where}' if self.where else ''};"
+        )
 
 
 class PostgresClient:
+    # {column: extractors.Field} declared by the consumers, see handle_messages
+    fields = None
+    # Consumers setting raw_body get the SQS bodies undecoded
+    raw_body = False
+    # Timestamp column counted per minute in the `<table>_per_minute` rollup
+    # table, kept up to date by insert_data and delete_data
+    rollup_column = None
+    # Column new tables are range-partitioned on, one partition per day, so
+    # that delete_data drops whole partitions instead of deleting rows
+    partition_column = None
+    # Secondary indexes, see Index and reconcile_indexes. Rows are appended in
+    # the order of their delete column: a BRIN index on it serves the retention
+    # range scans at a fraction of the size and insert cost of a btree
+    indexes = ()
+    # Tables written by this process -> version, moved on every commit of
+    # rows, see data_version
+    _data_versions = {}
+    _version_counter = itertools.count(1)
+
     def __init__(self, db_uri: str, primary_key: str = "id") -> None:
         """
         Initialize the Postgres client and run initial setup.
         """
         self.db_uri = db_uri
-        self.connection = None
-        self.cursor = None
+        self.pool = None
         self.primary_key = primary_key
+        self._extractor = None
         self.connect()
 
     def connect(self) -> None:
         """
-        Establish a connection to the PostgreSQL database.
+        Attach the client to the connection pool shared by the process.
         """
-        try:
-            self.connection = psycopg2.connect(self.db_uri)
-            self.cursor = self.connection.cursor()
-            logger.info("Connected to PostgreSQL database.")
-        except Exception as e:
-            logger.error(f"Error connecting to the database: {e}")
-            raise
+        self.pool = get_pool(self.db_uri)
+
+    def handle_messages(self, message_bodies) -> list:
+        """
+        Turn a batch of decoded SNS messages into rows to insert.
+        Consumers declaring `fields` get an extractor compiled on first use.
+        This is the default adapter for consumers that only define a
+        per-message `handle_message(message_body)` returning a list of rows.
+        """
+        if self.fields is not None:
+            if self._extractor is None:
+                if list(self.fields) != list(self.columns):
+                    raise ValueError("Fields must map the columns, in order.")
+                self._extractor = compile_extractor(self.fields)
+            # Naive UTC, like the timestamps converted by extractors.to_timestamp
+            received_at = datetime.datetime.now(datetime.timezone.utc).replace(
+                tzinfo=None
+            )
+            return self._extractor(message_bodies, received_at)
+
+        if type(self).handle_message is PostgresClient.handle_message:
+            raise NotImplementedError(
+                "Consumers must declare fields or handle_message."
+            )
+        rows = []
+        for message_body in message_bodies:
+            rows.extend(self.handle_message(message_body))
+        return rows
+
+    def handle_message(self, message_body) -> list:
+        """
+        Rows of a single decoded SNS message, see handle_messages.
+        """
+        return self.handle_messages([message_body])
+
+    @contextmanager
+    def transaction(self):
+        """
+        Check out a pooled connection for one transaction.
+        Commits when the block succeeds and rolls back otherwise.
+        """
+        with self.pool.connection() as connection:
+            try:
+                with connection.cursor() as cursor:
+                    yield cursor
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
 
     def execute_query(self, query: str) -> list:
-        with self.connection.cursor() as cursor:
+        with self.transaction() as cursor:
             cursor.execute(query)
             try:
                 result = cursor.fetchall()
             except Exception:
                 result = None
-            self.connection.commit()
             return result
 
     def schema_exists(self, schema_name: str) -> bool:
@@ -51,8 +185,9 @@ class PostgresClient:
                     WHERE schema_name = %s
                 );
             """
-            self.cursor.execute(check_schema_sql, (schema_name,))
-            return self.cursor.fetchone()[0]
+            with self.transaction() as cursor:
+                cursor.execute(check_schema_sql, (schema_name,))
+                return cursor.fetchone()[0]
         except Exception as e:
             logger.error(f"Error checking existence of schema '{schema_name}': {e}")
             raise
@@ -73,8 +208,9 @@ class PostgresClient:
                     AND table_name = %s
                 );
             """
-            self.cursor.execute(check_table_sql, (schema_name, table_name))
-            return self.cursor.fetchone()[0]
+            with self.transaction() as cursor:
+                cursor.execute(check_table_sql, (schema_name, table_name))
+                return cursor.fetchone()[0]
         except Exception as e:
             logger.error(
                 f"Error checking existence of table '{schema_name}.{table_name}': {e}"
@@ -90,8 +226,8 @@ class PostgresClient:
                 logger.info(f"Schema '{schema_name}' already exists.")
                 return
             create_schema_sql = f"CREATE SCHEMA IF NOT EXISTS {schema_name};"
-            self.cursor.execute(create_schema_sql)
-            self.connection.commit()
+            with self.transaction() as cursor:
+                cursor.execute(create_schema_sql)
             logger.info(f"Schema '{schema_name}' created successfully.")
         except Exception as e:
             logger.error(f"Error creating schema '{schema_name}': {e}")
@@ -114,22 +250,373 @@ class PostgresClient:
         try:
             if self.table_exists(schema_name, table_name):
                 logger.info(f"Table '{schema_name}.{table_name}' already exists.")
+                if self.partition_column is not None:
+                    if self.is_partitioned(schema_name, table_name):
+                        self._check_partition_column()
+                        self.create_partitions(schema_name, table_name)
+                    else:
+                        logger.warning(
+                            f"Table '{schema_name}.{table_name}' is not partitioned, "
+                            f"retention keeps deleting rows."
+                        )
+                        self.partition_column = None
+                self.reconcile_indexes(schema_name, table_name)
+                self.get_or_create_rollup_table(schema_name, table_name)
                 return
             self.columns = list(columns.keys())
-            column_definitions = ", ".join(
-                [f"{col} {dtype}" for col, dtype in columns.items()]
-            )
-            create_table_sql = (
-                f"CREATE TABLE IF NOT EXISTS {schema_name}.{table_name}"
-                f"({column_definitions});"
-            )
-            self.cursor.execute(create_table_sql)
-            self.connection.commit()
+            if self.partition_column is not None:
+                self._check_partition_column()
+                create_table_sql = self._partitioned_table_sql(
+                    schema_name, table_name, columns
+                )
+            else:
+                column_definitions = ", ".join(
+                    [f"{col} {dtype}" for col, dtype in columns.items()]
+                )
+                create_table_sql = (
+                    f"CREATE TABLE IF NOT EXISTS {schema_name}.{table_name}"
+                    f"({column_definitions});"
+                )
+            with self.transaction() as cursor:
+                cursor.execute(create_table_sql)
             logger.info(f"Table '{schema_name}.{table_name}' created successfully.")
+            if self.partition_column is not None:
+                self.create_partitions(schema_name, table_name)
+            # The table is empty, no need to build the indexes concurrently
+            self.reconcile_indexes(schema_name, table_name, concurrently=False)
+            self.get_or_create_rollup_table(schema_name, table_name)
         except Exception as e:
             logger.error(f"Error creating table '{schema_name}.{table_name}': {e}")
             raise
 
+    def _check_partition_column(self) -> None:
+        """
+        Refuse to partition on the receive time: as part of the primary key,
+        it would tell duplicate deliveries of a message apart.
+        """
+        if self.fields and self.fields.get(self.partition_column) is RECEIVED_AT:
+            raise ValueError(
+                f"Cannot partition on '{self.partition_column}', it holds the "
+                f"receive time and would defeat deduplication."
+            )
+
+    def _partitioned_table_sql(self, schema_name, table_name, columns) -> str:
+        """
+        CREATE TABLE of a table partitioned by range of `partition_column`,
+        with a default partition for the rows outside the daily ones.
+        The primary key of a partitioned table must hold the partition column.
+        """
+        primary_key = []
+        column_definitions = []
+        for col, dtype in columns.items():
+            definition = re.sub(r"\s+PRIMARY KEY", "", dtype, flags=re.IGNORECASE)
+            if definition != dtype:
+                primary_key.append(col)
+            column_definitions.append(f"{col} {definition}")
+        if primary_key:
+            primary_key.append(self.partition_column)
+            column_definitions.append(f"PRIMARY KEY ({', '.join(primary_key)})")
+        return (
+            f"CREATE TABLE IF NOT EXISTS {schema_name}.{table_name}"
+            f"({', '.join(column_definitions)}) "
+            f"PARTITION BY RANGE ({self.partition_column}); "
+            f"CREATE TABLE IF NOT EXISTS {schema_name}.{table_name}_default "
+            f"PARTITION OF {schema_name}.{table_name} DEFAULT;"
+        )
+
+    @contextmanager
+    def autocommit(self):
+        """
+        Check out a pooled connection in autocommit mode, for the statements
+        that cannot run inside a transaction block.
+        """
+        with self.pool.connection() as connection:
+            connection.autocommit = True
+            try:
+                with connection.cursor() as cursor:
+                    yield cursor
+            finally:
+                connection.autocommit = False
+
+    @contextmanager
+    def advisory_lock(self, name: str):
+        """
+        Try to take the session advisory lock `name` on a connection held for
+        the block, and yield whether it was taken: the processes sharing the
+        database run a job guarded by it one at a time.
+        """
+        with self.autocommit() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s));", (name,))
+            acquired = cursor.fetchone()[0]
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    cursor.execute("SELECT pg_advisory_unlock(hashtext(%s));", (name,))
+
+    def list_indexes(self, schema_name, table_name, names=()) -> dict:
+        """
+        Indexes of a table created from `indexes`: {name: is valid}. They are
+        found by their comment, or by their declared `names` as the comment
+        is only set once an index is built. An index whose concurrent build
+        failed is left invalid, and uncommented.
+        """
+        with self.transaction() as cursor:
+            cursor.execute(
+                """
+                SELECT i.relname, x.indisvalid
+                FROM pg_index AS x
+                JOIN pg_class AS i ON i.oid = x.indexrelid
+                JOIN pg_class AS t ON t.oid = x.indrelid
+                JOIN pg_namespace AS n ON n.oid = t.relnamespace
+                WHERE n.nspname = %s AND t.relname = %s
+                AND (obj_description(i.oid, 'pg_class') = %s
+                     OR i.relname = ANY(%s));
+                """,
+                (schema_name, table_name, MANAGED_INDEX_COMMENT, list(names)),
+            )
+            return dict(cursor.fetchall())
+
+    def reconcile_indexes(self, schema_name, table_name, concurrently=True) -> None:
+        """
+        Create the declared indexes missing from the table, rebuild the
+        invalid ones, and drop the ones no longer declared.
+        Existing tables are indexed concurrently, without blocking inserts:
+        a partitioned table gets its index ON ONLY itself, then built on
+        each partition concurrently and attached.
+        """
+        target = f"{schema_name}.{table_name}"
+        declared = {index.name(table_name): index for index in self.indexes}
+        existing = self.list_indexes(schema_name, table_name, declared)
+        partitioned = concurrently and self.is_partitioned(schema_name, table_name)
+        for name, valid in list(existing.items()):
+            if name in declared and (valid or partitioned):
+                # The partitions of an invalid partitioned index are resumed
+                continue
+            # Partitioned indexes cannot be dropped concurrently
+            concurrent = "CONCURRENTLY " if concurrently and not partitioned else ""
+            with self.autocommit() as cursor:
+                cursor.execute(f"DROP INDEX {concurrent}{schema_name}.{name};")
+            logger.info(f"Index '{schema_name}.{name}' dropped.")
+            existing.pop(name)
+        for name, index in declared.items():
+            if existing.get(name):
+                continue
+            if partitioned:
+                self._create_partitioned_index(schema_name, table_name, name, index)
+            else:
+                # CREATE INDEX CONCURRENTLY must be alone in its statement
+                with self.autocommit() as cursor:
+                    cursor.execute(index.create_sql(target, name, concurrently))
+            with self.autocommit() as cursor:
+                cursor.execute(
+                    f"COMMENT ON INDEX {schema_name}.{name} "
+                    f"IS '{MANAGED_INDEX_COMMENT}';"
+                )
+            logger.info(f"Index '{schema_name}.{name}' created.")
+
+    def _create_partitioned_index(self, schema_name, table_name, name, index):
+        """
+        Index a partitioned table without locking it: the index is created
+        ON ONLY the table, invalid, then built concurrently on each
+        partition not yet covered and attached. It turns valid once all the
+        partitions are attached.
+        """
+        with self.autocommit() as cursor:
+            cursor.execute(index.create_sql(f"ONLY {schema_name}.{table_name}", name))
+            cursor.execute(
+                """
+                SELECT c.relname
+                FROM pg_inherits AS i
+                JOIN pg_class AS c ON c.oid = i.inhrelid
+                WHERE i.inhparent = %s::regclass
+                AND NOT EXISTS (
+                    SELECT 1
+                    FROM pg_inherits AS ii
+                    JOIN pg_index AS x ON x.indexrelid = ii.inhrelid
+                    WHERE ii.inhparent = %s::regclass AND x.indrelid = c.oid
+                );
+                """,
+                (f"{schema_name}.{table_name}", f"{schema_name}.{name}"),
+            )
+            partitions = [row[0] for row in cursor.fetchall()]
+        for partition in partitions:
+            child = index.name(partition)
+            if self.list_indexes(schema_name, partition, [child]).get(child) is False:
+                with self.autocommit() as cursor:
+                    cursor.execute(f"DROP INDEX CONCURRENTLY {schema_name}.{child};")
+            with self.autocommit() as cursor:
+                cursor.execute(
+                    index.create_sql(f"{schema_name}.{partition}", child, True)
+                )
+                cursor.execute(
+                    f"ALTER INDEX {schema_name}.{name} "
+                    f"ATTACH PARTITION {schema_name}.{child};"
+                )
+
+    def is_partitioned(self, schema_name, table_name) -> bool:
+        with self.transaction() as cursor:
+            cursor.execute(
+                """
+                SELECT c.relkind = 'p'
+                FROM pg_class AS c
+                JOIN pg_namespace AS n ON n.oid = c.relnamespace
+                WHERE n.nspname = %s AND c.relname = %s;
+                """,
+                (schema_name, table_name),
+            )
+            row = cursor.fetchone()
+        return bool(row and row[0])
+
+    @staticmethod
+    def partition_name(table_name: str, day: datetime.date) -> str:
+        return f"{table_name}_p{day:%Y%m%d}"
+
+    def list_partitions(self, schema_name, table_name) -> dict:
+        """
+        Daily partitions of a table: {day: partition name}.
+        """
+        with self.transaction() as cursor:
+            cursor.execute(
+                """
+                SELECT c.relname
+                FROM pg_inherits AS i
+                JOIN pg_class AS c ON c.oid = i.inhrelid
+                JOIN pg_class AS p ON p.oid = i.inhparent
+                JOIN pg_namespace AS n ON n.oid = p.relnamespace
+                WHERE n.nspname = %s AND p.relname = %s;
+                """,
+                (schema_name, table_name),
+            )
+            names = [row[0] for row in cursor.fetchall()]
+        pattern = re.compile(rf"{re.escape(table_name)}_p(\d{{8}})")
+        partitions = {}
+        for name in names:
+            match = pattern.fullmatch(name)
+            if match:
+                day = datetime.datetime.strptime(match.group(1), "%Y%m%d").date()
+                partitions[day] = name
+        return partitions
+
+    def create_partitions(
+        self, schema_name, table_name, days_ahead: int = PARTITION_PREMAKE_DAYS
+    ) -> None:
+        """
+        Create the daily partitions from today to `days_ahead` days ahead, so
+        that inserts never wait for one. Called at startup and by delete_data.
+        """
+        today = self.execute_query(f"SELECT {UTC_NOW}::DATE;")[0][0]
+        existing = self.list_partitions(schema_name, table_name)
+        for offset in range(days_ahead + 1):
+            day = today + datetime.timedelta(days=offset)
+            if day in existing:
+                continue
+            partition = self.partition_name(table_name, day)
+            try:
+                with self.transaction() as cursor:
+                    cursor.execute(
+                        f"CREATE TABLE IF NOT EXISTS {schema_name}.{partition} "
+                        f"PARTITION OF {schema_name}.{table_name} "
+                        f"FOR VALUES FROM (%s) TO (%s);",
+                        (day, day + datetime.timedelta(days=1)),
+                    )
+                logger.info(f"Partition '{schema_name}.{partition}' created.")
+            except Exception as e:
+                # e.g. the default partition already holds rows of that day
+                logger.error(f"Error creating partition '{partition}': {e}")
+
+    def data_version(self, schema_name, table_name) -> int:
+        """
+        Version of the rows of a table, moved whenever this process commits
+        changes to them. Results computed at the same version are still valid.
+        """
+        return self._data_versions.get(f"{schema_name}.{table_name}", 0)
+
+    def _bump_data_version(self, target: str) -> None:
+        self._data_versions[target] = next(self._version_counter)
+
+    @staticmethod
+    def rollup_table(target: str) -> str:
+        return f"{target}_per_minute"
+
+    def _rollup_minute(self, alias=None) -> str:
+        """
+        Minute of a row in the rollup table. Rows without timestamp are
+        counted under '-infinity', the primary key cannot be NULL.
+        """
+        column = (
+            self.rollup_column if alias is None else f"{alias}.{self.rollup_column}"
+        )
+        return f"COALESCE(DATE_TRUNC('minute', {column}), '-infinity')"
+
+    def get_or_create_rollup_table(self, schema_name, table_name) -> None:
+        """
+        Create the per-minute rollup table of a table, filled from the rows
+        already in the table.
+        """
+        if self.rollup_column is None:
+            return
+        rollup_table = self.rollup_table(f"{schema_name}.{table_name}")
+        if self.table_exists(schema_name, f"{table_name}_per_minute"):
+            return
+        with self.transaction() as cursor:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {rollup_table}"
+                f"(minute TIMESTAMP PRIMARY KEY, count BIGINT NOT NULL);"
+            )
+        logger.info(f"Table '{rollup_table}' created successfully.")
+        self.rebuild_rollup(schema_name, table_name)
+
+    def rebuild_rollup(self, schema_name, table_name) -> None:
+        """
+        Recompute the rollup table from the raw rows, e.g. after a backfill.
+        Inserts into the table wait for the end of the rebuild.
+        """
+        target = f"{schema_name}.{table_name}"
+        rollup_table = self.rollup_table(target)
+        with self.transaction() as cursor:
+            cursor.execute(f"LOCK TABLE {target} IN SHARE MODE;")
+            cursor.execute(f"DELETE FROM {rollup_table};")
+            cursor.execute(
+                f"INSERT INTO {rollup_table}(minute, count) "
+                f"SELECT {self._rollup_minute()}, COUNT(*) FROM {target} GROUP BY 1;"
+            )
+            nb_minutes = cursor.rowcount
+        self._bump_data_version(target)
+        logger.info(f"Rebuilt '{rollup_table}': {nb_minutes} minutes.")
+
+    def _with_rollup(self, target: str, insert_sql: str, update_key=None) -> str:
+        """
+        Wrap an INSERT so that the same statement adds the rows it created to
+        the rollup table. An INSERT ... DO NOTHING only returns created rows.
+        For an upsert on `update_key`, the rows returned are created or
+        updated ones: the previous value of an updated row, read from the
+        table as it was before the statement, is taken off its minute.
+        """
+        if self.rollup_column is None:
+            return insert_sql
+        rollup_table = self.rollup_table(target)
+        minute = self._rollup_minute()
+        returning, old_rows = self.rollup_column, ""
+        if update_key is not None:
+            key = [column.strip() for column in update_key.split(",")]
+            returning = ", ".join([self.rollup_column, *key])
+            old_rows = (
+                f"UNION ALL SELECT {self._rollup_minute('t')}, -1 "
+                f"FROM {target} AS t JOIN inserted USING ({', '.join(key)}) "
+            )
+        return (
+            f"WITH inserted AS ({insert_sql.rstrip().rstrip(';')} "
+            f"RETURNING {returning}), "
+            f"deltas(minute, delta) AS (SELECT {minute}, 1 FROM inserted "
+            f"{old_rows}) "
+            f"INSERT INTO {rollup_table}(minute, count) "
+            f"SELECT minute, SUM(delta) FROM deltas "
+            f"GROUP BY 1 HAVING SUM(delta) <> 0 ORDER BY 1 "
+            f"ON CONFLICT (minute) DO UPDATE "
+            f"SET count = {rollup_table}.count + EXCLUDED.count;"
+        )
+
     @staticmethod
     def insert_data_strategy(
         primary_key: str = "id", strategy: str = "skip", columns=None
@@ -150,6 +637,103 @@ class PostgresClient:
             )
         return sql_statement
 
+    def deduplicate_rows(self, data, columns, strategy="skip") -> list:
+        """
+        Keep one row per primary key, as a single multi-row INSERT cannot
+        touch the same key twice: the first row wins for 'skip', the last
+        one for 'update'.
+        """
+        columns = list(columns)
+        if self.primary_key not in columns:
+            return list(data)
+        key_index = columns.index(self.primary_key)
+        rows = {}
+        for row in data:
+            key = row[key_index]
+            if strategy == "update":
+                rows.pop(key, None)
+                rows[key] = row
+            else:
+                rows.setdefault(key, row)
+        return list(rows.values())
+
+    def _insert_values(
+        self, cursor, target, columns_str, data, conflict_sql, update_key=None
+    ):
+        """
+        Insert rows with a single multi-row INSERT ... VALUES statement.
+        """
+        insert_sql = f"INSERT INTO {target}({columns_str}) VALUES %s {conflict_sql}"
+        insert_sql = self._with_rollup(target, insert_sql, update_key)
+        execute_values(cursor, insert_sql, data, page_size=len(data))
+
+    @staticmethod
+    def _staging_table(target: str) -> tuple:
+        """
+        Name of the temporary staging table of `target`, and its DDL.
+        """
+        staging_table = f"_staging_{target.replace('.', '_')}"
+        return staging_table, (
+            f"CREATE TEMP TABLE {staging_table} "
+            f"(LIKE {target} INCLUDING DEFAULTS) ON COMMIT DROP;"
+        )
+
+    def _merge_staging_sql(
+        self, target, staging_table, columns_str, conflict_sql, update_key=None
+    ) -> str:
+        return self._with_rollup(
+            target,
+            f"INSERT INTO {target}({columns_str}) "
+            f"SELECT {columns_str} FROM {staging_table} {conflict_sql}",
+            update_key,
+        )
+
+    def _insert_copy(
+        self, cursor, target, columns_str, data, conflict_sql, update_key=None
+    ):
+        """
+        Stream rows into a temporary staging table through COPY FROM STDIN,
+        then merge them into the target table.
+        """
+        staging_table, create_sql = self._staging_table(target)
+        cursor.execute(create_sql)
+        cursor.copy_expert(
+            f"COPY {staging_table}({columns_str}) FROM STDIN WITH (FORMAT csv)",
+            _copy_buffer(data),
+        )
+        cursor.execute(
+            self._merge_staging_sql(
+                target, staging_table, columns_str, conflict_sql, update_key
+            )
+        )
+
+    def _insert_statement(self, columns, strategy) -> tuple:
+        """
+        Columns, ON CONFLICT clause and upsert key of an insert.
+        """
+        if columns is None:
+            # If columns are not provided, use the previously defined ones
+            if not hasattr(self, "columns"):
+                raise ValueError("Columns must be defined before inserting data.")
+            columns = self.columns
+
+        primary_key = self.primary_key
+        if self.partition_column is not None:
+            if strategy == "update":
+                # A new partition column value would insert a second row
+                raise ValueError("Partitioned tables only support 'skip'.")
+            # Conflicts are detected per partition, on the partitioned key
+            primary_key = f"{primary_key}, {self.partition_column}"
+        conflict_sql = self.insert_data_strategy(
+            primary_key=primary_key, strategy=strategy, columns=columns
+        )
+        return columns, conflict_sql, primary_key if strategy == "update" else None
+
+    def _record_insert(self, target: str, nb_rows: int) -> None:
+        self._bump_data_version(target)
+        ROWS_INSERTED.inc(nb_rows)
+        BATCH_SIZE.labels(operation="insert_data").observe(nb_rows)
+
     def insert_data(
         self,
         schema_name="public",
@@ -160,30 +744,80 @@ class PostgresClient:
     ) -> None:
         """
         Insert data into the PostgreSQL table.
+
+        Batches of at least COPY_MIN_ROWS rows go through COPY and a staging
+        table, smaller ones through a multi-row INSERT.
         """
         if data is None:
             raise ValueError("Data must be provided to insert into the table.")
-
-        if columns is None:
-            # If columns are not provided, use the previously defined ones
-            if not hasattr(self, "columns"):
-                raise ValueError("Columns must be defined before inserting data.")
-            columns = self.columns
-
-        insert_sql_statement = self.insert_data_strategy(
-            primary_key=self.primary_key, strategy=strategy, columns=columns
+        columns, insert_sql_statement, update_key = self._insert_statement(
+            columns, strategy
         )
         try:
-            columns_str = ", ".join(columns)
-            placeholders = ", ".join(["%s"] * len(columns))
+            data = self.deduplicate_rows(data=data, columns=columns, strategy=strategy)
+            if data:
+                target = f"{schema_name}.{table_name}"
+                columns_str = ", ".join(columns)
+                if len(data) >= COPY_MIN_ROWS:
+                    insert_method = self._insert_copy
+                else:
+                    insert_method = self._insert_values
+                with STAGE_LATENCY.labels(stage="insert_data").time():
+                    with self.transaction() as cursor:
+                        insert_method(
+                            cursor,
+                            target,
+                            columns_str,
+                            data,
+                            insert_sql_statement,
+                            update_key=update_key,
+                        )
+                self._record_insert(target, len(data))
+            logger.info(f"Inserted {len(data)} rows into '{schema_name}.{table_name}'.")
+        except Exception as e:
+            logger.error(f"Error inserting data into '{schema_name}.{table_name}': {e}")
+            raise
 
-            insert_sql = (
-                f"INSERT INTO {schema_name}.{table_name}"
-                f"({columns_str}) VALUES ({placeholders})"
-                f"{insert_sql_statement}"
-            )
-            self.cursor.executemany(insert_sql, data)
-            self.connection.commit()
+    async def insert_data_async(
+        self,
+        connection,
+        schema_name="public",
+        table_name="users",
+        strategy="skip",
+        data=None,
+        columns=None,
+    ) -> None:
+        """
+        Insert data like insert_data, on an asyncpg `connection` of the
+        asyncio consumer. Rows go through the binary COPY of asyncpg into the
+        staging table, whatever their number.
+        """
+        if data is None:
+            raise ValueError("Data must be provided to insert into the table.")
+        columns, insert_sql_statement, update_key = self._insert_statement(
+            columns, strategy
+        )
+        try:
+            data = self.deduplicate_rows(data=data, columns=columns, strategy=strategy)
+            if data:
+                target = f"{schema_name}.{table_name}"
+                staging_table, create_sql = self._staging_table(target)
+                with STAGE_LATENCY.labels(stage="insert_data").time():
+                    async with connection.transaction():
+                        await connection.execute(create_sql)
+                        await connection.copy_records_to_table(
+                            staging_table, records=data, columns=list(columns)
+                        )
+                        await connection.execute(
+                            self._merge_staging_sql(
+                                target,
+                                staging_table,
+                                ", ".join(columns),
+                                insert_sql_statement,
+                                update_key,
+                            )
+                        )
+                self._record_insert(target, len(data))
             logger.info(f"Inserted {len(data)} rows into '{schema_name}.{table_name}'.")
         except Exception as e:
             logger.error(f"Error inserting data into '{schema_name}.{table_name}': {e}")
@@ -196,29 +830,137 @@ class PostgresClient:
         delete_column: str = "inserted_at",
     ) -> None:
         """
-        Delete data from the PostgreSQL table.
+        Delete data older than RETENTION_DAYS from the PostgreSQL table.
+        Partitioned tables drop their expired daily partitions instead.
         """
         try:
-            delete_sql = f"""DELETE FROM {schema_name}.{table_name}
-            WHERE {delete_column} < NOW() - INTERVAL '14 days';
-            """
-            self.cursor.execute(delete_sql)
-            self.connection.commit()
+            target = f"{schema_name}.{table_name}"
+            if delete_column == self.partition_column:
+                self.create_partitions(schema_name, table_name)
+                self.drop_expired_partitions(schema_name, table_name)
+                # Only the rows outside the daily partitions are left to delete
+                target = f"{schema_name}.{table_name}_default"
+            with self.transaction() as cursor:
+                self._delete_expired_rows(
+                    cursor, f"{schema_name}.{table_name}", target, delete_column
+                )
+            self._bump_data_version(f"{schema_name}.{table_name}")
             logger.info(
-                f"Deleted rows from '{schema_name}.{table_name}' older than 14 days."
+                f"Deleted rows from '{schema_name}.{table_name}' older than "
+                f"{RETENTION_DAYS} days."
             )
         except Exception as e:
             logger.error(f"Error deleting data from '{schema_name}.{table_name}': {e}")
             raise
 
+    def _delete_expired_rows(
+        self, cursor, table, target, delete_column, limit: int = None
+    ) -> int:
+        """
+        Delete the expired rows of `target`, `table` itself or one of its
+        partitions, and remove them from the rollup of `table`. With a
+        `limit`, delete at most that many rows, located by ctid.
+        Returns the number of deleted rows.
+        """
+        expired = f"{delete_column} < {UTC_NOW} - INTERVAL '{RETENTION_DAYS} days'"
+        if limit is not None:
+            expired = (
+                f"ctid = ANY(ARRAY(SELECT ctid FROM {target} "
+                f"WHERE {expired} LIMIT {int(limit)}))"
+            )
+        delete_sql = f"DELETE FROM {target} WHERE {expired}"
+        if self.rollup_column is None:
+            cursor.execute(delete_sql)
+            return cursor.rowcount
+        cursor.execute(
+            self._without_rollup(table, f"{delete_sql} RETURNING {self.rollup_column}")
+        )
+        nb_deleted = cursor.fetchone()[0]
+        cursor.execute(f"DELETE FROM {self.rollup_table(table)} WHERE count <= 0;")
+        return nb_deleted
+
+    def delete_expired_chunk(
+        self, schema_name, table_name, delete_column, chunk_size: int
+    ) -> int:
+        """
+        Delete at most `chunk_size` rows older than RETENTION_DAYS in a short
+        transaction, from the default partition of a partitioned table.
+        Returns the number of deleted rows, 0 once nothing is left to delete.
+        """
+        table = f"{schema_name}.{table_name}"
+        target = table
+        if delete_column == self.partition_column:
+            target = f"{table}_default"
+        with self.transaction() as cursor:
+            nb_deleted = self._delete_expired_rows(
+                cursor, table, target, delete_column, limit=chunk_size
+            )
+        if nb_deleted:
+            self._bump_data_version(table)
+        return nb_deleted
+
+    def drop_expired_partitions(self, schema_name, table_name) -> None:
+        """
+        Detach and drop the daily partitions whose rows are all older than
+        RETENTION_DAYS. Dropping a partition leaves no dead tuples to vacuum.
+        """
+        target = f"{schema_name}.{table_name}"
+        cutoff = self.execute_query(
+            f"SELECT {UTC_NOW} - INTERVAL '{RETENTION_DAYS} days';"
+        )[0][0]
+        partitions = self.list_partitions(schema_name, table_name)
+        for day, partition in sorted(partitions.items()):
+            # The partition of `day` holds the rows until the next midnight
+            next_day = day + datetime.timedelta(days=1)
+            if datetime.datetime.combine(next_day, datetime.time.min) > cutoff:
+                continue
+            with self.transaction() as cursor:
+                if self.rollup_column is not None:
+                    cursor.execute(
+                        self._without_rollup(
+                            target,
+                            f"SELECT {self.rollup_column} "
+                            f"FROM {schema_name}.{partition}",
+                        )
+                    )
+                    cursor.execute(
+                        f"DELETE FROM {self.rollup_table(target)} WHERE count <= 0;"
+                    )
+                cursor.execute(
+                    f"ALTER TABLE {target} DETACH PARTITION {schema_name}.{partition};"
+                )
+                cursor.execute(f"DROP TABLE {schema_name}.{partition};")
+            logger.info(f"Partition '{schema_name}.{partition}' dropped.")
+
+    def _without_rollup(self, target: str, rows_sql: str) -> str:
+        """
+        Subtract from the rollup table the rows returned by `rows_sql`, a
+        DELETE ... RETURNING or SELECT of the rollup column, in the same
+        statement. The statement returns the number of rows.
+        """
+        rollup_table = self.rollup_table(target)
+        return (
+            f"WITH deleted AS ({rows_sql.strip().rstrip(';')}), "
+            f"counts AS (SELECT {self._rollup_minute()} AS minute, COUNT(*) AS count "
+            f"FROM deleted GROUP BY 1), "
+            f"updated AS (UPDATE {rollup_table} AS rollup "
+            f"SET count = rollup.count - counts.count "
+            f"FROM counts WHERE rollup.minute = counts.minute) "
+            f"SELECT COALESCE(SUM(count), 0) FROM counts;"
+        )
+
     def delete_table(self, schema_name="public", table_name="users") -> None:
         """
         Delete the PostgreSQL table.
         """
         try:
             delete_sql = f"DROP TABLE IF EXISTS {schema_name}.{table_name};"
-            self.cursor.execute(delete_sql)
-            self.connection.commit()
+            with self.transaction() as cursor:
+                cursor.execute(delete_sql)
+                if self.rollup_column is not None:
+                    rollup_table = self.rollup_table(f"{schema_name}.{table_name}")
+                    cursor.execute(f"DROP TABLE IF EXISTS {rollup_table};")
+            self._bump_data_version(f"{schema_name}.{table_name}")
             logger.info(f"Table '{schema_name}.{table_name}' deleted successfully.")
         except Exception as e:
             logger.error(f"Error deleting table '{schema_name}.{table_name}': {e}")
@@ -230,8 +972,9 @@ class PostgresClient:
         """
         try:
             count_sql = f"SELECT COUNT(*) FROM {schema_name}.{table_name};"
-            self.cursor.execute(count_sql)
-            count = self.cursor.fetchone()[0]
+            with self.transaction() as cursor:
+                cursor.execute(count_sql)
+                count = cursor.fetchone()[0]
             logger.info(f"Count of elements in '{schema_name}.{table_name}': {count}")
             return count
         except Exception as e:
@@ -242,13 +985,7 @@ class PostgresClient:
 
     def close(self) -> None:
         """
-        Close the cursor and connection to the PostgreSQL database.
+        Release the client. Connections go back to the shared pool after every
+        query, the pool itself is closed with `close_pools` at shutdown.
         """
-        try:
-            if self.cursor:
-                self.cursor.close()
-            if self.connection:
-                self.connection.close()
-                logger.info("PostgreSQL connection closed.")
-        except Exception as e:
-            logger.error(f"Error closing PostgreSQL connection: {e}")
+        self.pool = None
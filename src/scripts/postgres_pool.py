@@ -0,0 +1,212 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+from config import (
+    POSTGRES_POOL_CHECKOUT_TIMEOUT,
+    POSTGRES_POOL_HEALTH_CHECK_AFTER,
+    POSTGRES_POOL_MAX_IDLE,
+    POSTGRES_POOL_MAX_SIZE,
+    POSTGRES_POOL_MIN_SIZE,
+    logger,
+)
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections.
+
+    Connections are checked out for one unit of work and handed back right
+    after. A connection idle for more than `health_check_after` seconds is
+    pinged before reuse, and connections idle for more than `max_idle` seconds
+    are closed as long as `min_size` connections remain open.
+    """
+
+    def __init__(
+        self,
+        db_uri: str,
+        min_size: int = POSTGRES_POOL_MIN_SIZE,
+        max_size: int = POSTGRES_POOL_MAX_SIZE,
+        max_idle: float = POSTGRES_POOL_MAX_IDLE,
+        health_check_after: float = POSTGRES_POOL_HEALTH_CHECK_AFTER,
+        checkout_timeout: float = POSTGRES_POOL_CHECKOUT_TIMEOUT,
+    ) -> None:
+        if not 0 <= min_size <= max_size or max_size < 1:
+            raise ValueError("Pool sizes must satisfy 0 <= min_size <= max_size.")
+        self.db_uri = db_uri
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.health_check_after = health_check_after
+        self.checkout_timeout = checkout_timeout
+        self._condition = threading.Condition()
+        self._idle = []  # (connection, last_used) pairs, most recently used last
+        self._size = 0
+        self._closed = False
+
+        for _ in range(min_size):
+            self._size += 1
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        try:
+            connection = psycopg2.connect(self.db_uri)
+            logger.info("Connected to PostgreSQL database.")
+            return connection
+        except Exception as e:
+            logger.error(f"Error connecting to the database: {e}")
+            raise
+
+    def _is_healthy(self, connection, last_used: float) -> bool:
+        if connection.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_after:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            connection.rollback()
+            return True
+        except Exception as e:
+            logger.warning(f"Discarding unhealthy PostgreSQL connection: {e}")
+            return False
+
+    def _discard(self, connection) -> None:
+        """
+        Close a connection and free its slot. Must be called with the lock held.
+        """
+        self._size -= 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+        self._condition.notify()
+
+    def _recycle_idle(self) -> None:
+        """
+        Close connections idle for too long. Must be called with the lock held.
+        """
+        now = time.monotonic()
+        # The least recently used connections come first
+        while (
+            self._idle
+            and self._size > self.min_size
+            and now - self._idle[0][1] > self.max_idle
+        ):
+            connection, _ = self._idle.pop(0)
+            self._discard(connection)
+
+    def getconn(self):
+        """
+        Check out a connection, opening a new one if the pool is not full.
+        """
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            with self._condition:
+                candidate = None
+                while candidate is None:
+                    if self._closed:
+                        raise PoolError("Connection pool is closed.")
+                    self._recycle_idle()
+                    if self._idle:
+                        candidate = self._idle.pop()
+                    elif self._size < self.max_size:
+                        self._size += 1
+                        break
+                    else:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise PoolError(
+                                f"No PostgreSQL connection available after "
+                                f"{self.checkout_timeout}s "
+                                f"(max_size={self.max_size})."
+                            )
+                        self._condition.wait(timeout=remaining)
+
+            if candidate is None:
+                break
+            # The health check runs outside the lock to not block other threads
+            connection, last_used = candidate
+            if self._is_healthy(connection, last_used):
+                return connection
+            with self._condition:
+                self._discard(connection)
+
+        try:
+            return self._connect()
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+
+    def putconn(self, connection, discard: bool = False) -> None:
+        """
+        Hand a connection back to the pool, closing it if it is broken.
+        """
+        with self._condition:
+            if discard or self._closed or connection.closed:
+                self._discard(connection)
+                return
+            try:
+                status = connection.info.transaction_status
+                if status != extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+            except Exception:
+                self._discard(connection)
+                return
+            self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self):
+        connection = self.getconn()
+        discard = False
+        try:
+            yield connection
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.putconn(connection, discard=discard)
+
+    def close(self) -> None:
+        """
+        Close every idle connection and refuse new checkouts.
+        """
+        with self._condition:
+            self._closed = True
+            while self._idle:
+                connection, _ = self._idle.pop()
+                self._discard(connection)
+        logger.info("PostgreSQL connection pool closed.")
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_uri: str) -> ConnectionPool:
+    """
+    Return the connection pool shared by every client of this process.
+    """
+    # Connections cannot be shared with forked worker processes
+    key = (os.getpid(), db_uri)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool._closed:
+            pool = ConnectionPool(db_uri=db_uri)
+            _pools[key] = pool
+        return pool
+
+
+def close_pools() -> None:
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
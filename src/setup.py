@@ -1,8 +1,17 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
 from config import (
     AWS_ARN_ROLE_CONSUMER,
+    AWS_MANIFEST_PATH,
     POSTGRES_URI,
     QUEUE_NAME,
+    RAW_MESSAGE_DELIVERY,
     SESSION_NAME,
+    SUBSCRIPTION_FILTER_POLICY,
     TOPIC_NAME,
     logger,
 )
@@ -11,15 +20,81 @@ from scripts.aws_topic import Topic
 from scripts.postgres import PostgresClient
 
 
+def load_manifest(path: str = AWS_MANIFEST_PATH):
+    try:
+        with open(path, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def save_manifest(manifest: dict, path: str = AWS_MANIFEST_PATH) -> None:
+    """
+    Write the manifest atomically, workers may read it at the same time.
+    """
+    try:
+        with open(f"{path}.tmp", "w") as file:
+            json.dump(manifest, file, indent=2)
+        os.replace(f"{path}.tmp", path)
+    except OSError as e:
+        logger.warning(f"Could not write the AWS manifest {path}: {e}")
+
+
+def verify_manifest(manifest: dict, sns_client, sqs_client) -> bool:
+    """
+    Check, with one call each run in parallel, that the topic and the queue
+    of a manifest still exist and that the queue redrives to its DLQ.
+    """
+
+    def check_topic():
+        sns_client.get_topic_attributes(TopicArn=manifest["topic_arn"])
+        return True
+
+    def check_queue():
+        attributes = sqs_client.get_queue_attributes(
+            QueueUrl=manifest["queue_url"], AttributeNames=["RedrivePolicy"]
+        )["Attributes"]
+        redrive_policy = json.loads(attributes.get("RedrivePolicy", "{}"))
+        return (
+            redrive_policy.get("deadLetterTargetArn")
+            == manifest["dead_letter_queue_arn"]
+        )
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(check_topic), executor.submit(check_queue)]
+        try:
+            return all(future.result() for future in futures)
+        except ClientError as e:
+            logger.warning(f"AWS manifest is out of date: {e}")
+            return False
+
+
+def _get_or_create_queue(queue: Queue) -> bool:
+    """
+    Returns True if the queue had to be created.
+    """
+    if queue.get_queue_url():
+        queue.get_queue_arn()
+        return False
+    queue.create_queue()
+    return True
+
+
 def initialize_aws_setup(
     role: str = AWS_ARN_ROLE_CONSUMER,
     session_name: str = SESSION_NAME,
     topic_name: str = TOPIC_NAME,
     queue_name: str = QUEUE_NAME,
+    raw_message_delivery: bool = RAW_MESSAGE_DELIVERY,
+    filter_policy: str = SUBSCRIPTION_FILTER_POLICY,
+    manifest_path: str = AWS_MANIFEST_PATH,
 ):
     """
     Initialize the AWS setup by creating an SNS topic a SQS queue and a DLQ queue
     The, subscribe the queue to the topic.
+    The topic and the two queues are set up in parallel. The resources are
+    then recorded in a manifest: while it matches the settings and its
+    resources exist, the next startups only verify them.
     """
     topic = Topic(
         role=role,
@@ -27,34 +102,86 @@ def initialize_aws_setup(
         topic_name=topic_name,
         logger=logger,
     )
-    topic_arn = topic.get_or_create_topic()
-
-    # Create queue if it doesn't exist
-    dead_letter_queue = Queue(
+    queue = Queue(
         role=role,
         session_name=session_name,
-        queue_name=f"dead_letter_{queue_name}",
+        queue_name=queue_name,
         logger=logger,
     )
-    dead_letter_queue_url = dead_letter_queue.get_queue_url()
-    if not dead_letter_queue_url:
-        dead_letter_queue.create_queue()
-        dead_letter_queue_arn = dead_letter_queue.get_queue_arn()
-    else:
-        dead_letter_queue_arn = dead_letter_queue.get_queue_arn()
-    queue = Queue(
+    if filter_policy and not isinstance(filter_policy, str):
+        filter_policy = json.dumps(filter_policy, sort_keys=True)
+    settings = {
+        "topic_name": topic_name,
+        "queue_name": queue_name,
+        "raw_message_delivery": bool(raw_message_delivery),
+        "filter_policy": filter_policy,
+    }
+
+    manifest = load_manifest(manifest_path) if manifest_path else None
+    if (
+        manifest is not None
+        and manifest.get("settings") == settings
+        and verify_manifest(manifest, topic.sns_client, queue.sqs_client)
+    ):
+        logger.info(f"AWS resources verified from the manifest {manifest_path}.")
+        return (
+            topic.sns_client,
+            queue.sqs_client,
+            manifest["topic_arn"],
+            manifest["queue_url"],
+        )
+
+    dead_letter_queue = Queue(
         role=role,
         session_name=session_name,
-        queue_name=queue_name,
+        queue_name=f"dead_letter_{queue_name}",
         logger=logger,
     )
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        topic_future = executor.submit(topic.get_or_create_topic)
+        dead_letter_queue_future = executor.submit(
+            _get_or_create_queue, dead_letter_queue
+        )
+        queue_future = executor.submit(_get_or_create_queue, queue)
+        topic_arn = topic_future.result()
+        dead_letter_queue_future.result()
+        dead_letter_queue_arn = dead_letter_queue.get_queue_arn()
+        is_new_queue = queue_future.result()
+
+        # Apply the delivery settings to an existing subscription as well
+        steps = [
+            executor.submit(
+                queue.subscribe_queue_to_topic,
+                topic_arn=topic_arn,
+                raw_message_delivery=raw_message_delivery,
+                filter_policy=filter_policy,
+            )
+        ]
+        if is_new_queue:
+            steps += [
+                executor.submit(
+                    queue.add_subscription_policy_to_queue, topic_arn=topic_arn
+                ),
+                executor.submit(
+                    queue.add_redrive_policy_to_queue,
+                    dead_letter_queue_arn=dead_letter_queue_arn,
+                ),
+            ]
+        for step in steps:
+            step.result()
     queue_url = queue.get_queue_url()
-    if not queue_url:
-        queue.initialize_queue(
-            topic_arn=topic_arn,
-            dead_letter_queue_arn=dead_letter_queue_arn,
+
+    if manifest_path and topic_arn and queue_url and dead_letter_queue_arn:
+        save_manifest(
+            {
+                "settings": settings,
+                "topic_arn": topic_arn,
+                "queue_url": queue_url,
+                "queue_arn": queue.get_queue_arn(),
+                "dead_letter_queue_arn": dead_letter_queue_arn,
+            },
+            path=manifest_path,
         )
-        queue_url = queue.get_queue_url()
     return topic.sns_client, queue.sqs_client, topic_arn, queue_url
 
 
@@ -1,7 +1,10 @@
-import datetime
+from config import DIRECTORY_PATH, PARTITION_BY_DAY, RAW_MESSAGE_DELIVERY
+from extractors import PUBLISHED_AT, RECEIVED_AT, Field, to_string
+from result_cache import cached_result
+from scripts.postgres import Index, PostgresClient
 
-from config import DIRECTORY_PATH
-from scripts.postgres import PostgresClient
+with open(f"{DIRECTORY_PATH}/queries/aggregate_simple_message.sql", "r") as file:
+    AGGREGATE_QUERY = file.read()
 
 
 class SimpleMessage(PostgresClient):
@@ -10,28 +13,28 @@ class SimpleMessage(PostgresClient):
         self.schema_name = "schema_name"
         self.table_name = "table_name"
         self.delete_column = "created_at"
+        self.indexes = [Index("created_at", method="brin")]
+        # Counted per minute by /aggregate
+        self.rollup_column = "created_at"
         self.columns = {
             "id": "VARCHAR PRIMARY KEY",
             "created_at": "TIMESTAMP",
             "message": "VARCHAR",
         }
+        self.fields = {
+            "id": Field("MessageId"),
+            "created_at": RECEIVED_AT,
+            "message": Field("Message", to_string),
+        }
 
-    def handle_message(self, message_body):
-        """
-        Handle the message received from SQS.
-        """
-        data = [
-            (
-                message_body.get("MessageId"),
-                datetime.datetime.now().isoformat(),
-                message_body.get("Message"),
-            )
-        ]
-        return data
+        if PARTITION_BY_DAY:
+            if RAW_MESSAGE_DELIVERY:
+                raise ValueError("PARTITION_BY_DAY needs the SNS envelope.")
+            # The partition column is part of the primary key: duplicate
+            # deliveries must share it, their receive time differs
+            self.partition_column = self.delete_column
+            self.fields[self.delete_column] = PUBLISHED_AT
 
+    @cached_result()
     def aggregate(self):
-        with open(
-            f"{DIRECTORY_PATH}/queries/aggregate_simple_message.sql", "r"
-        ) as file:
-            query = file.read()
-        return self.execute_query(query=query)
+        return self.execute_query(query=AGGREGATE_QUERY)
@@ -1,8 +1,51 @@
-import json
+import math
+import time
+import uuid
 
 from botocore.exceptions import ClientError
 
-from config import MAX_NUMBER_OF_MESSAGES, VISIBILITY_TIMEOUT, WAIT_TIME_SECONDS, logger
+from codec import MESSAGE_ID_ATTRIBUTE, SNSBody
+from config import (
+    MAX_NUMBER_OF_MESSAGES,
+    PUBLISH_BATCH_MAX_BYTES,
+    PUBLISH_BATCH_SIZE,
+    PUBLISH_MAX_RETRIES,
+    RAW_MESSAGE_DELIVERY,
+    VISIBILITY_TIMEOUT,
+    WAIT_TIME_SECONDS,
+    logger,
+)
+from metrics import (
+    BATCH_SIZE,
+    CONSUMER_HEARTBEAT,
+    DELETE_FAILURES,
+    MESSAGES_DELETED,
+    MESSAGES_RECEIVED,
+    STAGE_LATENCY,
+)
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile of a list of values, None if the list is empty.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = min(len(ordered), max(1, math.ceil(percent / 100 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def with_message_id(message_attributes=None) -> dict:
+    """
+    Message attributes with the ID consumers read the message by when the
+    queue is subscribed with raw message delivery, see codec.SNSBody.
+    """
+    message_attributes = dict(message_attributes or {})
+    message_attributes.setdefault(
+        MESSAGE_ID_ATTRIBUTE, {"DataType": "String", "StringValue": str(uuid.uuid4())}
+    )
+    return message_attributes
 
 
 def send_message_to_topic(
@@ -14,8 +57,7 @@ def send_message_to_topic(
             TopicArn=topic_arn,
             Message=message_body,
             Subject=subject,  # Optional subject
-            MessageAttributes=message_attributes
-            or {},  # If no attributes, use empty dict
+            MessageAttributes=with_message_id(message_attributes),
         )
 
         logger.info(f"Message sent to Topic. Message ID: {response['MessageId']}")
@@ -25,41 +67,235 @@ def send_message_to_topic(
         return None
 
 
+def publish_entry_size(entry) -> int:
+    """
+    Size of a PublishBatch entry as counted by SNS: body, subject and attributes.
+    """
+    size = len(entry["Message"].encode("utf-8"))
+    size += len(entry.get("Subject", "").encode("utf-8"))
+    for name, attribute in entry.get("MessageAttributes", {}).items():
+        size += len(name.encode("utf-8")) + len(attribute["DataType"].encode("utf-8"))
+        value = attribute.get("StringValue", attribute.get("BinaryValue", b""))
+        size += len(value.encode("utf-8") if isinstance(value, str) else value)
+    return size
+
+
+def split_publish_batches(entries):
+    """
+    Group entries into PublishBatch requests of at most PUBLISH_BATCH_SIZE entries
+    and PUBLISH_BATCH_MAX_BYTES bytes.
+    """
+    batches = []
+    batch, batch_size = [], 0
+    for entry in entries:
+        entry_size = publish_entry_size(entry)
+        if batch and (
+            len(batch) >= PUBLISH_BATCH_SIZE
+            or batch_size + entry_size > PUBLISH_BATCH_MAX_BYTES
+        ):
+            batches.append(batch)
+            batch, batch_size = [], 0
+        batch.append(entry)
+        batch_size += entry_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def send_messages_to_topic(sns_client, topic_arn, messages, max_retries=None):
+    """
+    Publish messages to an SNS topic with PublishBatch.
+
+    Each message is a dict with a `message_body` and optional `subject` and
+    `message_attributes`. Entries failing on the AWS side are retried with an
+    exponential backoff. Returns the message ID of each message, in order,
+    with None for the ones that could not be published.
+    """
+    if max_retries is None:
+        max_retries = PUBLISH_MAX_RETRIES
+
+    message_ids = [None] * len(messages)
+    entries = []
+    for i, message in enumerate(messages):
+        entry = {
+            "Id": str(i),
+            "Message": message["message_body"],
+            "MessageAttributes": with_message_id(message.get("message_attributes")),
+        }
+        if message.get("subject"):
+            entry["Subject"] = message["subject"]
+        if publish_entry_size(entry) > PUBLISH_BATCH_MAX_BYTES:
+            logger.error(f"Message {i} exceeds {PUBLISH_BATCH_MAX_BYTES} bytes.")
+            continue
+        entries.append(entry)
+
+    for attempt in range(max_retries + 1):
+        if not entries:
+            break
+        if attempt > 0:
+            time.sleep(0.1 * 2 ** (attempt - 1))
+        retry_entries = []
+        for batch in split_publish_batches(entries):
+            try:
+                response = sns_client.publish_batch(
+                    TopicArn=topic_arn, PublishBatchRequestEntries=batch
+                )
+            except ClientError as e:
+                logger.error(f"Error sending message batch: {e}")
+                retry_entries.extend(batch)
+                continue
+
+            for success in response.get("Successful", []):
+                message_ids[int(success["Id"])] = success["MessageId"]
+            failed_ids = set()
+            for failure in response.get("Failed", []):
+                logger.error(f"Failed to send message {failure['Id']}: {failure}")
+                # Sender faults (invalid parameters...) fail again on retry
+                if not failure.get("SenderFault"):
+                    failed_ids.add(failure["Id"])
+            retry_entries.extend(entry for entry in batch if entry["Id"] in failed_ids)
+        entries = retry_entries
+
+    nb_sent = sum(message_id is not None for message_id in message_ids)
+    logger.info(f"{nb_sent}/{len(messages)} messages sent to Topic.")
+    return message_ids
+
+
+def _receive_parameters(
+    queue_url, max_number_of_messages, wait_time_seconds, visibility_timeout
+) -> dict:
+    return {
+        "QueueUrl": queue_url,
+        "MaxNumberOfMessages": max_number_of_messages,
+        "WaitTimeSeconds": wait_time_seconds,  # Long polling
+        "VisibilityTimeout": visibility_timeout,
+        "MessageAttributeNames": ["All"],  # Retrieve all message attributes
+    }
+
+
+def _received_messages(response) -> list:
+    messages = response.get("Messages", [])
+    MESSAGES_RECEIVED.inc(len(messages))
+    BATCH_SIZE.labels(operation="receive_message").observe(len(messages))
+    return messages
+
+
+def poll_messages(
+    sqs_client,
+    queue_url,
+    max_number_of_messages=MAX_NUMBER_OF_MESSAGES,
+    wait_time_seconds=WAIT_TIME_SECONDS,
+    visibility_timeout=VISIBILITY_TIMEOUT,
+):
+    """
+    Long-poll an SQS queue and return the received messages.
+    """
+    CONSUMER_HEARTBEAT.set_to_current_time()
+    with STAGE_LATENCY.labels(stage="receive_message").time():
+        response = sqs_client.receive_message(
+            **_receive_parameters(
+                queue_url, max_number_of_messages, wait_time_seconds, visibility_timeout
+            )
+        )
+    return _received_messages(response)
+
+
+async def poll_messages_async(
+    sqs_client,
+    queue_url,
+    max_number_of_messages=MAX_NUMBER_OF_MESSAGES,
+    wait_time_seconds=WAIT_TIME_SECONDS,
+    visibility_timeout=VISIBILITY_TIMEOUT,
+):
+    """
+    poll_messages with an aiobotocore client.
+    """
+    CONSUMER_HEARTBEAT.set_to_current_time()
+    with STAGE_LATENCY.labels(stage="receive_message").time():
+        response = await sqs_client.receive_message(
+            **_receive_parameters(
+                queue_url, max_number_of_messages, wait_time_seconds, visibility_timeout
+            )
+        )
+    return _received_messages(response)
+
+
+def build_data_batch(
+    postgres_client, messages, raw_message_delivery=RAW_MESSAGE_DELIVERY
+):
+    """
+    Turn SQS messages into rows ready to be inserted by the consumer.
+    """
+    if postgres_client.raw_body:
+        # Logging the SNS message ID would cost the decode raw_body avoids
+        for message in messages:
+            logger.info(f"Received message: {message['MessageId']}")
+        message_bodies = [message["Body"] for message in messages]
+    else:
+        # Bodies are decoded once, when first read: reading the MessageId
+        # decodes the envelopes, timed once for the batch as json_decode
+        message_bodies = [
+            SNSBody(message, raw_message_delivery) for message in messages
+        ]
+        with STAGE_LATENCY.labels(stage="json_decode").time():
+            message_ids = [
+                message_body.get("MessageId") for message_body in message_bodies
+            ]
+        for message_id in message_ids:
+            logger.info(f"Received message: {message_id}")
+    with STAGE_LATENCY.labels(stage="handle_message").time():
+        return postgres_client.handle_messages(message_bodies)
+
+
 def receive_message_from_queue(
-    postgres_client, schema_name, table_name, sqs_client, queue_url, columns
+    postgres_client,
+    schema_name,
+    table_name,
+    sqs_client,
+    queue_url,
+    columns,
+    max_number_of_messages=MAX_NUMBER_OF_MESSAGES,
+    wait_time_seconds=WAIT_TIME_SECONDS,
+    visibility_manager=None,
+    raw_message_delivery=RAW_MESSAGE_DELIVERY,
 ):
     """
     Receive messages from an SQS queue.
+    With a `visibility_manager`, the messages stay invisible while they are
+    processed and are returned to the queue right away if processing fails.
     """
     try:
-        response = sqs_client.receive_message(
-            QueueUrl=queue_url,
-            MaxNumberOfMessages=MAX_NUMBER_OF_MESSAGES,
-            WaitTimeSeconds=WAIT_TIME_SECONDS,  # Long polling
-            VisibilityTimeout=VISIBILITY_TIMEOUT,
-            MessageAttributeNames=["All"],  # Retrieve all message attributes
+        messages = poll_messages(
+            sqs_client,
+            queue_url,
+            max_number_of_messages=max_number_of_messages,
+            wait_time_seconds=wait_time_seconds,
         )
-
-        messages = response.get("Messages", [])
         if not messages:
             logger.info("No messages received.")
             return None
 
-        data_batch = []
-        for message in messages:
-            message_body = json.loads(message["Body"])
-            logger.info(f"Received message: {message_body.get('MessageId')}")
-            data = postgres_client.handle_message(message_body)
-            data_batch = [*data_batch, *data]
-
-        postgres_client.insert_data(
-            schema_name=schema_name,
-            table_name=table_name,
-            data=data_batch,
-            columns=columns,
-            strategy="skip",
-        )
+        if visibility_manager is not None:
+            visibility_manager.track(messages)
+        try:
+            data_batch = build_data_batch(
+                postgres_client, messages, raw_message_delivery
+            )
+
+            postgres_client.insert_data(
+                schema_name=schema_name,
+                table_name=table_name,
+                data=data_batch,
+                columns=columns,
+                strategy="skip",
+            )
+        except Exception:
+            if visibility_manager is not None:
+                visibility_manager.abandon(messages)
+            raise
         delete_batch_messages_from_queue(sqs_client, queue_url, messages)
+        if visibility_manager is not None:
+            visibility_manager.release(messages)
         return messages
     except ClientError as e:
         logger.error(f"Error receiving message: {e}")
@@ -85,23 +321,66 @@ def delete_message_from_queue(sqs_client, queue_url, message):
         return None
 
 
+def _delete_chunks(messages):
+    """
+    Delete entries of the messages, by chunks of 10, the maximum allowed by
+    SQS per call.
+    """
+    entries = [
+        {"Id": str(i), "ReceiptHandle": msg["ReceiptHandle"]}
+        for i, msg in enumerate(messages)
+    ]
+    for start in range(0, len(entries), MAX_NUMBER_OF_MESSAGES):
+        yield entries[start : start + MAX_NUMBER_OF_MESSAGES]
+
+
+def _record_deleted(response) -> None:
+    nb_successful = len(response["Successful"])
+    nb_failed = len(response["Failed"])
+    MESSAGES_DELETED.inc(nb_successful)
+    DELETE_FAILURES.inc(nb_failed)
+
+    if nb_failed > 0:
+        logger.error(f"Failed to delete some messages: {response.get('Failed')}")
+    else:
+        logger.info(f"{nb_successful} Batch messages deleted successfully.")
+
+
 def delete_batch_messages_from_queue(sqs_client, queue_url, messages):
     """
     Delete a batch of messages from an SQS queue.
+    Messages are deleted by chunks of 10, the maximum allowed by SQS per call.
     """
     try:
-        entries = [
-            {"Id": str(i), "ReceiptHandle": msg["ReceiptHandle"]}
-            for i, msg in enumerate(messages)
-        ]
-        response = sqs_client.delete_message_batch(QueueUrl=queue_url, Entries=entries)
-        nb_successful = len(response.get("Successful", []))
-        nb_failed = len(response.get("Failed", []))
-
-        if nb_failed > 0:
-            logger.error(f"Failed to delete some messages: {response.get('Failed')}")
-        else:
-            logger.info(f"{nb_successful} Batch messages deleted successfully.")
+        response = {"Successful": [], "Failed": []}
+        with STAGE_LATENCY.labels(stage="delete_message_batch").time():
+            for entries in _delete_chunks(messages):
+                chunk_response = sqs_client.delete_message_batch(
+                    QueueUrl=queue_url, Entries=entries
+                )
+                response["Successful"].extend(chunk_response.get("Successful", []))
+                response["Failed"].extend(chunk_response.get("Failed", []))
+        _record_deleted(response)
+        return response
+    except ClientError as e:
+        logger.error(f"Error deleting batch messages: {e}")
+        return None
+
+
+async def delete_batch_messages_from_queue_async(sqs_client, queue_url, messages):
+    """
+    delete_batch_messages_from_queue with an aiobotocore client.
+    """
+    try:
+        response = {"Successful": [], "Failed": []}
+        with STAGE_LATENCY.labels(stage="delete_message_batch").time():
+            for entries in _delete_chunks(messages):
+                chunk_response = await sqs_client.delete_message_batch(
+                    QueueUrl=queue_url, Entries=entries
+                )
+                response["Successful"].extend(chunk_response.get("Successful", []))
+                response["Failed"].extend(chunk_response.get("Failed", []))
+        _record_deleted(response)
         return response
     except ClientError as e:
         logger.error(f"Error deleting batch messages: {e}")
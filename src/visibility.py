@@ -0,0 +1,176 @@
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from config import (
+    MAX_NUMBER_OF_MESSAGES,
+    VISIBILITY_HEARTBEAT_INTERVAL,
+    VISIBILITY_SAFETY_MARGIN,
+    VISIBILITY_TIMEOUT,
+    logger,
+)
+
+
+class VisibilityManager:
+    """
+    Keep in-flight messages invisible until they are acked.
+
+    Every tracked receipt handle has a visibility deadline. A heartbeat
+    thread extends, with ChangeMessageVisibilityBatch, every deadline closer
+    than VISIBILITY_SAFETY_MARGIN seconds. Acked messages are released, and
+    messages whose processing failed are abandoned: they are made visible
+    again right away instead of waiting for their deadline.
+    """
+
+    def __init__(
+        self,
+        sqs_client,
+        queue_url: str,
+        visibility_timeout: int = VISIBILITY_TIMEOUT,
+        heartbeat_interval: float = VISIBILITY_HEARTBEAT_INTERVAL,
+    ) -> None:
+        if heartbeat_interval >= VISIBILITY_SAFETY_MARGIN:
+            raise ValueError(
+                "Heartbeat interval must be shorter than the safety margin "
+                f"({VISIBILITY_SAFETY_MARGIN}s)."
+            )
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+        self.visibility_timeout = visibility_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self._deadlines = {}  # receipt handle -> monotonic visibility deadline
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def track(self, messages, received_at: float = None) -> None:
+        """
+        Start tracking messages received at `received_at` (now by default).
+        """
+        deadline = (received_at or time.monotonic()) + self.visibility_timeout
+        with self._lock:
+            for message in messages:
+                self._deadlines[message["ReceiptHandle"]] = deadline
+
+    def release(self, messages) -> None:
+        """
+        Stop tracking acked messages.
+        """
+        with self._lock:
+            for message in messages:
+                self._deadlines.pop(message["ReceiptHandle"], None)
+
+    def abandon(self, messages) -> None:
+        """
+        Stop tracking messages whose processing failed and make them visible
+        again right away.
+        """
+        self.release(messages)
+        receipt_handles = [message["ReceiptHandle"] for message in messages]
+        self._change_visibility(receipt_handles, visibility_timeout=0)
+        logger.warning(f"Returned {len(receipt_handles)} messages to the queue.")
+
+    @staticmethod
+    def _chunks(receipt_handles):
+        for start in range(0, len(receipt_handles), MAX_NUMBER_OF_MESSAGES):
+            yield receipt_handles[start : start + MAX_NUMBER_OF_MESSAGES]
+
+    @staticmethod
+    def _entries(chunk, visibility_timeout: int) -> list:
+        return [
+            {
+                "Id": str(i),
+                "ReceiptHandle": receipt_handle,
+                "VisibilityTimeout": visibility_timeout,
+            }
+            for i, receipt_handle in enumerate(chunk)
+        ]
+
+    @staticmethod
+    def _failures(chunk, response) -> list:
+        failed = []
+        for failure in response.get("Failed", []):
+            logger.error(f"Failed to change message visibility: {failure}")
+            failed.append(chunk[int(failure["Id"])])
+        return failed
+
+    def _change_visibility(self, receipt_handles, visibility_timeout: int) -> list:
+        """
+        Change the visibility of messages by chunks of 10.
+        Returns the receipt handles that could not be changed.
+        """
+        failed = []
+        for chunk in self._chunks(receipt_handles):
+            try:
+                response = self.sqs_client.change_message_visibility_batch(
+                    QueueUrl=self.queue_url,
+                    Entries=self._entries(chunk, visibility_timeout),
+                )
+            except ClientError as e:
+                logger.error(f"Error changing message visibility: {e}")
+                failed.extend(chunk)
+                continue
+            failed.extend(self._failures(chunk, response))
+        return failed
+
+    def _due(self, now: float) -> list:
+        with self._lock:
+            return [
+                receipt_handle
+                for receipt_handle, deadline in self._deadlines.items()
+                if deadline - now < VISIBILITY_SAFETY_MARGIN
+            ]
+
+    def _extended(self, due, failed, now: float) -> int:
+        """
+        Move the deadlines of the extended messages. Returns their number.
+        """
+        new_deadline = now + self.visibility_timeout
+        with self._lock:
+            for receipt_handle in due:
+                if receipt_handle not in self._deadlines:
+                    continue  # acked in the meantime
+                if receipt_handle in failed:
+                    # The handle expired or was deleted, it cannot be extended
+                    del self._deadlines[receipt_handle]
+                else:
+                    self._deadlines[receipt_handle] = new_deadline
+        logger.info(f"Extended visibility of {len(due) - len(failed)} messages.")
+        return len(due) - len(failed)
+
+    def extend_due(self) -> int:
+        """
+        Extend the visibility of the messages about to become visible again.
+        Returns the number of extended messages.
+        """
+        now = time.monotonic()
+        due = self._due(now)
+        if not due:
+            return 0
+        failed = set(self._change_visibility(due, self.visibility_timeout))
+        return self._extended(due, failed, now)
+
+    def _heartbeat(self) -> None:
+        while not self._stop_event.wait(timeout=self.heartbeat_interval):
+            try:
+                self.extend_due()
+            except Exception as e:
+                logger.error(f"Error in visibility heartbeat: {e}")
+
+    def start(self) -> "VisibilityManager":
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._heartbeat, name="visibility-heartbeat", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
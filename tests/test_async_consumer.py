@@ -0,0 +1,209 @@
+import asyncio
+import datetime
+import json
+import threading
+import time
+
+import asyncpg
+import pytest
+
+from async_consumer import AsyncConsumer
+from config import POSTGRES_URI
+from queue_listener import get_consumer
+from scripts.fake_aws import FakeBroker, FakeSQSClient
+from setup import initialize_postgres_client
+from simple_message import SimpleMessage
+
+
+class AsyncMessage(SimpleMessage):
+    def __init__(self, db_uri):
+        super().__init__(db_uri=db_uri)
+        self.schema_name, self.table_name = "test_schema", "test_async"
+
+
+class FailingMessage(AsyncMessage):
+    async def insert_data_async(self, connection, **kwargs):
+        raise RuntimeError("insert failed")
+
+
+@pytest.fixture
+def postgres_client():
+    client = initialize_postgres_client(postgres=AsyncMessage, db_uri=POSTGRES_URI)
+    yield client
+    client.delete_table(schema_name="test_schema", table_name="test_async")
+    client.close()
+
+
+@pytest.fixture
+def broker():
+    return FakeBroker()
+
+
+@pytest.fixture
+def queue_url(broker):
+    return broker.client("sqs").create_queue(QueueName="async-queue")["QueueUrl"]
+
+
+def send_envelopes(broker, queue_url, nb_messages):
+    sqs_client = broker.client("sqs")
+    for i in range(nb_messages):
+        sqs_client.send_message(
+            QueueUrl=queue_url,
+            MessageBody=json.dumps({"MessageId": f"sns-{i}", "Message": f"{i}"}),
+        )
+
+
+def queue_counts(broker, queue_url):
+    attributes = broker.client("sqs").get_queue_attributes(QueueUrl=queue_url)
+    return (
+        int(attributes["Attributes"]["ApproximateNumberOfMessages"]),
+        int(attributes["Attributes"]["ApproximateNumberOfMessagesNotVisible"]),
+    )
+
+
+async def run_until(consumer, condition, timeout=10):
+    """
+    Run the consumer until `condition` holds, then stop it.
+    """
+    run = asyncio.create_task(consumer.run())
+    deadline = time.monotonic() + timeout
+    while not condition() and not run.done() and time.monotonic() < deadline:
+        await asyncio.sleep(0.02)
+    consumer.stop()
+    await asyncio.wait_for(run, timeout=10)
+
+
+def test_consumes_each_message_once(
+    postgres_client, broker, queue_url, monkeypatch
+) -> None:
+    deleted = []
+    delete_message_batch = FakeSQSClient.delete_message_batch
+
+    def recording_delete(self, QueueUrl, Entries):  # noqa: N803
+        deleted.extend(entry["ReceiptHandle"].split("#")[0] for entry in Entries)
+        return delete_message_batch(self, QueueUrl=QueueUrl, Entries=Entries)
+
+    monkeypatch.setattr(FakeSQSClient, "delete_message_batch", recording_delete)
+    nb_messages = 300
+    send_envelopes(broker, queue_url, nb_messages)
+
+    async def main():
+        async with (
+            broker.async_client("sqs") as sqs_client,
+            asyncpg.create_pool(dsn=POSTGRES_URI, min_size=1, max_size=2) as pool,
+        ):
+            consumer = AsyncConsumer(
+                postgres_client,
+                sqs_client,
+                pool,
+                queue_url,
+                concurrency=8,
+                writers=2,
+                wait_time_seconds=1,
+            )
+            await run_until(consumer, lambda: len(deleted) >= nb_messages)
+
+    asyncio.run(main())
+
+    assert postgres_client.count_elements("test_schema", "test_async") == nb_messages
+    assert len(deleted) == len(set(deleted)) == nb_messages
+    assert queue_counts(broker, queue_url) == (0, 0)
+    assert postgres_client.execute_query(
+        "SELECT SUM(count) FROM test_schema.test_async_per_minute;"
+    ) == [(nb_messages,)]
+
+
+def test_concurrent_polls_share_one_thread(postgres_client, broker, queue_url):
+    nb_threads = []
+
+    async def main():
+        async with (
+            broker.async_client("sqs") as sqs_client,
+            asyncpg.create_pool(dsn=POSTGRES_URI, min_size=1, max_size=1) as pool,
+        ):
+            consumer = AsyncConsumer(
+                postgres_client,
+                sqs_client,
+                pool,
+                queue_url,
+                concurrency=50,
+                writers=1,
+                wait_time_seconds=1,
+            )
+
+            def condition():
+                nb_threads.append(threading.active_count())
+                return len(nb_threads) > 20
+
+            await run_until(consumer, condition)
+
+    before = threading.active_count()
+    asyncio.run(main())
+
+    # Fifty long polls in flight without a thread each
+    assert max(nb_threads) <= before + 1
+
+
+def test_failed_insert_returns_the_messages(broker, queue_url) -> None:
+    send_envelopes(broker, queue_url, 20)
+    postgres_client = initialize_postgres_client(
+        postgres=FailingMessage, db_uri=POSTGRES_URI
+    )
+
+    async def main():
+        async with (
+            broker.async_client("sqs") as sqs_client,
+            asyncpg.create_pool(dsn=POSTGRES_URI, min_size=1, max_size=1) as pool,
+        ):
+            consumer = AsyncConsumer(
+                postgres_client,
+                sqs_client,
+                pool,
+                queue_url,
+                concurrency=2,
+                writers=1,
+                wait_time_seconds=1,
+            )
+            with pytest.raises(RuntimeError):
+                await consumer.run()
+
+    try:
+        asyncio.run(main())
+        assert queue_counts(broker, queue_url) == (20, 0)
+    finally:
+        postgres_client.delete_table(schema_name="test_schema", table_name="test_async")
+        postgres_client.close()
+
+
+def test_insert_data_async_skips_duplicates(postgres_client) -> None:
+    now = datetime.datetime(2024, 1, 1, 12, 0, 30)
+    postgres_client.insert_data(
+        schema_name="test_schema",
+        table_name="test_async",
+        data=[("a", now, "first")],
+    )
+
+    async def main():
+        connection = await asyncpg.connect(POSTGRES_URI)
+        try:
+            await postgres_client.insert_data_async(
+                connection,
+                schema_name="test_schema",
+                table_name="test_async",
+                data=[("a", now, "again"), ("b", now, "second"), ("b", now, "dup")],
+            )
+        finally:
+            await connection.close()
+
+    asyncio.run(main())
+
+    assert postgres_client.execute_query(
+        "SELECT id, message FROM test_schema.test_async ORDER BY id;"
+    ) == [("a", "first"), ("b", "second")]
+    assert postgres_client.execute_query(
+        "SELECT count FROM test_schema.test_async_per_minute;"
+    ) == [(2,)]
+
+
+def test_async_mode_is_selectable() -> None:
+    assert get_consumer("async").__name__ == "async_consumer"
@@ -0,0 +1,63 @@
+import datetime
+import threading
+import time
+
+from config import AWS_MAX_POOL_CONNECTIONS
+from scripts.aws_connection import AWSConnection, AWSConnectionMeta
+
+
+def test_clients_are_cached_per_service_and_region(monkeypatch) -> None:
+    monkeypatch.delenv("FAKE_AWS", raising=False)
+    connection = AWSConnection(role=None, session_name=None)
+    connection.__init__(role=None, session_name=None)
+
+    sqs_client = connection.get_client(service="sqs")
+
+    assert connection.get_client(service="sqs") is sqs_client
+    assert connection.get_client(service="sns") is not sqs_client
+    assert connection.get_client(service="sqs", region_name="us-east-1") is not (
+        sqs_client
+    )
+    assert sqs_client.meta.config.max_pool_connections == AWS_MAX_POOL_CONNECTIONS
+
+    # New credentials, new clients
+    connection.__init__(role=None, session_name=None)
+    assert connection.get_client(service="sqs") is not sqs_client
+
+
+def test_credentials_are_refreshed_in_the_background(monkeypatch) -> None:
+    monkeypatch.delenv("FAKE_AWS", raising=False)
+    monkeypatch.delenv("LOCALSTACK", raising=False)
+    monkeypatch.setattr(AWSConnectionMeta, "_instances", {})
+    monkeypatch.setattr(AWSConnection, "prefetch_lead", 0.1)
+    refresh_margin = 600
+    assumed = []
+
+    def assume_role(self):
+        # The first credentials expire right after the refresh margin
+        lifetime = refresh_margin + 0.2 if not assumed else 3600
+        assumed.append(threading.current_thread().name)
+        expiry = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+            seconds=lifetime
+        )
+        return {
+            "access_key": f"key-{len(assumed)}",
+            "secret_key": "secret",
+            "token": "token",
+            "expiry_time": expiry.isoformat(),
+        }
+
+    monkeypatch.setattr(AWSConnection, "_assume_role", assume_role)
+    connection = AWSConnection(
+        role="arn:aws:iam::000000000000:role/consumer",
+        session_name="test",
+        refresh_margin=refresh_margin,
+    )
+    try:
+        time.sleep(1)
+        credentials = connection.credentials.get_frozen_credentials()
+    finally:
+        connection.close()
+
+    assert credentials.access_key == "key-2"
+    assert assumed == [threading.current_thread().name, "credentials-refresher"]
@@ -0,0 +1,227 @@
+import functools
+import threading
+import time
+
+import pytest
+
+import batching
+from batching import MicroBatcher
+from config import VISIBILITY_SAFETY_MARGIN
+from polling import AdaptivePoller
+from scripts.fake_aws import FakeBroker
+
+
+class PollingStoppedError(Exception):
+    pass
+
+
+class StubSQSClient:
+    def __init__(self):
+        self.calls = []
+
+    def receive_message(self, **kwargs):
+        self.calls.append(kwargs)
+        raise PollingStoppedError
+
+
+def test_receives_with_the_batcher_visibility_timeout() -> None:
+    sqs_client = StubSQSClient()
+    batcher = MicroBatcher(
+        postgres_client=None,
+        sqs_client=sqs_client,
+        queue_url="queue",
+        max_linger=600,
+        visibility_timeout=60,
+    )
+
+    with pytest.raises(PollingStoppedError):
+        batcher.run()
+
+    # The linger cap and the actual visibility in SQS agree
+    assert batcher.max_linger == 60 - VISIBILITY_SAFETY_MARGIN
+    assert sqs_client.calls[0]["VisibilityTimeout"] == 60
+
+
+class StubPostgresClient:
+    raw_body = True
+    schema_name, table_name, columns = "schema", "table", None
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.flushes = []  # (time, rows) of each insert
+
+    def handle_messages(self, message_bodies):
+        return list(message_bodies)
+
+    def insert_data(self, schema_name, table_name, data, columns, strategy):
+        if self.fail:
+            raise RuntimeError("insert failed")
+        self.flushes.append((time.monotonic(), list(data)))
+
+
+class RecordingSQSClient:
+    """
+    Fake broker client that records the receipt handles it hands out, deletes
+    and returns to the queue.
+    """
+
+    def __init__(self, sqs_client):
+        self.sqs_client = sqs_client
+        self.received, self.deleted, self.released = [], [], []
+
+    def __getattr__(self, name):
+        return getattr(self.sqs_client, name)
+
+    def receive_message(self, **kwargs):
+        response = self.sqs_client.receive_message(**kwargs)
+        self.received.extend(m["ReceiptHandle"] for m in response.get("Messages", []))
+        return response
+
+    def delete_message_batch(self, QueueUrl, Entries):  # noqa: N803
+        self.deleted.extend(entry["ReceiptHandle"] for entry in Entries)
+        return self.sqs_client.delete_message_batch(QueueUrl=QueueUrl, Entries=Entries)
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):  # noqa: N803
+        self.released.extend(
+            entry["ReceiptHandle"]
+            for entry in Entries
+            if entry["VisibilityTimeout"] == 0
+        )
+        return self.sqs_client.change_message_visibility_batch(
+            QueueUrl=QueueUrl, Entries=Entries
+        )
+
+
+@pytest.fixture
+def short_long_polls(monkeypatch):
+    # Short long polls, so that the batcher sees the stop quickly
+    monkeypatch.setattr(
+        batching,
+        "AdaptivePoller",
+        functools.partial(AdaptivePoller, max_wait_time_seconds=1),
+    )
+
+
+@pytest.fixture
+def queue(short_long_polls):
+    sqs_client = FakeBroker().client("sqs")
+    queue_url = sqs_client.create_queue(QueueName="batching-queue")["QueueUrl"]
+    return RecordingSQSClient(sqs_client), queue_url
+
+
+def send_messages(sqs_client, queue_url, nb_messages, size=10):
+    for i in range(nb_messages):
+        sqs_client.send_message(QueueUrl=queue_url, MessageBody=f"{i:0{size}d}")
+
+
+def queue_counts(sqs_client, queue_url):
+    attributes = sqs_client.get_queue_attributes(QueueUrl=queue_url)["Attributes"]
+    return (
+        int(attributes["ApproximateNumberOfMessages"]),
+        int(attributes["ApproximateNumberOfMessagesNotVisible"]),
+    )
+
+
+def run_batcher(batcher, stop_event, condition, timeout=5):
+    """
+    Run the batcher in a thread until `condition` holds, then stop it.
+    """
+    errors = []
+
+    def target():
+        try:
+            batcher.run(stop_event=stop_event)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    stop_event.set()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    return errors
+
+
+def test_flush_on_row_count(queue) -> None:
+    sqs_client, queue_url = queue
+    send_messages(sqs_client, queue_url, 25)
+    postgres_client = StubPostgresClient()
+    batcher = MicroBatcher(
+        postgres_client, sqs_client, queue_url, max_rows=20, visibility_timeout=60
+    )
+    stop_event = threading.Event()
+
+    # Stopped only once the last 5 messages are buffered too
+    run_batcher(
+        batcher,
+        stop_event,
+        lambda: postgres_client.flushes and len(sqs_client.received) == 25,
+    )
+
+    # Two full receives fill the buffer, the rest is flushed on stop
+    assert [len(rows) for _, rows in postgres_client.flushes] == [20, 5]
+    assert sorted(sqs_client.deleted) == sorted(sqs_client.received)
+    assert len(sqs_client.deleted) == 25
+    assert sqs_client.released == []
+    assert queue_counts(sqs_client, queue_url) == (0, 0)
+
+
+def test_flush_on_byte_size(queue) -> None:
+    sqs_client, queue_url = queue
+    send_messages(sqs_client, queue_url, 20, size=100)
+    postgres_client = StubPostgresClient()
+    batcher = MicroBatcher(
+        postgres_client, sqs_client, queue_url, max_bytes=1000, visibility_timeout=60
+    )
+    stop_event = threading.Event()
+
+    run_batcher(batcher, stop_event, lambda: len(postgres_client.flushes) == 2)
+
+    # Each receive of 10 messages of 100 bytes reaches the byte limit
+    assert [len(rows) for _, rows in postgres_client.flushes] == [10, 10]
+    assert sorted(sqs_client.deleted) == sorted(sqs_client.received)
+    assert len(sqs_client.deleted) == 20
+    assert queue_counts(sqs_client, queue_url) == (0, 0)
+
+
+def test_flush_on_linger_expiry(queue) -> None:
+    sqs_client, queue_url = queue
+    send_messages(sqs_client, queue_url, 5)
+    postgres_client = StubPostgresClient()
+    batcher = MicroBatcher(
+        postgres_client, sqs_client, queue_url, max_linger=1.5, visibility_timeout=60
+    )
+    stop_event = threading.Event()
+    start = time.monotonic()
+
+    run_batcher(batcher, stop_event, lambda: postgres_client.flushes)
+
+    [(flushed_at, rows)] = postgres_client.flushes
+    assert len(rows) == 5
+    # The long polls are capped by the linger and do not overshoot it
+    assert 1.5 <= flushed_at - start < 2
+    assert sorted(sqs_client.deleted) == sorted(sqs_client.received)
+    assert queue_counts(sqs_client, queue_url) == (0, 0)
+
+
+def test_failed_flush_releases_the_messages(queue) -> None:
+    sqs_client, queue_url = queue
+    send_messages(sqs_client, queue_url, 10)
+    batcher = MicroBatcher(
+        StubPostgresClient(fail=True),
+        sqs_client,
+        queue_url,
+        max_rows=10,
+        visibility_timeout=60,
+    )
+    stop_event = threading.Event()
+
+    errors = run_batcher(batcher, stop_event, lambda: sqs_client.released)
+
+    assert [str(e) for e in errors] == ["insert failed"]
+    assert sqs_client.deleted == []
+    assert sorted(sqs_client.released) == sorted(sqs_client.received)
+    assert queue_counts(sqs_client, queue_url) == (10, 0)
@@ -0,0 +1,37 @@
+from benchmark import BENCHMARK_SCHEMA, compare, run_benchmark
+from config import POSTGRES_URI
+from scripts.postgres import PostgresClient
+
+
+def test_run_benchmark() -> None:
+    report = run_benchmark(
+        consumer_name="message",
+        nb_messages=25,
+        payload_size=10,
+        batch_size=10,
+        db_uri=POSTGRES_URI,
+    )
+
+    assert [result["scenario"] for result in report["results"]] == [
+        "handle",
+        "insert",
+        "consume",
+    ]
+    for result in report["results"]:
+        assert result["messages"] == 25
+        assert result["p50_ms"] <= result["p99_ms"]
+        assert result["peak_rss_mb"] > 0
+    stages = report["results"][2]["stages"]
+    assert {"receive_message", "handle_message", "insert_data"} <= set(stages)
+    for stage in stages.values():
+        assert stage["p50_ms"] <= stage["p99_ms"]
+    # The insert scenario does not decode messages again
+    assert "json_decode" not in report["results"][1]["stages"]
+
+    postgres_client = PostgresClient(db_uri=POSTGRES_URI)
+    assert not postgres_client.schema_exists(BENCHMARK_SCHEMA)
+    postgres_client.close()
+
+    lines = compare(report, baseline=report)
+    assert lines[0].startswith("handle:")
+    assert lines[0].endswith("(x1.00)")
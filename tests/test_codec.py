@@ -0,0 +1,113 @@
+import json
+
+import codec
+import extractors
+from codec import MESSAGE_ID_ATTRIBUTE, LazyBody, SNSBody, dumps, loads
+from extractors import Field, compile_extractor
+from metrics import STAGE_LATENCY
+from utils import build_data_batch, with_message_id
+
+
+def test_codec_round_trip() -> None:
+    document = {"id": 1, "name": "é", "items": [1.5, None, True]}
+
+    assert loads(dumps(document)) == document
+    assert loads(dumps(document).encode("utf-8")) == document
+
+
+def test_lazy_body_is_decoded_on_first_access(monkeypatch) -> None:
+    decoded = []
+
+    def counting_decode(data):
+        decoded.append(data)
+        return loads(data)
+
+    monkeypatch.setattr(codec, "decode", counting_decode)
+    monkeypatch.setattr(extractors, "decode", counting_decode)
+    body = LazyBody(json.dumps({"MessageId": "m1", "Message": '{"id": 1}'}))
+    assert body._document is None
+    assert decoded == []
+
+    extract = compile_extractor({"id": Field("Message.id"), "raw": Field("Message")})
+
+    assert extract([body], received_at=None) == [(1, '{"id": 1}')]
+    # The envelope, then the message it holds, each decoded once
+    assert len(decoded) == 2
+    assert body["MessageId"] == "m1"
+    assert "Message" in body
+    assert len(decoded) == 2
+
+
+def test_decodes_are_timed_once_per_batch() -> None:
+    class StubPostgresClient:
+        raw_body = False
+
+        def handle_messages(self, message_bodies):
+            return [body["Message"] for body in message_bodies]
+
+    decode_latency = STAGE_LATENCY.labels(stage="json_decode")
+    _, nb_observations = decode_latency.totals()
+    messages = [
+        {
+            "MessageId": f"sqs-{i}",
+            "Body": json.dumps({"MessageId": f"sns-{i}", "Message": f"message {i}"}),
+        }
+        for i in range(3)
+    ]
+
+    rows = build_data_batch(StubPostgresClient(), messages, raw_message_delivery=0)
+
+    assert rows == ["message 0", "message 1", "message 2"]
+    assert decode_latency.totals()[1] == nb_observations + 1
+
+
+def test_sns_body_reads_envelopes_and_raw_deliveries() -> None:
+    envelope = SNSBody(
+        {
+            "MessageId": "sqs-1",
+            "Body": json.dumps(
+                {
+                    "Type": "Notification",
+                    "MessageId": "sns-1",
+                    "TopicArn": "arn:aws:sns:eu-west-3:0:topic",
+                    "Message": '{"id": 1}',
+                }
+            ),
+        },
+        raw_message_delivery=False,
+    )
+    raw = SNSBody(
+        {
+            "MessageId": "sqs-2",
+            "Body": '{"id": 2}',
+            "MessageAttributes": {
+                "type": {"DataType": "String", "StringValue": "a"},
+                MESSAGE_ID_ATTRIBUTE: {"DataType": "String", "StringValue": "pub-2"},
+            },
+        },
+        raw_message_delivery=True,
+    )
+    extract = compile_extractor(
+        {"message_id": Field("MessageId"), "id": Field("Message.id")}
+    )
+
+    assert extract([envelope, raw], received_at=None) == [("sns-1", 1), ("pub-2", 2)]
+    assert raw["MessageAttributes"]["type"] == {"Type": "String", "Value": "a"}
+
+
+def test_raw_delivery_is_never_unwrapped() -> None:
+    # A raw payload that looks like an SNS envelope stays the message
+    payload = json.dumps({"TopicArn": "arn", "Message": "inner", "MessageId": "x"})
+    raw = SNSBody({"MessageId": "sqs-3", "Body": payload}, raw_message_delivery=True)
+
+    assert raw["Message"] == payload
+    # Without the producer's attribute, the SQS MessageId is used
+    assert raw["MessageId"] == "sqs-3"
+
+
+def test_with_message_id_keeps_the_producer_id() -> None:
+    attributes = with_message_id({"type": {"DataType": "String", "StringValue": "a"}})
+
+    assert set(attributes) == {"type", MESSAGE_ID_ATTRIBUTE}
+    assert with_message_id(attributes) == attributes
+    assert with_message_id()[MESSAGE_ID_ATTRIBUTE] != attributes[MESSAGE_ID_ATTRIBUTE]
@@ -0,0 +1,55 @@
+import datetime
+import json
+
+import pytest
+
+from extractors import (
+    RECEIVED_AT,
+    Field,
+    compile_extractor,
+    to_integer,
+    to_timestamp,
+    to_uuid,
+)
+
+
+def test_compile_extractor() -> None:
+    extract = compile_extractor(
+        {
+            "id": Field("Message.id", to_integer),
+            "received_at": RECEIVED_AT,
+            "started_at": Field("Message.start.at", to_timestamp),
+            "reference": Field("Message.reference", to_uuid),
+            "message_id": Field("MessageId"),
+        }
+    )
+    received_at = datetime.datetime(2024, 1, 1)
+    message = {
+        "id": "42",
+        "start": {"at": "2024-01-01T10:00:00+02:00"},
+        "reference": "12345678123456781234567812345678",
+    }
+
+    rows = extract(
+        [{"MessageId": "m1", "Message": json.dumps(message)}, {"MessageId": "m2"}],
+        received_at,
+    )
+
+    assert rows == [
+        (
+            42,
+            received_at,
+            datetime.datetime(2024, 1, 1, 8, 0),
+            "12345678-1234-5678-1234-567812345678",
+            "m1",
+        ),
+        (None, received_at, None, None, "m2"),
+    ]
+
+
+def test_converters_reject_malformed_values() -> None:
+    assert to_timestamp("2024-01-01T10:00:00Z") == datetime.datetime(2024, 1, 1, 10)
+    with pytest.raises(ValueError):
+        to_uuid("not-a-uuid")
+    with pytest.raises(ValueError):
+        to_integer("4.2")
@@ -0,0 +1,188 @@
+import json
+import threading
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+from scripts.aws_queue import Queue
+from scripts.aws_topic import Topic
+from scripts.fake_aws import FakeBroker
+from setup import initialize_aws_setup, load_manifest, save_manifest
+from utils import (
+    delete_batch_messages_from_queue,
+    send_message_to_topic,
+    send_messages_to_topic,
+)
+
+
+@pytest.fixture
+def broker():
+    return FakeBroker()
+
+
+def subscribed_queue(broker, topic_arn, queue_name="queue", attributes=None):
+    sqs_client = broker.client("sqs")
+    queue_url = sqs_client.create_queue(QueueName=queue_name, Attributes=attributes)[
+        "QueueUrl"
+    ]
+    queue_arn = sqs_client.get_queue_attributes(
+        QueueUrl=queue_url, AttributeNames=["QueueArn"]
+    )["Attributes"]["QueueArn"]
+    broker.client("sns").subscribe(
+        TopicArn=topic_arn, Protocol="sqs", Endpoint=queue_arn
+    )
+    return queue_url
+
+
+def test_publish_fans_out_to_subscribed_queues(broker) -> None:
+    sns_client, sqs_client = broker.client("sns"), broker.client("sqs")
+    topic_arn = sns_client.create_topic(Name="topic")["TopicArn"]
+    queue_urls = [
+        subscribed_queue(broker, topic_arn, queue_name=f"queue-{i}") for i in range(2)
+    ]
+
+    messages = [
+        {
+            "message_body": json.dumps({"id": i}),
+            "subject": "subject",
+            "message_attributes": {},
+        }
+        for i in range(25)
+    ]
+    assert all(send_messages_to_topic(sns_client, topic_arn, messages))
+
+    for queue_url in queue_urls:
+        received = []
+        while response := sqs_client.receive_message(
+            QueueUrl=queue_url, MaxNumberOfMessages=10
+        ).get("Messages"):
+            received.extend(response)
+        assert len(received) == 25
+        envelope = json.loads(received[0]["Body"])
+        assert envelope["TopicArn"] == topic_arn
+        assert json.loads(envelope["Message"]) == {"id": 0}
+
+        result = delete_batch_messages_from_queue(sqs_client, queue_url, received)
+        assert len(result["Successful"]) == 25
+        assert not result["Failed"]
+
+
+def test_visibility_timeout_and_redrive(broker) -> None:
+    sqs_client = broker.client("sqs")
+    dead_letter_url = sqs_client.create_queue(QueueName="dead_letter")["QueueUrl"]
+    dead_letter_arn = sqs_client.get_queue_attributes(QueueUrl=dead_letter_url)[
+        "Attributes"
+    ]["QueueArn"]
+    redrive_policy = {"deadLetterTargetArn": dead_letter_arn, "maxReceiveCount": 2}
+    queue_url = sqs_client.create_queue(
+        QueueName="queue",
+        Attributes={"RedrivePolicy": json.dumps(redrive_policy)},
+    )["QueueUrl"]
+    sqs_client.send_message(QueueUrl=queue_url, MessageBody="poison")
+
+    for _ in range(2):
+        messages = sqs_client.receive_message(
+            QueueUrl=queue_url, VisibilityTimeout=0.05
+        )["Messages"]
+        # In flight: hidden until the visibility timeout expires
+        assert "Messages" not in sqs_client.receive_message(QueueUrl=queue_url)
+        time.sleep(0.1)
+
+    # Received maxReceiveCount times without being deleted
+    assert "Messages" not in sqs_client.receive_message(QueueUrl=queue_url)
+    messages = sqs_client.receive_message(QueueUrl=dead_letter_url)["Messages"]
+    assert messages[0]["Body"] == "poison"
+
+
+def test_long_poll_wakes_up_on_new_message(broker) -> None:
+    sqs_client = broker.client("sqs")
+    queue_url = sqs_client.create_queue(QueueName="queue")["QueueUrl"]
+    timer = threading.Timer(
+        0.1, sqs_client.send_message, kwargs={"QueueUrl": queue_url, "MessageBody": "x"}
+    )
+    timer.start()
+
+    start = time.monotonic()
+    response = sqs_client.receive_message(QueueUrl=queue_url, WaitTimeSeconds=5)
+
+    assert len(response["Messages"]) == 1
+    assert time.monotonic() - start < 1
+
+
+def test_unknown_queue_and_topic(broker) -> None:
+    sqs_client, sns_client = broker.client("sqs"), broker.client("sns")
+
+    with pytest.raises(ClientError) as error:
+        sqs_client.get_queue_url(QueueName="missing")
+    assert (
+        error.value.response["Error"]["Code"]
+        == "AWS.SimpleQueueService.NonExistentQueue"
+    )
+    with pytest.raises(sns_client.exceptions.NotFoundException):
+        sns_client.get_topic_attributes(TopicArn="arn:aws:sns:eu-west-3:0:missing")
+
+
+def test_filter_policy_and_raw_delivery(monkeypatch) -> None:
+    monkeypatch.setenv("FAKE_AWS", "1")
+    settings = {
+        "role": None,
+        "session_name": None,
+        "topic_name": "filtered-topic",
+        "queue_name": "filtered-queue",
+        "filter_policy": {"type": ["order", {"prefix": "refund"}]},
+        "manifest_path": None,
+    }
+    sns_client, sqs_client, topic_arn, queue_url = initialize_aws_setup(
+        raw_message_delivery=True, **settings
+    )
+
+    def publish(message_type):
+        send_message_to_topic(
+            sns_client,
+            topic_arn,
+            message_body=message_type,
+            subject="subject",
+            message_attributes={
+                "type": {"DataType": "String", "StringValue": message_type}
+            },
+        )
+        response = sqs_client.receive_message(QueueUrl=queue_url)
+        return [message["Body"] for message in response.get("Messages", [])]
+
+    assert publish("order") == ["order"]
+    assert publish("refund-partial") == ["refund-partial"]
+    assert publish("audit") == []
+
+    # The settings of the existing subscription are updated
+    initialize_aws_setup(raw_message_delivery=False, **settings)
+    assert json.loads(publish("order")[0])["Message"] == "order"
+
+
+def test_initialize_aws_setup_verifies_the_manifest(monkeypatch, tmp_path) -> None:
+    monkeypatch.setenv("FAKE_AWS", "1")
+    settings = {
+        "role": None,
+        "session_name": None,
+        "topic_name": "manifest-topic",
+        "queue_name": "manifest-queue",
+        "manifest_path": str(tmp_path / "manifest.json"),
+    }
+    _, sqs_client, topic_arn, queue_url = initialize_aws_setup(**settings)
+    manifest = load_manifest(settings["manifest_path"])
+    assert manifest["queue_url"] == queue_url
+
+    def fail(*args, **kwargs):
+        raise AssertionError("The manifest should have been used.")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(Queue, "create_queue", fail)
+        patch.setattr(Queue, "get_queue_url", fail)
+        patch.setattr(Topic, "get_or_create_topic", fail)
+        assert initialize_aws_setup(**settings)[2:] == (topic_arn, queue_url)
+
+    # A queue missing from the manifest resources is set up again
+    manifest["queue_url"] = queue_url + "-deleted"
+    save_manifest(manifest, path=settings["manifest_path"])
+    assert initialize_aws_setup(**settings)[2:] == (topic_arn, queue_url)
+    assert load_manifest(settings["manifest_path"])["queue_url"] == queue_url
@@ -0,0 +1,50 @@
+import pytest
+
+from metrics import Counter, Gauge, Histogram, Registry, bucket_quantile
+
+
+def test_render_prometheus_text_format() -> None:
+    registry = Registry()
+    counter = registry.register(Counter("test_messages_total", "Messages."))
+    gauge = registry.register(Gauge("test_alive", "Liveness."))
+    histogram = registry.register(
+        Histogram(
+            "test_latency_seconds",
+            "Latency.",
+            label_names=("stage",),
+            buckets=(0.1, 1),
+        )
+    )
+
+    counter.inc(3)
+    gauge.set_function(lambda: 1)
+    histogram.labels(stage="insert").observe(0.05)
+    histogram.labels(stage="insert").observe(0.5)
+
+    lines = registry.render().splitlines()
+
+    assert "# TYPE test_messages_total counter" in lines
+    assert "test_messages_total 3" in lines
+    assert "test_alive 1" in lines
+    assert 'test_latency_seconds_bucket{stage="insert",le="0.1"} 1' in lines
+    assert 'test_latency_seconds_bucket{stage="insert",le="1"} 2' in lines
+    assert 'test_latency_seconds_bucket{stage="insert",le="+Inf"} 2' in lines
+    assert 'test_latency_seconds_count{stage="insert"} 2' in lines
+
+
+def test_unused_counter_is_exposed() -> None:
+    registry = Registry()
+    registry.register(Counter("test_unused_total", "Unused."))
+
+    assert "test_unused_total 0" in registry.render().splitlines()
+
+
+def test_bucket_quantile_interpolates_inside_buckets() -> None:
+    buckets = (0.1, 0.5, 1)
+    # 4 observations up to 0.1, 4 in (0.1, 0.5], 2 above 1
+    counts = [4, 4, 0, 2]
+
+    assert bucket_quantile(buckets, counts, 0.2) == 0.05
+    assert bucket_quantile(buckets, counts, 0.6) == pytest.approx(0.3)
+    assert bucket_quantile(buckets, counts, 0.99) == 1
+    assert bucket_quantile(buckets, [0, 0, 0, 0], 0.5) is None
@@ -0,0 +1,157 @@
+import functools
+import threading
+import time
+
+import pytest
+
+import pipeline
+from pipeline import ConsumerPipeline
+from polling import AdaptivePoller
+from scripts.fake_aws import FakeBroker
+
+
+class StubPostgresClient:
+    """
+    Stores the rows in memory, and lets the test hold or fail the inserts.
+    """
+
+    raw_body = True
+    schema_name, table_name, columns = "schema", "table", None
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.inserted = []
+        self.inserting = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def handle_messages(self, message_bodies):
+        return list(message_bodies)
+
+    def insert_data(self, schema_name, table_name, data, columns, strategy):
+        self.inserting.set()
+        self.release.wait()
+        if self.fail:
+            raise RuntimeError("insert failed")
+        self.inserted.extend(data)
+
+
+@pytest.fixture(autouse=True)
+def short_long_polls(monkeypatch):
+    # Short long polls, so that the receive stage sees the stop quickly
+    monkeypatch.setattr(
+        pipeline,
+        "AdaptivePoller",
+        functools.partial(AdaptivePoller, max_wait_time_seconds=1),
+    )
+
+
+@pytest.fixture
+def sqs_client():
+    return FakeBroker().client("sqs")
+
+
+@pytest.fixture
+def queue_url(sqs_client):
+    return sqs_client.create_queue(QueueName="pipeline-queue")["QueueUrl"]
+
+
+def send_messages(sqs_client, queue_url, nb_messages):
+    for i in range(nb_messages):
+        sqs_client.send_message(QueueUrl=queue_url, MessageBody=f"message-{i}")
+
+
+def queue_counts(sqs_client, queue_url):
+    attributes = sqs_client.get_queue_attributes(QueueUrl=queue_url)["Attributes"]
+    return (
+        int(attributes["ApproximateNumberOfMessages"]),
+        int(attributes["ApproximateNumberOfMessagesNotVisible"]),
+    )
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+def start(consumer):
+    thread = threading.Thread(target=consumer.run)
+    thread.start()
+    return thread
+
+
+def test_receive_overlaps_insert(sqs_client, queue_url) -> None:
+    send_messages(sqs_client, queue_url, 30)
+    postgres_client = StubPostgresClient()
+    postgres_client.release.clear()
+    consumer = ConsumerPipeline(postgres_client, sqs_client, queue_url)
+    thread = start(consumer)
+
+    assert postgres_client.inserting.wait(timeout=5)
+    # The first insert is still running, the next batches are already received
+    assert wait_until(lambda: queue_counts(sqs_client, queue_url) == (0, 30))
+
+    postgres_client.release.set()
+    assert wait_until(lambda: len(postgres_client.inserted) == 30)
+    assert wait_until(lambda: queue_counts(sqs_client, queue_url) == (0, 0))
+    consumer.stop()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+
+
+def test_full_stage_queues_stop_the_receives(sqs_client, queue_url) -> None:
+    send_messages(sqs_client, queue_url, 100)
+    postgres_client = StubPostgresClient()
+    postgres_client.release.clear()
+    consumer = ConsumerPipeline(postgres_client, sqs_client, queue_url, queue_size=1)
+    thread = start(consumer)
+
+    # One batch held by each stage and by each queue between them
+    assert wait_until(lambda: queue_counts(sqs_client, queue_url) == (50, 50))
+    time.sleep(0.5)
+    assert queue_counts(sqs_client, queue_url) == (50, 50)
+
+    postgres_client.release.set()
+    assert wait_until(lambda: len(postgres_client.inserted) == 100)
+    consumer.stop()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert queue_counts(sqs_client, queue_url) == (0, 0)
+
+
+def test_stop_drains_in_flight_batches(sqs_client, queue_url) -> None:
+    send_messages(sqs_client, queue_url, 50)
+    postgres_client = StubPostgresClient()
+    postgres_client.release.clear()
+    consumer = ConsumerPipeline(postgres_client, sqs_client, queue_url)
+    thread = start(consumer)
+    assert postgres_client.inserting.wait(timeout=5)
+    assert wait_until(lambda: queue_counts(sqs_client, queue_url) == (0, 50))
+
+    consumer.stop()
+    # The insert in progress commits after the stop
+    postgres_client.release.set()
+    thread.join(timeout=10)
+
+    assert not thread.is_alive()
+    assert len(postgres_client.inserted) == 10
+    # The committed batch is acked, the others are visible again at once
+    assert queue_counts(sqs_client, queue_url) == (40, 0)
+
+
+def test_failed_insert_makes_the_messages_visible_again(sqs_client, queue_url) -> None:
+    send_messages(sqs_client, queue_url, 20)
+    postgres_client = StubPostgresClient(fail=True)
+    consumer = ConsumerPipeline(postgres_client, sqs_client, queue_url)
+    thread = start(consumer)
+
+    # The failed stage stops the pipeline
+    thread.join(timeout=10)
+
+    assert not thread.is_alive()
+    assert postgres_client.inserted == []
+    assert queue_counts(sqs_client, queue_url) == (20, 0)
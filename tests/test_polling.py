@@ -0,0 +1,53 @@
+from config import MAX_NUMBER_OF_MESSAGES, POLLING_INTERVAL, WAIT_TIME_SECONDS
+from polling import AdaptivePoller
+
+
+def test_full_batches_poll_again_at_once() -> None:
+    poller = AdaptivePoller()
+    poller.record(MAX_NUMBER_OF_MESSAGES, elapsed=0.1)
+
+    assert poller.delay == 0
+    assert poller.receive_parameters() == {
+        "max_number_of_messages": MAX_NUMBER_OF_MESSAGES,
+        "wait_time_seconds": poller.min_wait_time_seconds,
+    }
+
+
+def test_empty_queue_backs_off_to_long_polling() -> None:
+    poller = AdaptivePoller()
+    poller.record(MAX_NUMBER_OF_MESSAGES, elapsed=0.1)
+
+    wait_times = []
+    for _ in range(10):
+        poller.record(0, elapsed=poller.wait_time_seconds)
+        wait_times.append(poller.wait_time_seconds)
+
+    assert wait_times == sorted(wait_times)
+    assert wait_times[-1] == WAIT_TIME_SECONDS
+    assert poller.delay == 0
+
+
+def test_low_arrival_rate_asks_for_fewer_messages() -> None:
+    poller = AdaptivePoller()
+    for _ in range(20):
+        poller.record(1, elapsed=0.1)
+
+    assert poller.max_number_of_messages < MAX_NUMBER_OF_MESSAGES
+
+    poller.record(poller.max_number_of_messages, elapsed=0.1)
+    assert poller.max_number_of_messages == MAX_NUMBER_OF_MESSAGES
+
+
+def test_failed_receive_does_not_spin() -> None:
+    poller = AdaptivePoller()
+    poller.record(0, elapsed=0.01)
+
+    assert poller.delay == POLLING_INTERVAL
+
+
+def test_capped_empty_receive_has_not_failed() -> None:
+    poller = AdaptivePoller()
+    # The caller asked for a zero-wait receive instead of the poller's wait
+    poller.record(0, elapsed=0.01, requested_wait=0)
+
+    assert poller.delay == 0
@@ -1,7 +1,12 @@
+import datetime
+import json
+
 import pytest
 
-from src.config import POSTGRES_URI
-from src.scripts.postgres import PostgresClient
+from extractors import PUBLISHED_AT, RECEIVED_AT, Field
+from src.config import POSTGRES_URI, RETENTION_DAYS
+from src.message import Message
+from src.scripts.postgres import Index, PostgresClient
 
 
 @pytest.fixture(scope="function")
@@ -78,3 +83,308 @@ def test_insert_data(postgres_client, strategy, data, expected):
     )
     assert check_name[0][0] == expected[1]
     assert nb_elements == expected[0]
+
+
+@pytest.mark.parametrize(
+    "strategy, expected",
+    [
+        ("skip", (2, "Alice")),
+        ("update", (2, 'John "Jr", Doe')),
+    ],
+)
+def test_insert_data_copy(postgres_client, monkeypatch, strategy, expected):
+    # Force the COPY path even for a small batch
+    monkeypatch.setattr("src.scripts.postgres.COPY_MIN_ROWS", 1)
+    columns = {"id": "INT PRIMARY KEY", "name": "VARCHAR(255)"}
+    schema_name = "test_schema"
+    table_name = "test_table"
+    postgres_client.get_or_create_table(
+        schema_name=schema_name, table_name=table_name, columns=columns
+    )
+
+    postgres_client.insert_data(
+        schema_name=schema_name,
+        table_name=table_name,
+        data=[(1, "Alice"), (2, None), (1, 'John "Jr", Doe')],
+        strategy=strategy,
+    )
+
+    nb_elements = postgres_client.count_elements(
+        schema_name=schema_name, table_name=table_name
+    )
+    rows = postgres_client.execute_query(
+        "SELECT id, name FROM test_schema.test_table ORDER BY id;"
+    )
+    assert nb_elements == expected[0]
+    assert rows == [(1, expected[1]), (2, None)]
+
+
+def test_handle_messages():
+    message_bodies = [
+        {"MessageId": str(i), "Message": json.dumps({"id": i, "closedAt": None})}
+        for i in range(3)
+    ]
+
+    message = Message(db_uri=POSTGRES_URI)
+    rows = message.handle_messages(message_bodies)
+
+    assert [row[0] for row in rows] == ["0", "1", "2"]
+    # One timestamp for the whole batch, in naive UTC
+    assert len({row[1] for row in rows}) == 1
+    utc_now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    assert abs(utc_now - rows[0][1]) < datetime.timedelta(seconds=5)
+    assert message.handle_message(message_bodies[0])[0][0] == "0"
+
+    class LegacyMessage(PostgresClient):
+        def handle_message(self, message_body):
+            return [(message_body["MessageId"],)]
+
+    rows = LegacyMessage(db_uri=POSTGRES_URI).handle_messages(message_bodies)
+    assert rows == [("0",), ("1",), ("2",)]
+
+
+@pytest.mark.parametrize("strategy", ["skip", "update"])
+@pytest.mark.parametrize("copy_min_rows", [1, 1000])
+def test_rollup(postgres_client, monkeypatch, copy_min_rows, strategy):
+    monkeypatch.setattr("src.scripts.postgres.COPY_MIN_ROWS", copy_min_rows)
+    postgres_client.rollup_column = "created_at"
+    columns = {"id": "INT PRIMARY KEY", "created_at": "TIMESTAMP"}
+    postgres_client.get_or_create_table(
+        schema_name="test_schema", table_name="test_table", columns=columns
+    )
+    rollup_sql = "SELECT minute::TEXT, count FROM test_schema.test_table_per_minute"
+
+    def insert(data):
+        postgres_client.insert_data(
+            schema_name="test_schema",
+            table_name="test_table",
+            data=data,
+            strategy=strategy,
+        )
+
+    insert([(1, "2024-01-01 10:00:05"), (2, "2024-01-01 10:00:59"), (3, None)])
+    # The duplicate of row 1 is not counted twice
+    insert([(1, "2024-01-01 10:00:05"), (4, "2024-01-01 10:01:00")])
+    expected = [
+        ("-infinity", 1),
+        ("2024-01-01 10:00:00", 2),
+        ("2024-01-01 10:01:00", 1),
+    ]
+    assert sorted(postgres_client.execute_query(rollup_sql)) == expected
+
+    # Rows backfilled without going through insert_data
+    postgres_client.execute_query(
+        "INSERT INTO test_schema.test_table VALUES (5, '2024-01-01 10:01:30');"
+    )
+    postgres_client.rebuild_rollup(schema_name="test_schema", table_name="test_table")
+    expected[2] = ("2024-01-01 10:01:00", 2)
+    assert sorted(postgres_client.execute_query(rollup_sql)) == expected
+
+    postgres_client.delete_data(
+        schema_name="test_schema", table_name="test_table", delete_column="created_at"
+    )
+    assert postgres_client.execute_query(rollup_sql) == [("-infinity", 1)]
+
+
+@pytest.mark.parametrize("copy_min_rows", [1, 1000])
+def test_rollup_follows_updates(postgres_client, monkeypatch, copy_min_rows):
+    monkeypatch.setattr("src.scripts.postgres.COPY_MIN_ROWS", copy_min_rows)
+    postgres_client.rollup_column = "closed_at"
+    columns = {"id": "INT PRIMARY KEY", "closed_at": "TIMESTAMP"}
+    postgres_client.get_or_create_table(
+        schema_name="test_schema", table_name="test_table", columns=columns
+    )
+    rollup_sql = (
+        "SELECT minute::TEXT, count FROM test_schema.test_table_per_minute "
+        "WHERE count <> 0"
+    )
+
+    def upsert(data):
+        postgres_client.insert_data(
+            schema_name="test_schema",
+            table_name="test_table",
+            data=data,
+            strategy="update",
+        )
+
+    upsert([(1, None), (2, None), (3, "2024-01-01 10:00:05")])
+    # Row 1 gets closed, row 3 moves to the next minute, row 2 is unchanged
+    upsert([(1, "2024-01-01 10:00:30"), (2, None), (3, "2024-01-01 10:01:05")])
+    assert sorted(postgres_client.execute_query(rollup_sql)) == [
+        ("-infinity", 1),
+        ("2024-01-01 10:00:00", 1),
+        ("2024-01-01 10:01:00", 1),
+    ]
+
+
+def test_partitioned_table(postgres_client):
+    postgres_client.partition_column = "created_at"
+    postgres_client.rollup_column = "created_at"
+    columns = {"id": "INT PRIMARY KEY", "created_at": "TIMESTAMP"}
+    postgres_client.get_or_create_table(
+        schema_name="test_schema", table_name="test_table", columns=columns
+    )
+    utc_now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    today = utc_now.date()
+    partitions = postgres_client.list_partitions("test_schema", "test_table")
+    assert min(partitions) == today
+    assert len(partitions) == 4
+
+    # A daily partition past the retention, and an old row in the default one
+    expired_day = today - datetime.timedelta(days=20)
+    postgres_client.execute_query(
+        f"CREATE TABLE test_schema.test_table_p{expired_day:%Y%m%d} "
+        f"PARTITION OF test_schema.test_table "
+        f"FOR VALUES FROM ('{expired_day}') TO ('{expired_day}'::DATE + 1);"
+    )
+    data = [
+        (1, utc_now),
+        (2, datetime.datetime.combine(expired_day, datetime.time(12))),
+        (3, utc_now - datetime.timedelta(days=100)),
+    ]
+    for _ in range(2):
+        postgres_client.insert_data(
+            schema_name="test_schema", table_name="test_table", data=data
+        )
+    assert postgres_client.count_elements("test_schema", "test_table") == 3
+
+    postgres_client.delete_data(
+        schema_name="test_schema", table_name="test_table", delete_column="created_at"
+    )
+
+    assert expired_day not in postgres_client.list_partitions(
+        "test_schema", "test_table"
+    )
+    assert postgres_client.execute_query("SELECT id FROM test_schema.test_table;") == [
+        (1,)
+    ]
+    assert postgres_client.execute_query(
+        "SELECT SUM(count) FROM test_schema.test_table_per_minute;"
+    ) == [(1,)]
+
+
+def test_retention_runs_on_the_database_utc_clock():
+    # A session time zone far from UTC must not move the retention cutoff
+    separator = "&" if "?" in POSTGRES_URI else "?"
+    client = PostgresClient(
+        db_uri=f"{POSTGRES_URI}{separator}options=-c%20TimeZone%3DPacific%2FKiritimati"
+    )
+    client.partition_column = "created_at"
+    columns = {"id": "INT PRIMARY KEY", "created_at": "TIMESTAMP"}
+    client.get_or_create_table(
+        schema_name="test_schema", table_name="test_table", columns=columns
+    )
+    utc_now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    assert min(client.list_partitions("test_schema", "test_table")) == utc_now.date()
+
+    cutoff = utc_now - datetime.timedelta(days=RETENTION_DAYS)
+    data = [
+        (1, cutoff - datetime.timedelta(hours=2)),
+        (2, cutoff + datetime.timedelta(hours=2)),
+    ]
+    client.insert_data(schema_name="test_schema", table_name="test_table", data=data)
+    client.delete_data(
+        schema_name="test_schema", table_name="test_table", delete_column="created_at"
+    )
+    assert client.execute_query("SELECT id FROM test_schema.test_table;") == [(2,)]
+    client.close()
+
+
+def test_partitioned_table_keeps_deduplication(postgres_client):
+    postgres_client.partition_column = "created_at"
+    columns = {"id": "INT PRIMARY KEY", "created_at": "TIMESTAMP"}
+    postgres_client.fields = {"id": Field("MessageId"), "created_at": RECEIVED_AT}
+    with pytest.raises(ValueError):
+        postgres_client.get_or_create_table(
+            schema_name="test_schema", table_name="test_table", columns=columns
+        )
+    assert not postgres_client.table_exists("test_schema", "test_table")
+
+    postgres_client.fields["created_at"] = PUBLISHED_AT
+    postgres_client.get_or_create_table(
+        schema_name="test_schema", table_name="test_table", columns=columns
+    )
+    with pytest.raises(ValueError):
+        postgres_client.insert_data(
+            schema_name="test_schema",
+            table_name="test_table",
+            data=[(1, datetime.datetime.now())],
+            strategy="update",
+        )
+
+
+@pytest.mark.parametrize("partitioned", [False, True])
+def test_reconcile_indexes(postgres_client, partitioned):
+    if partitioned:
+        postgres_client.partition_column = "created_at"
+    columns = {"id": "INT PRIMARY KEY", "created_at": "TIMESTAMP", "name": "VARCHAR"}
+    postgres_client.get_or_create_table(
+        schema_name="test_schema", table_name="test_table", columns=dict(columns)
+    )
+    postgres_client.execute_query(
+        "CREATE INDEX test_table_name_idx ON test_schema.test_table (name);"
+    )
+
+    # Declared on the existing table: built concurrently, partition by partition
+    postgres_client.indexes = [
+        Index("created_at", method="brin"),
+        Index("name", where="name IS NOT NULL"),
+    ]
+    postgres_client.get_or_create_table(
+        schema_name="test_schema", table_name="test_table", columns=dict(columns)
+    )
+    indexes = postgres_client.list_indexes("test_schema", "test_table")
+    assert set(indexes) == {
+        index.name("test_table") for index in postgres_client.indexes
+    }
+    assert all(indexes.values())
+    if partitioned:
+        # One index per partition, attached to the index of the table
+        nb_partitions, nb_attached = postgres_client.execute_query(
+            "SELECT COUNT(*) FILTER (WHERE inhparent = 'test_schema.test_table'"
+            "::regclass), COUNT(*) FILTER (WHERE inhparent = "
+            "'test_schema.test_table_created_at_brin_idx'::regclass) "
+            "FROM pg_inherits;"
+        )[0]
+        assert nb_partitions == nb_attached == 5
+
+    postgres_client.indexes = postgres_client.indexes[:1]
+    postgres_client.reconcile_indexes("test_schema", "test_table")
+    assert list(postgres_client.list_indexes("test_schema", "test_table")) == [
+        "test_table_created_at_brin_idx"
+    ]
+    # Indexes not created from the declarations are left alone
+    assert postgres_client.execute_query(
+        "SELECT indexname FROM pg_indexes WHERE indexname = 'test_table_name_idx';"
+    ) == [("test_table_name_idx",)]
+
+
+@pytest.mark.parametrize("partitioned", [False, True])
+def test_reconcile_rebuilds_invalid_indexes(postgres_client, partitioned):
+    if partitioned:
+        postgres_client.partition_column = "created_at"
+    columns = {"id": "INT PRIMARY KEY", "created_at": "TIMESTAMP"}
+    postgres_client.get_or_create_table(
+        schema_name="test_schema", table_name="test_table", columns=columns
+    )
+    # A build interrupted before the comment was set: left invalid
+    postgres_client.indexes = [Index("created_at", method="brin")]
+    name = postgres_client.indexes[0].name("test_table")
+    if partitioned:
+        # Created ON ONLY the table, none of its partitions attached yet
+        postgres_client.execute_query(
+            f"CREATE INDEX {name} ON ONLY test_schema.test_table "
+            f"USING brin (created_at);"
+        )
+    else:
+        postgres_client.execute_query(
+            f"CREATE INDEX {name} ON test_schema.test_table USING brin (created_at);"
+            f"UPDATE pg_index SET indisvalid = false "
+            f"WHERE indexrelid = 'test_schema.{name}'::regclass;"
+        )
+    assert postgres_client.list_indexes("test_schema", "test_table", [name]) == {
+        name: False
+    }
+
+    postgres_client.reconcile_indexes("test_schema", "test_table")
+    assert postgres_client.list_indexes("test_schema", "test_table") == {name: True}
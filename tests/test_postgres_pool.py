@@ -0,0 +1,49 @@
+import pytest
+from psycopg2.pool import PoolError
+
+from src.config import POSTGRES_URI
+from src.scripts.postgres_pool import ConnectionPool
+
+
+@pytest.fixture(scope="function")
+def pool():
+    pool = ConnectionPool(
+        db_uri=POSTGRES_URI, min_size=1, max_size=2, checkout_timeout=0.2
+    )
+    yield pool
+    pool.close()
+
+
+def test_pool_reuses_connections(pool):
+    with pool.connection() as connection:
+        first_pid = connection.get_backend_pid()
+    with pool.connection() as connection:
+        assert connection.get_backend_pid() == first_pid
+
+
+def test_pool_max_size(pool):
+    first = pool.getconn()
+    second = pool.getconn()
+    with pytest.raises(PoolError):
+        pool.getconn()
+    pool.putconn(first)
+    pool.putconn(second)
+
+
+def test_pool_discards_closed_connections(pool):
+    connection = pool.getconn()
+    connection.close()
+    pool.putconn(connection)
+    with pool.connection() as connection:
+        assert not connection.closed
+
+
+def test_pool_recycles_idle_connections(pool):
+    pool.max_idle = 0
+    first = pool.getconn()
+    second = pool.getconn()
+    pool.putconn(first)
+    pool.putconn(second)
+    with pool.connection():
+        # Idle connections above min_size have been closed
+        assert pool._size == pool.min_size
@@ -0,0 +1,137 @@
+import threading
+import time
+
+from producer_engine import ProducerEngine, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept += seconds
+        self.now += seconds
+
+
+class StubSNSClient:
+    """
+    Records the publish calls and how many of them ran at the same time.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.messages = []
+        self.batches = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def _call(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.latency)
+        with self._lock:
+            self.in_flight -= 1
+
+    def publish(self, **kwargs):
+        self._call()
+        with self._lock:
+            self.messages.append(kwargs["Message"])
+        return {"MessageId": kwargs["Message"]}
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries):  # noqa: N803
+        self._call()
+        with self._lock:
+            self.batches.append(PublishBatchRequestEntries)
+        return {
+            "Successful": [
+                {"Id": entry["Id"], "MessageId": entry["Message"]}
+                for entry in PublishBatchRequestEntries
+            ]
+        }
+
+
+def make_messages(nb_messages):
+    return [{"message_body": f"message {i}"} for i in range(nb_messages)]
+
+
+def test_token_bucket_refills_at_its_rate(monkeypatch) -> None:
+    clock = FakeClock()
+    monkeypatch.setattr("producer_engine.time", clock)
+    bucket = TokenBucket(rate=10, capacity=5)
+
+    # The bucket starts empty: every token is waited for
+    for _ in range(5):
+        bucket.acquire()
+    assert abs(clock.slept - 0.5) < 1e-9
+
+    # Idle time refills the bucket up to its capacity only
+    clock.now += 60
+    clock.slept = 0
+    for _ in range(7):
+        bucket.acquire()
+    assert abs(clock.slept - 0.2) < 1e-9
+
+
+def test_token_bucket_without_rate_does_not_wait(monkeypatch) -> None:
+    clock = FakeClock()
+    monkeypatch.setattr("producer_engine.time", clock)
+    bucket = TokenBucket(rate=0)
+    for _ in range(100):
+        bucket.acquire()
+    assert clock.slept == 0
+
+
+def test_publishes_in_flight_are_capped() -> None:
+    sns_client = StubSNSClient(latency=0.02)
+    engine = ProducerEngine(sns_client, "topic", rate=0, max_in_flight=3, num_threads=8)
+
+    report = engine.run(make_messages(30))
+
+    assert sns_client.max_in_flight == 3
+    assert report["sent"] == 30
+    assert report["failed"] == 0
+
+
+def test_run_flushes_the_last_partial_batch() -> None:
+    sns_client = StubSNSClient(latency=0.01)
+    engine = ProducerEngine(sns_client, "topic", rate=0, batch_size=4)
+
+    report = engine.run(make_messages(100), nb_messages=10)
+
+    # Every publish is done when run returns, the last batch holds 2 messages
+    assert sns_client.in_flight == 0
+    assert sorted(len(batch) for batch in sns_client.batches) == [2, 4, 4]
+    assert report["sent"] == 10
+
+
+def test_failed_publishes_are_reported() -> None:
+    class FailingSNSClient(StubSNSClient):
+        def publish(self, **kwargs):
+            raise RuntimeError("throttled")
+
+    engine = ProducerEngine(FailingSNSClient(), "topic", rate=0)
+
+    report = engine.run(make_messages(5))
+
+    assert report["sent"] == 0
+    assert report["failed"] == 5
+
+
+def test_batched_publishes_in_flight_are_capped() -> None:
+    sns_client = StubSNSClient(latency=0.02)
+    engine = ProducerEngine(
+        sns_client, "topic", rate=0, max_in_flight=2, num_threads=8, batch_size=3
+    )
+
+    report = engine.run(make_messages(30))
+
+    assert sns_client.max_in_flight == 2
+    assert [len(batch) for batch in sns_client.batches] == [3] * 10
+    assert report["sent"] == 30
+    assert report["failed"] == 0
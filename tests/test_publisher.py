@@ -0,0 +1,105 @@
+import json
+import time
+
+import pytest
+
+from publisher import BatchPublisher
+from scripts.fake_aws import FakeBroker
+
+
+class RecordingSNSClient:
+    """
+    Fake broker client that records the size of each PublishBatch call.
+    """
+
+    def __init__(self, sns_client):
+        self.sns_client = sns_client
+        self.batches = []
+
+    def __getattr__(self, name):
+        return getattr(self.sns_client, name)
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries):  # noqa: N803
+        self.batches.append(len(PublishBatchRequestEntries))
+        return self.sns_client.publish_batch(
+            TopicArn=TopicArn, PublishBatchRequestEntries=PublishBatchRequestEntries
+        )
+
+
+@pytest.fixture
+def broker():
+    return FakeBroker()
+
+
+@pytest.fixture
+def topic(broker):
+    sns_client = broker.client("sns")
+    topic_arn = sns_client.create_topic(Name="publisher-topic")["TopicArn"]
+    return RecordingSNSClient(sns_client), topic_arn
+
+
+def subscribed_queue(broker, topic_arn):
+    sqs_client = broker.client("sqs")
+    queue_url = sqs_client.create_queue(QueueName="publisher-queue")["QueueUrl"]
+    queue_arn = sqs_client.get_queue_attributes(
+        QueueUrl=queue_url, AttributeNames=["QueueArn"]
+    )["Attributes"]["QueueArn"]
+    broker.client("sns").subscribe(
+        TopicArn=topic_arn, Protocol="sqs", Endpoint=queue_arn
+    )
+    return sqs_client, queue_url
+
+
+def test_full_batches_are_sent_at_once(broker, topic) -> None:
+    sns_client, topic_arn = topic
+    sqs_client, queue_url = subscribed_queue(broker, topic_arn)
+    publisher = BatchPublisher(sns_client, topic_arn, max_linger=60, batch_size=3)
+
+    futures = [publisher.publish(f"message {i}") for i in range(7)]
+
+    # Two full batches went out without waiting for the linger
+    assert sns_client.batches == [3, 3]
+    assert all(future.done() for future in futures[:6])
+    assert not futures[6].done()
+    publisher.close()
+
+    received = sqs_client.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10)
+    assert sorted(
+        json.loads(message["Body"])["Message"] for message in received["Messages"]
+    ) == [f"message {i}" for i in range(7)]
+
+
+def test_partial_batch_is_sent_after_the_linger(topic) -> None:
+    sns_client, topic_arn = topic
+    with BatchPublisher(sns_client, topic_arn, max_linger=0.2) as publisher:
+        start = time.monotonic()
+        futures = [publisher.publish(f"message {i}") for i in range(2)]
+
+        message_ids = [future.result(timeout=2) for future in futures]
+        waited = time.monotonic() - start
+
+    assert all(message_ids)
+    assert sns_client.batches == [2]
+    # Sent by the linger thread, which checks every half linger
+    assert 0.2 <= waited < 0.5
+
+
+def test_close_flushes_the_buffered_messages(topic) -> None:
+    sns_client, topic_arn = topic
+    publisher = BatchPublisher(sns_client, topic_arn, max_linger=60)
+    futures = [publisher.publish(f"message {i}") for i in range(3)]
+    assert sns_client.batches == []
+
+    publisher.close()
+
+    assert sns_client.batches == [3]
+    assert all(future.result(timeout=0) for future in futures)
+    with pytest.raises(RuntimeError):
+        publisher.publish("late message")
+
+
+@pytest.mark.parametrize("max_linger", [0, -1])
+def test_linger_must_be_positive(topic, max_linger) -> None:
+    sns_client, topic_arn = topic
+    with pytest.raises(ValueError):
+        BatchPublisher(sns_client, topic_arn, max_linger=max_linger)
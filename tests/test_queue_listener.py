@@ -0,0 +1,93 @@
+import functools
+import json
+import threading
+import time
+
+import pytest
+
+import queue_listener
+from config import POSTGRES_URI
+from polling import AdaptivePoller
+from scripts.fake_aws import FakeSQSClient
+from setup import initialize_aws_setup, initialize_postgres_client
+from simple_message import SimpleMessage
+from utils import send_messages_to_topic
+
+
+class PoolMessage(SimpleMessage):
+    def __init__(self, db_uri):
+        super().__init__(db_uri=db_uri)
+        self.schema_name, self.table_name = "test_schema", "test_pool"
+
+
+@pytest.fixture
+def postgres_client():
+    client = initialize_postgres_client(postgres=PoolMessage, db_uri=POSTGRES_URI)
+    yield client
+    client.delete_table(schema_name="test_schema", table_name="test_pool")
+    client.close()
+
+
+def test_thread_workers_consume_each_message_once(postgres_client, monkeypatch) -> None:
+    monkeypatch.setenv("FAKE_AWS", "1")
+    # Short long polls, so that the workers see the stop quickly
+    monkeypatch.setattr(
+        queue_listener,
+        "AdaptivePoller",
+        functools.partial(AdaptivePoller, max_wait_time_seconds=1),
+    )
+    deleted = []
+    delete_message_batch = FakeSQSClient.delete_message_batch
+
+    def recording_delete(self, QueueUrl, Entries):  # noqa: N803
+        deleted.extend(entry["ReceiptHandle"].split("#")[0] for entry in Entries)
+        return delete_message_batch(self, QueueUrl=QueueUrl, Entries=Entries)
+
+    monkeypatch.setattr(FakeSQSClient, "delete_message_batch", recording_delete)
+    sns_client, sqs_client, topic_arn, queue_url = initialize_aws_setup(
+        role=None,
+        session_name=None,
+        topic_name="pool-topic",
+        queue_name="pool-queue",
+        manifest_path=None,
+    )
+    nb_messages = 200
+    send_messages_to_topic(
+        sns_client,
+        topic_arn,
+        [{"message_body": json.dumps({"id": i})} for i in range(nb_messages)],
+    )
+
+    stop_event = threading.Event()
+    pool = threading.Thread(
+        target=queue_listener.consumer_pool,
+        kwargs={
+            "postgres": PoolMessage,
+            "queue_url": queue_url,
+            "num_workers": 4,
+            "worker_mode": "thread",
+            "role": None,
+            "session_name": None,
+            "consumer_mode": "loop",
+            "stop_event": stop_event,
+        },
+    )
+    pool.start()
+    deadline = time.monotonic() + 20
+    while len(deleted) < nb_messages and time.monotonic() < deadline:
+        time.sleep(0.05)
+    stop_event.set()
+    pool.join(timeout=10)
+
+    assert not pool.is_alive()
+    assert not [
+        thread.name
+        for thread in threading.enumerate()
+        if thread.name.startswith("consumer-worker")
+    ]
+    assert postgres_client.count_elements("test_schema", "test_pool") == nb_messages
+    # Every message acked once, by SQS message ID
+    assert len(deleted) == len(set(deleted)) == nb_messages
+    attributes = sqs_client.get_queue_attributes(QueueUrl=queue_url)["Attributes"]
+    assert attributes["ApproximateNumberOfMessages"] == "0"
+    assert attributes["ApproximateNumberOfMessagesNotVisible"] == "0"
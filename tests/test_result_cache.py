@@ -0,0 +1,46 @@
+from result_cache import ResultCache, cached_result
+
+
+def test_entries_expire_after_ttl(monkeypatch) -> None:
+    now = [100.0]
+    monkeypatch.setattr("result_cache.time.monotonic", lambda: now[0])
+    cache = ResultCache(maxsize=2, ttl=5)
+    cache.put("a", 1, "rows")
+
+    now[0] += 4
+    assert cache.get("a", 1) == "rows"
+    now[0] += 1
+    assert cache.get("a", 1) is None
+
+
+def test_least_recently_read_entry_is_evicted() -> None:
+    cache = ResultCache(maxsize=2, ttl=60)
+    cache.put("a", 1, "a")
+    cache.put("b", 1, "b")
+    cache.get("a", 1)
+    cache.put("c", 1, "c")
+
+    assert cache.get("a", 1) == "a"
+    assert cache.get("b", 1) is None
+    assert cache.get("c", 1) == "c"
+
+
+def test_new_data_version_invalidates_results() -> None:
+    class Consumer:
+        schema_name, table_name = "public", "messages"
+        version, nb_queries = 0, 0
+
+        def data_version(self, schema_name, table_name):
+            return self.version
+
+        @cached_result(ResultCache(maxsize=8, ttl=60))
+        def aggregate(self):
+            self.nb_queries += 1
+            return [("2024-01-01 10:00", self.nb_queries)]
+
+    consumer = Consumer()
+    assert consumer.aggregate() == consumer.aggregate() == [("2024-01-01 10:00", 1)]
+
+    consumer.version = 1
+    assert consumer.aggregate() == [("2024-01-01 10:00", 2)]
+    assert consumer.nb_queries == 2
@@ -0,0 +1,116 @@
+import datetime
+import time
+
+import pytest
+
+from src.config import POSTGRES_URI
+from src.retention import RetentionScheduler
+from src.scripts.postgres import PostgresClient
+
+
+class RetentionClient(PostgresClient):
+    def __init__(self, db_uri):
+        super().__init__(db_uri=db_uri)
+        self.schema_name, self.table_name = "test_schema", "test_retention"
+        self.delete_column = self.rollup_column = "created_at"
+        self.columns = {"id": "INT PRIMARY KEY", "created_at": "TIMESTAMP"}
+
+
+@pytest.fixture
+def postgres_client():
+    client = RetentionClient(db_uri=POSTGRES_URI)
+    client.delete_table(schema_name="test_schema", table_name="test_retention")
+    yield client
+    client.delete_table(schema_name="test_schema", table_name="test_retention")
+    client.close()
+
+
+def test_expired_rows_are_deleted_by_chunks(postgres_client) -> None:
+    postgres_client.get_or_create_table(
+        "test_schema", "test_retention", dict(postgres_client.columns)
+    )
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    expired = now - datetime.timedelta(days=30)
+    postgres_client.insert_data(
+        schema_name="test_schema",
+        table_name="test_retention",
+        data=[(i, expired if i < 25 else now) for i in range(30)],
+    )
+    scheduler = RetentionScheduler(RetentionClient, chunk_size=10, pause=0)
+
+    assert scheduler.run_once() == 25
+    assert postgres_client.count_elements("test_schema", "test_retention") == 5
+    assert postgres_client.execute_query(
+        "SELECT SUM(count) FROM test_schema.test_retention_per_minute;"
+    ) == [(5,)]
+    scheduler.stop()
+
+
+def test_pause_follows_insert_latency(monkeypatch) -> None:
+    scheduler = RetentionScheduler(
+        RetentionClient, pause=0.1, max_pause=0.4, latency_target=0.25
+    )
+    totals = iter([(1.0, 2), (3.0, 4), (5.0, 6), (5.2, 8), (5.2, 8)])
+    monkeypatch.setattr(scheduler._insert_latency, "totals", lambda: next(totals))
+    scheduler._insert_totals = (0.0, 0)
+
+    pauses = []
+    for _ in range(5):
+        scheduler._adapt_pause()
+        pauses.append(scheduler.pause)
+
+    # Slow inserts double the pause up to the maximum, fast ones halve it
+    assert pauses == [0.2, 0.4, 0.4, 0.2, 0.2]
+
+
+def test_fixed_pause_without_adaptive_pacing(monkeypatch) -> None:
+    # Consumer workers in other processes: their inserts are not seen here
+    scheduler = RetentionScheduler(RetentionClient, pause=0.1, adaptive=False)
+    totals = iter([(1.0, 2), (3.0, 4)])
+    monkeypatch.setattr(scheduler._insert_latency, "totals", lambda: next(totals))
+
+    scheduler._adapt_pause()
+    assert scheduler.pause == 0.1
+
+
+def test_replicas_take_turns(postgres_client) -> None:
+    postgres_client.get_or_create_table(
+        "test_schema", "test_retention", dict(postgres_client.columns)
+    )
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    postgres_client.insert_data(
+        schema_name="test_schema",
+        table_name="test_retention",
+        data=[(1, now - datetime.timedelta(days=30))],
+    )
+    scheduler = RetentionScheduler(RetentionClient, pause=0)
+
+    # Another replica runs the retention of the same table
+    replica = PostgresClient(db_uri=POSTGRES_URI)
+    with replica.advisory_lock("retention test_schema.test_retention") as locked:
+        assert locked
+        assert scheduler.run_once() == 0
+    assert scheduler.run_once() == 1
+    replica.close()
+    scheduler.stop()
+
+
+def test_starts_without_the_database(monkeypatch) -> None:
+    connections = []
+
+    class UnreachableClient(RetentionClient):
+        def __init__(self, db_uri):
+            connections.append(db_uri)
+            raise ConnectionError("database is down")
+
+    scheduler = RetentionScheduler(UnreachableClient, interval=0.05)
+    # Nothing connects before the first run, in the scheduler thread
+    assert connections == []
+
+    scheduler.start()
+    time.sleep(0.3)
+
+    # Failed runs are logged and retried on the next interval
+    assert len(connections) > 1
+    assert scheduler._thread.is_alive()
+    scheduler.stop()
@@ -2,7 +2,7 @@ import pytest
 
 from config import AWS_ARN_ROLE_CONSUMER
 from setup import initialize_aws_setup
-from utils import send_message_to_topic
+from utils import send_message_to_topic, send_messages_to_topic
 
 session_name = "test_session_producer"
 topic_name = "test_topic_producer"
@@ -45,3 +45,23 @@ def test_sns_response(message_body, subject, message_attributes) -> None:
         "Failed to send message to SNS topic"
     )
     assert response["MessageId"] is not None, "Message ID is missing in the response"
+
+
+def test_sns_publish_batch() -> None:
+    sns_client, sqs_client, topic_arn, queue_url = initialize_aws_setup(
+        role=AWS_ARN_ROLE_CONSUMER,
+        session_name=session_name,
+        topic_name=topic_name,
+        queue_name=queue_name,
+    )
+    messages = [
+        {"message_body": f"Batch message {i}", "subject": f"Batch Subject {i}"}
+        for i in range(25)
+    ]
+
+    message_ids = send_messages_to_topic(
+        sns_client=sns_client, topic_arn=topic_arn, messages=messages
+    )
+
+    assert len(message_ids) == len(messages)
+    assert all(message_ids), "Some messages were not published"
@@ -0,0 +1,71 @@
+import time
+
+from config import VISIBILITY_TIMEOUT
+from visibility import VisibilityManager
+
+
+class StubSQSClient:
+    def __init__(self, failed_ids=()):
+        self.calls = []
+        self.failed_ids = failed_ids
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):  # noqa: N803
+        self.calls.append(Entries)
+        return {
+            "Successful": [{"Id": e["Id"]} for e in Entries],
+            "Failed": [
+                {"Id": i, "Code": "ReceiptHandleIsInvalid"} for i in self.failed_ids
+            ],
+        }
+
+
+def make_messages(nb_messages):
+    return [{"ReceiptHandle": f"handle-{i}"} for i in range(nb_messages)]
+
+
+def test_extend_due_messages() -> None:
+    sqs_client = StubSQSClient()
+    manager = VisibilityManager(sqs_client=sqs_client, queue_url="queue")
+    messages = make_messages(15)
+
+    # Received long enough ago to be close to their deadline
+    manager.track(messages, received_at=time.monotonic() - VISIBILITY_TIMEOUT + 1)
+
+    assert manager.extend_due() == 15
+    assert [len(entries) for entries in sqs_client.calls] == [10, 5]
+    assert sqs_client.calls[0][0]["VisibilityTimeout"] == VISIBILITY_TIMEOUT
+    # Deadlines have been pushed back, nothing is due anymore
+    assert manager.extend_due() == 0
+
+
+def test_released_messages_are_not_extended() -> None:
+    sqs_client = StubSQSClient()
+    manager = VisibilityManager(sqs_client=sqs_client, queue_url="queue")
+    messages = make_messages(3)
+    manager.track(messages, received_at=time.monotonic() - VISIBILITY_TIMEOUT)
+
+    manager.release(messages)
+
+    assert manager.extend_due() == 0
+    assert len(manager) == 0
+
+
+def test_abandon_returns_messages_immediately() -> None:
+    sqs_client = StubSQSClient()
+    manager = VisibilityManager(sqs_client=sqs_client, queue_url="queue")
+    messages = make_messages(3)
+    manager.track(messages)
+
+    manager.abandon(messages)
+
+    assert len(manager) == 0
+    assert [e["VisibilityTimeout"] for e in sqs_client.calls[0]] == [0, 0, 0]
+
+
+def test_failed_extensions_stop_being_tracked() -> None:
+    sqs_client = StubSQSClient(failed_ids=["0"])
+    manager = VisibilityManager(sqs_client=sqs_client, queue_url="queue")
+    manager.track(make_messages(2), received_at=time.monotonic() - VISIBILITY_TIMEOUT)
+
+    assert manager.extend_due() == 1
+    assert len(manager) == 1